@@ -21,6 +21,9 @@ class NoSuchEndpoint(APIError):
 class BadRequestParams(APIError):
     code = 400
 
+class RequestTooLarge(BadRequestParams):
+    code = 413
+
 class BadResponseParams(APIError):
     code = 500
 
@@ -29,3 +32,25 @@ class AuthenticationRequired(BadRequestParams):
 
 class AuthenticationFailed(BadRequestParams):
     code = 403
+
+class ServiceUnavailable(APIError):
+    code = 503
+
+    def __init__(self, message, code=None, retryAfter=None):
+        """
+        @param retryAfter: How many seconds the client should wait before
+            trying again, sent in the C{Retry-After} header.
+        """
+        self.retryAfter = retryAfter
+        super(ServiceUnavailable, self).__init__(message, code)
+
+class TooManyRequests(BadRequestParams):
+    code = 429
+
+    def __init__(self, message, code=None, retryAfter=None):
+        """
+        @param retryAfter: How many seconds the client should wait before
+            trying again, sent in the C{Retry-After} header.
+        """
+        self.retryAfter = retryAfter
+        super(TooManyRequests, self).__init__(message, code)
@@ -1,10 +1,22 @@
-from twisted.internet.defer import maybeDeferred, Deferred
+from twisted.internet.defer import maybeDeferred, Deferred, CancelledError
 from twisted.python import log, filepath
 from twisted.python.failure import Failure
 from twisted.web.resource import Resource
 import twisted
 
 from saratoga.test.requestMock import _testItem as testItem
+from saratoga.routing import Router
+from saratoga.cache import ResponseCache
+from saratoga.signatures import parseSignatureHeader
+from saratoga.metrics import MetricsResource
+from saratoga.batch import BatchResource
+from saratoga.timing import RequestTimer, reportTiming
+from saratoga.limits import (
+    ConcurrencyLimiter, RateLimiter, BodySizeLimitedSite)
+from saratoga.threadpools import BlockingPool, DEFAULT_POOL_SIZE
+from saratoga.processes import ProcessPool
+from saratoga import validation
+from saratoga.streaming import isStream, ChunkProducer
 from saratoga import (
     BadRequestParams,
     BadResponseParams,
@@ -12,8 +24,12 @@ from saratoga import (
     AuthenticationRequired,
     DoesNotExist,
     NoSuchEndpoint,
+    RequestTooLarge,
+    ServiceUnavailable,
     APIError,
+    inputFormats,
     outputFormats,
+    jsoncodec,
     __version__
 )
 
@@ -21,9 +37,11 @@ from saratoga import (
 DoesNotExist = DoesNotExist
 
 from base64 import b64decode
-from jsonschema import Draft4Validator
+from collections import namedtuple
+from functools import partial
+from math import ceil
+from urlparse import parse_qs
 
-import re
 import json
 
 
@@ -34,23 +52,76 @@ class DefaultServiceClass(object):
 
 
 
+Route = namedtuple("Route", ["api", "version", "processor",
+                             "requestValidator", "responseValidator",
+                             "cache", "limiter", "rateLimiter", "pool",
+                             "processPool",
+                             "func", "funcName"])
+
+
+
+def _isForm(request):
+    """
+    Does C{request} say that its body is form data?
+    """
+    contentType = request.getHeader("Content-Type") or ""
+    return contentType.split(";", 1)[0].strip().lower() == \
+        "application/x-www-form-urlencoded"
+
+
+
 class SaratogaResource(Resource):
     isLeaf = True
 
     def __init__(self, api):
         self.api = api
 
-    def render(self, request):
+    def render(self, request, authenticated=None):
         """
         Render a response to this Saratoga server.
+
+        @param authenticated: The auth params that C{request} has already
+            been authenticated with (such as by the batch it is part of), or
+            C{None} to authenticate it from its C{Authorization} header.
         """
         # Some vars we'll need later
         args, api, version, processor = ({}, None, None, {})
+        responseValidator = None
         method = request.method.upper()
+        metrics = self.api.metrics
+        # Methods we don't serve are all recorded as one, so that made up
+        # ones can't make the metrics grow
+        methodLabel = method if method in self.api.endpoints else "other"
+
+        if metrics is not None:
+            started = self.api.reactor.seconds()
+
+            def _recordMetrics(_):
+                metrics.record(methodLabel, version,
+                               api["endpoint"] if api else None,
+                               request.code,
+                               self.api.reactor.seconds() - started)
+
+            request.notifyFinish().addBoth(_recordMetrics)
+
+        timer = None
+
+        if self.api.timingHooks:
+            timer = RequestTimer(self.api.reactor)
+
+            def _reportTiming(_):
+                timer.mark("write")
+                reportTiming(self.api.timingHooks, methodLabel, version,
+                             api["endpoint"] if api else None, timer.phases)
+
+            request.notifyFinish().addBoth(_reportTiming)
 
         # Figure out what output format we're going to be using
         outputFormat = self.api.outputRegistry.getFormat(request)
 
+        if timer:
+            timer.mark("negotiate")
+
         if not outputFormat:
             # If there's no output format, return 406 Not Acceptable, as they
             # have asked for something we can't give them
@@ -61,53 +132,155 @@ class SaratogaResource(Resource):
             return 1
 
         # Set the content type according to what was given before
-        request.setHeader("Content-Type", outputFormat + "; charset=utf-8")
+        request.setHeader("Content-Type",
+                          self.api.outputRegistry.getContentType(outputFormat))
         # Say who we are!
         request.setHeader("Server", "Saratoga {} on Twisted {}".format(
                 __version__, twisted.__version__))
 
-        def _write(result):
+        compression = self.api.compression
+        encoding = None
+
+        if compression is not None:
+            # Caches in between need to know that it depends on this
+            request.setHeader("Vary", "Accept-Encoding")
+            encoding = compression.negotiate(request)
+
+        def _send(contentEncoding, body):
+            """
+            Write a whole, serialised response.
             """
-            Serialise and write a successful result.
+            if contentEncoding is not None:
+                request.setHeader("Content-Encoding", contentEncoding)
+            else:
+                # A stream that failed before writing anything may have said
+                # it would be compressed
+                request.responseHeaders.removeHeader("Content-Encoding")
+
+            request.write(body)
+            request.finish()
+
+        def _encode(body):
+            """
+            Compress a serialised response, if that was negotiated.
+            """
+            if encoding is None:
+                return None, body
+
+            result = compression.encode(encoding, body)
+
+            if timer:
+                timer.mark("compress")
+
+            return result
+
+        def _write(result, cacheKey=None):
+            """
+            Serialise and write a successful result, caching it under
+            C{cacheKey} if it's given.
             """
             if result is None:
                 result = {}
 
-            schema = processor.get("responseSchema")
+            if isStream(result):
+                return _writeStream(result)
 
-            if schema:
-                v = Draft4Validator(schema)
-                errors = sorted(v.iter_errors(result), key=lambda e: e.path)
+            if responseValidator:
+                errors = responseValidator.check(result)
 
                 if errors:
-                    raise BadResponseParams(
-                        ", ".join(e.message for e in errors))
+                    raise BadResponseParams(errors)
+
+                if timer:
+                    timer.mark("validateResponse")
 
             finishedResult = self.api.outputRegistry.renderAutomaticResponse(
-                request, "success", result)
+                request, "success", result, outputFormat)
+
+            if timer:
+                timer.mark("serialise")
+
+            response = _encode(finishedResult)
+
+            if cacheKey is not None and request.code == 200:
+                # Keep what was actually sent, so it isn't compressed again,
+                # and the headers the implementation set along with it
+                headers = [
+                    (name, list(values)) for name, values
+                    in request.responseHeaders.getAllRawHeaders()]
+                cache.set(cacheKey, (outputFormat, encoding),
+                          (headers, response))
+
+            _send(*response)
+
+
+        def _writeStream(items):
+            """
+            Serialise and write a successful result that is an iterator, a
+            chunk at a time.
+            """
+            itemValidator = responseValidator and responseValidator.forItems()
+
+            if itemValidator:
+                # Only the items need checking, which can be done without
+                # having all of them
+                items = validation.checkItems(items, itemValidator)
+            elif responseValidator:
+                # The schema needs the whole list, so it can't be streamed
+                # until all of it has been checked
+                items = list(items)
+                errors = responseValidator.check(items)
+
+                if errors:
+                    raise BadResponseParams(errors)
+
+                if timer:
+                    timer.mark("validateResponse")
+
+            chunks = self.api.outputRegistry.renderStreamingResponse(
+                request, "success", items, outputFormat)
+
+            if encoding is not None:
+                request.setHeader("Content-Encoding", encoding)
+                chunks = compression.encodeChunks(encoding, chunks)
+
+            return ChunkProducer(request, chunks).start()
 
-            request.write(finishedResult)
-            request.finish()
 
+        # Whether the request gave up its place in the limiter's queue
+        abandoned = []
 
         def _error(failure):
             """
             Something's gone wrong, write out an error.
             """
+            if abandoned and failure.check(CancelledError):
+                # The request was lost while it waited for a turn, so there's
+                # no one to answer
+                return
+
             error = failure.value
             errorcode = 500
 
-            if not isinstance(error, BadRequestParams):
+            if timer:
+                timer.mark("error")
+
+            if not isinstance(error, (BadRequestParams, ServiceUnavailable)):
                 log.err(failure)
             if hasattr(error, "code"):
                 errorcode = error.code
 
             request.setResponseCode(errorcode)
 
+            retryAfter = getattr(error, "retryAfter", None)
+
+            if retryAfter is not None:
+                request.setHeader("Retry-After", str(int(ceil(retryAfter))))
+
             if errorcode == 500:
                 errstatus = "error"
                 errmessage = "Internal server error."
-            elif isinstance(error, NoSuchEndpoint):
+            elif isinstance(error, (NoSuchEndpoint, ServiceUnavailable)):
                 errstatus = "error"
                 errmessage = error.message
             else:
@@ -115,10 +288,9 @@ class SaratogaResource(Resource):
                 errmessage = error.message
 
             finishedResult = self.api.outputRegistry.renderAutomaticResponse(
-                request, errstatus, errmessage)
+                request, errstatus, errmessage, outputFormat)
 
-            request.write(finishedResult)
-            request.finish()
+            _send(*_encode(finishedResult))
 
 
         def _runAPICall(authParams):
@@ -126,8 +298,59 @@ class SaratogaResource(Resource):
             Run the function that we've looked up.
             """
             userParams["auth"] = authParams
-            return maybeDeferred(func, self.api.serviceClass, request,
-                                 userParams, *args)
+
+            if processPool is not None:
+                d = processPool.run(version, funcName, userParams, args)
+            elif pool is not None:
+                d = pool.run(func, self.api.serviceClass, request,
+                             userParams, *args)
+            else:
+                d = maybeDeferred(func, self.api.serviceClass, request,
+                                  userParams, *args)
+
+            if timer:
+                d.addCallback(timer.markResult, "implementation")
+
+            return d
+
+        def _rateLimit(authParams):
+            """
+            Count this call against the rate limit of whoever made it, which
+            is their client address if they didn't authenticate.
+            """
+            if authParams:
+                rateLimiter.take(authParams["username"])
+            else:
+                # Addresses that aren't IP ones, like UNIX sockets', have no
+                # host
+                address = request.getClientAddress()
+                rateLimiter.take(getattr(address, "host", address))
+
+            return authParams
+
+        def _runCachedAPICall(authParams):
+            """
+            Write the cached response for this call, or run it and cache what
+            it returns.
+            """
+            key = cache.key(version, args, params, authParams)
+            response = cache.get(key, (outputFormat, encoding))
+
+            if timer:
+                timer.mark("cache")
+
+            if response is not None:
+                headers, response = response
+
+                for name, values in headers:
+                    request.responseHeaders.setRawHeaders(name, values)
+
+                _send(*response)
+                return
+
+            d = _runAPICall(authParams)
+            d.addCallback(_write, cacheKey=key)
+            return d
 
         def _quickfail(fail):
             _error(Failure(fail))
@@ -141,21 +364,13 @@ class SaratogaResource(Resource):
             return _quickfail(fail)
 
 
-        # Try and look up the static route in the endpoints list
-        pathLookup = endpointMethods.get(tuple(request.postpath))
+        # Look up the route, static or Django-style dynamic
+        route = self.api.routes[method].lookup(request.postpath)
 
-        if not pathLookup:
-            # If there's no static route, try dynamic Django-style routes
-            for item in endpointMethods:
-                a = re.compile("^%s/%s$" % item)
-                match = a.match("/".join(request.postpath))
-                if match:
-                    # We found it, so break out of here
-                    pathLookup = endpointMethods[item]
-                    args = match.groups()
-                    break
+        if timer:
+            timer.mark("route")
 
-        if not pathLookup:
+        if not route:
             fail = NoSuchEndpoint("Endpoint does not exist.")
             return _quickfail(fail)
         else:
@@ -163,110 +378,128 @@ class SaratogaResource(Resource):
             params = {}
 
             # Expand out the looked up path
-            api, version, processor = pathLookup
+            pathLookup, args = route
+            (api, version, processor,
+             requestValidator, responseValidator, cache, limiter,
+             rateLimiter, pool, processPool, func, funcName) = pathLookup
+
+            maxBodySize = self.api.maxBodySize
+
+            if maxBodySize is not None:
+                # Sites from getSite have already turned away bodies that are
+                # too big as they came in, but other ones haven't
+                length = request.getHeader("Content-Length")
+
+                if length and length.isdigit() and int(length) > maxBodySize:
+                    return _quickfail(RequestTooLarge(
+                        "Request body is too large."))
+
+                # Read in the content from the request, but no more than
+                # enough to find out that it's too big
+                requestContent = request.content.read(maxBodySize + 1)
+
+                if len(requestContent) > maxBodySize:
+                    return _quickfail(RequestTooLarge(
+                        "Request body is too large."))
+            else:
+                # Read in the content from the request
+                requestContent = request.content.read()
 
-            # Read in the content from the request
-            requestContent = request.content.read()
             # Set it back to the start
             request.content.seek(0)
 
+            # Parse it according to its Content-Type
             try:
-                # Parse it from JSON
-                # XXX: We should do this according to what it is, but JSON will
-                # do for now
-                params = json.loads(requestContent)
-            except ValueError:
-                pass
+                params = self.api.inputRegistry.parse(
+                    request, requestContent) or {}
+            except BadRequestParams as e:
+                return _quickfail(e)
+
+            # Make sure it's a dict, even if it's empty
+            params = {} if not params else params
+
+            # Query args fill in whatever the body didn't give, whatever format
+            # it was in
+            if isinstance(params, dict) and request.args:
+                formFields = ()
+
+                if _isForm(request):
+                    # Twisted puts the fields of form bodies in request.args
+                    # too, which aren't wanted if it was really JSON
+                    formFields = parse_qs(requestContent,
+                                          keep_blank_values=True)
 
-            # If there's no content body, but there are query args, put them in
-            # a dictionary for us
-            if not params and request.args is not None:
                 for key, val in request.args.iteritems():
-                    if type(val) in [list, tuple] and len(val) == 1:
+                    if key in params or key in formFields:
+                        pass
+                    elif type(val) in [list, tuple] and len(val) == 1:
                         params[key] = val[0]
                     else:
                         params[key] = val
 
-            # Make sure it's a dict, even if it's empty
-            params = {} if not params else params
-
             userParams = {"params": params}
-            schema = processor.get("requestSchema")
 
-            if schema:
+            if timer:
+                timer.mark("parse")
+
+            if requestValidator:
                 # Validate the schema, if we've got it
-                v = Draft4Validator(schema)
-                errors = sorted(v.iter_errors(params), key=lambda e: e.path)
+                errors = requestValidator.check(params)
 
                 if errors:
-                    return _quickfail(BadRequestParams(", ".join(
-                        e.message for e in errors)))
+                    return _quickfail(BadRequestParams(errors))
 
-            # Get the name of the endpoint
-            funcname = api.get("func") or api["endpoint"]
-            # Find the version class in the implementation
-            versionClass = getattr(self.api.implementation, "v{}".format(version))
-            # Do the dispatch, based on endpoint_method
-            func = getattr(versionClass, "{}_{}".format(funcname, method)).im_func
-
-            d = Deferred()
+                if timer:
+                    timer.mark("validateRequest")
 
             #############################
             # Check for authentication. #
             #############################
 
-            if api.get("requiresAuthentication", False):
-
-                if not hasattr(self.api.serviceClass, "auth"):
-                    fail = APIError("Authentication required, but there is not"
-                        " an available authenticator.")
-                    return _quickfail(fail)
+            requiresAuthentication = api.get("requiresAuthentication", False)
 
-                def _authAdditional(canonicalUsername):
-                    return {"username": canonicalUsername}
+            if requiresAuthentication and authenticated is None:
+                try:
+                    authenticate = self._authenticator(request)
+                except APIError as e:
+                    return _quickfail(e)
 
-                auth = request.getHeader("Authorization")
-
-                if not auth:
-                    fail = AuthenticationRequired("Authentication required.")
-                    return _quickfail(fail)
-
-                # Find out how we're authenticating
-                authType, authDetails = auth.split()
-                authType = authType.lower()
+            d = Deferred()
 
-                if not authType in ["basic"] and  not authType.startswith("signature"):
-                    fail = AuthenticationFailed(
-                            "Unsupported Authorization type '{}'".format(
-                                authType.upper()))
-                    return _quickfail(fail)
+            if limiter is not None:
+                # Only take a turn once nothing else can turn the request
+                # away, and turn it away straight away if there's no room
+                try:
+                    waiting = limiter.hold(request)
+                except ServiceUnavailable as e:
+                    return _quickfail(e)
 
-                if authType == "basic":
-                    try:
-                        authDetails = b64decode(authDetails)
-                        authUser, authPassword = authDetails.split(":")
-                    except:
-                        fail = AuthenticationFailed("Malformed Authorization header.")
-                        return _quickfail(fail)
+                def _lost(failure):
+                    # It only fails when cancelled, if the request is lost
+                    abandoned.append(True)
+                    return failure
 
-                    d.addCallback(lambda _:
-                        self.api.serviceClass.auth.auth_usernameAndPassword(
-                            authUser, authPassword))
+                waiting.addErrback(_lost)
+                d.addCallback(lambda _: waiting)
 
-                if authType.startswith("signature"):
+            if requiresAuthentication:
 
-                    keyBits = request.getHeader("Authorization")\
-                                     .split("Signature ")[1].split(",")
-                    keyBits = [z.split("=", 1) for z in keyBits]
-                    keyBits = {x:y[1:-1] for x,y in keyBits}
+                if authenticated is not None:
+                    d.addCallback(lambda _: authenticated)
+                else:
+                    d.addCallback(lambda _: authenticate())
 
-                    d.addCallback(lambda _:
-                            self.api.serviceClass.auth.auth_HMAC(keyBits["keyId"], request))
+                if timer:
+                    d.addCallback(timer.markResult, "auth")
 
-                d.addCallback(_authAdditional)
+            if rateLimiter is not None:
+                d.addCallback(_rateLimit)
 
-            d.addCallback(_runAPICall)
-            d.addCallback(_write)
+            if cache is not None:
+                d.addCallback(_runCachedAPICall)
+            else:
+                d.addCallback(_runAPICall)
+                d.addCallback(_write)
             d.addErrback(_error)
 
             # Kick off the chain
@@ -275,12 +508,115 @@ class SaratogaResource(Resource):
             return 1
 
 
+    def _authenticator(self, request):
+        """
+        Check that C{request} has credentials that the service's
+        authenticator can check.
+
+        @return: A function that checks them, returning a L{Deferred} that
+            fires with the auth params to give the processor.
+        @raise APIError: If it doesn't.
+        """
+        if not hasattr(self.api.serviceClass, "auth"):
+            raise APIError("Authentication required, but there is not"
+                " an available authenticator.")
+
+        authenticator = self.api.serviceClass.auth
+        auth = request.getHeader("Authorization")
+
+        if not auth:
+            raise AuthenticationRequired("Authentication required.")
+
+        # Find out how we're authenticating
+        authType, _, authDetails = auth.partition(" ")
+        authType = authType.lower()
+
+        if not authType in ["basic"] and  not authType.startswith("signature"):
+            raise AuthenticationFailed(
+                "Unsupported Authorization type '{}'".format(
+                    authType.upper()))
+
+        if authType == "basic":
+            try:
+                authDetails = b64decode(authDetails)
+                authUser, authPassword = authDetails.split(":")
+            except:
+                raise AuthenticationFailed("Malformed Authorization header.")
+
+            check = partial(authenticator.auth_usernameAndPassword,
+                            authUser, authPassword)
+        else:
+            try:
+                signature = parseSignatureHeader(auth)
+            except ValueError:
+                raise AuthenticationFailed("Malformed Authorization header.")
+
+            if hasattr(authenticator, "auth_signature"):
+                # Save the authenticator from parsing it again
+                check = partial(authenticator.auth_signature, signature,
+                                request)
+            else:
+                check = partial(authenticator.auth_HMAC, signature.keyId,
+                                request)
+
+        def _authAdditional(canonicalUsername):
+            return {"username": canonicalUsername}
+
+        return lambda: maybeDeferred(check).addCallback(_authAdditional)
+
+
+
 class SaratogaAPI(object):
 
     def __init__(self, implementation, definition, serviceClass=None, outputRegistry=None,
-                 methods=["GET", "POST", "HEAD", "PUT", "DELETE", "PATCH"]):
+                 methods=["GET", "POST", "HEAD", "PUT", "DELETE", "PATCH"],
+                 validationEngine="jsonschema", maxBodySize=None,
+                 jsonCodec=None, reactor=None, metrics=None,
+                 threadPools=None, processPools=None, compression=None,
+                 inputRegistry=None):
+        """
+        @param validationEngine: The default engine for checking request and
+            response schemas, from L{saratoga.validation.engines}.
+        @param maxBodySize: The largest request body, in bytes, that will be
+            parsed. Larger ones get a 413. C{None} means there is no limit.
+            Twisted reads the whole body before the resource sees it, so to
+            turn large bodies away as they arrive, serve the API with the
+            site from L{getSite}.
+        @param jsonCodec: The L{saratoga.jsoncodec.JSONCodec} for parsing
+            JSON request bodies, and for the default output formats. Defaults
+            to the fastest one available. If C{msgpack} or C{cbor2} is
+            installed, the default input and output formats also include
+            MessagePack or CBOR.
+        @param reactor: The reactor to use for timing things, like how long
+            cached responses last. Defaults to the global reactor.
+        @param metrics: A L{saratoga.metrics.Metrics} to record every request
+            in, or C{None} to not record them.
+        @param threadPools: A dict of thread pool names to how many threads
+            they have, for processors marked as C{blocking}. Pools that
+            aren't given have L{saratoga.threadpools.DEFAULT_POOL_SIZE}
+            threads.
+        @param processPools: A dict of process pool names to dicts of
+            arguments for L{saratoga.processes.ProcessPool}, for processors
+            marked as C{process}.
+        @param compression: A L{saratoga.compression.Compression}, to
+            compress responses for clients that accept it, or C{None} to not
+            compress them.
+        @param inputRegistry: A L{saratoga.inputFormats.InputRegistry} for
+            parsing request bodies. The default one parses JSON, form data,
+            and MessagePack and CBOR if they are installed.
+        """
+        if reactor is None:
+            from twisted.internet import reactor
 
         methods = [x.upper() for x in methods]
+        self.maxBodySize = maxBodySize
+        self.jsonCodec = jsonCodec or jsoncodec.defaultCodec
+        self.reactor = reactor
+        self.metrics = metrics
+        self.compression = compression
+        self.timingHooks = []
+        self._threadPoolSizes = threadPools or {}
+        self._processPoolOptions = processPools or {}
 
         if serviceClass:
             self.serviceClass = serviceClass
@@ -290,11 +626,41 @@ class SaratogaAPI(object):
         if outputRegistry:
             self.outputRegistry = outputRegistry
         else:
+            codec = self.jsonCodec
             self.outputRegistry = outputFormats.OutputRegistry("application/json")
             self.outputRegistry.register("application/json",
-                                         outputFormats.JSendJSONOutputFormat)
+                                         partial(outputFormats.JSendJSONOutputFormat, codec=codec),
+                                         partial(outputFormats.JSendJSONStreamingOutputFormat, codec=codec))
             self.outputRegistry.register("application/debuggablejson",
-                                         outputFormats.DebuggableJSendJSONOutputFormat)
+                                         partial(outputFormats.DebuggableJSendJSONOutputFormat, codec=codec))
+
+            if outputFormats.msgpack is not None:
+                self.outputRegistry.register("application/msgpack",
+                                             outputFormats.JSendMessagePackOutputFormat,
+                                             binary=True)
+
+            if outputFormats.cbor2 is not None:
+                self.outputRegistry.register("application/cbor",
+                                             outputFormats.JSendCBOROutputFormat,
+                                             outputFormats.JSendCBORStreamingOutputFormat,
+                                             binary=True)
+
+        if inputRegistry:
+            self.inputRegistry = inputRegistry
+        else:
+            self.inputRegistry = inputFormats.InputRegistry("application/json")
+            self.inputRegistry.register("application/json", self.jsonCodec.loads)
+            self.inputRegistry.register("application/x-www-form-urlencoded",
+                                        partial(inputFormats.loadFormURLEncoded,
+                                                jsonLoads=self.jsonCodec.loads))
+
+            if inputFormats.msgpack is not None:
+                self.inputRegistry.register("application/msgpack",
+                                            inputFormats.loadMessagePack)
+
+            if inputFormats.cbor2 is not None:
+                self.inputRegistry.register("application/cbor",
+                                            inputFormats.loadCBOR)
 
         # Where the implementation comes from
         self._implementation = implementation
@@ -308,6 +674,12 @@ class SaratogaAPI(object):
         self.APIDefinition = definition.get("endpoints", [])
         self._versions = self.APIMetadata["versions"]
         self.endpoints = {x:{} for x in methods}
+        self.routes = {x:Router() for x in methods}
+        self.responseCaches = {}
+        self.limiters = {}
+        self.rateLimiters = {}
+        self.threadPools = {}
+        self.processPools = {}
 
         self.resource = SaratogaResource(self)
 
@@ -324,6 +696,13 @@ class SaratogaAPI(object):
             setattr(self.implementation, "v{}".format(version), i)
 
         for api in self.APIDefinition:
+
+            engine = api.get("validationEngine", validationEngine)
+
+            if engine not in validation.engines:
+                raise Exception("Unknown validation engine {} in {}".format(
+                    engine, api["endpoint"]))
+
             for verb in methods:
                 for processor in api.get("{}Processors".format(
                         verb.lower()), []):
@@ -338,6 +717,34 @@ class SaratogaAPI(object):
                             i = json.load(filepath.FilePath(".").preauthChild(val).open())
                             processor[key] = i
 
+                    # Compile the validators once, and share them between
+                    # every version this processor serves
+                    validators = [
+                        validation.engines[engine](processor[key])
+                        if processor.get(key) else None
+                        for key in ["requestSchema", "responseSchema"]]
+
+                    cache = self._makeCache(verb, api, processor)
+                    limiter = None
+                    rateLimiter = None
+
+                    if processor.get("maxConcurrent"):
+                        limiter = ConcurrencyLimiter(
+                            processor["maxConcurrent"],
+                            processor.get("maxQueued", 0),
+                            processor.get("retryAfter", 1))
+
+                    if processor.get("rateLimit"):
+                        rateLimit = processor["rateLimit"]
+                        rateLimiter = RateLimiter(
+                            rateLimit["requests"],
+                            rateLimit.get("seconds", 1),
+                            rateLimit.get("burst"), self.reactor)
+
+                    pool = self._getThreadPool(processor.get("blocking"))
+                    processPool = self._getProcessPool(
+                        processor.get("process"))
+
                     for version in processor["versions"]:
                         if version not in self._versions:
                             raise Exception("Version mismatch - {} in {} is "
@@ -346,15 +753,122 @@ class SaratogaAPI(object):
 
                         versionClass = getattr(
                             self.implementation, "v{}".format(version))
-                        funcName = api.get("func") or api["endpoint"]
-                        if not hasattr(versionClass,
-                            "{}_{}".format(funcName, verb)):
+                        name = api.get("func") or api["endpoint"]
+                        funcName = "{}_{}".format(name, verb)
+                        impl = getattr(versionClass, funcName, None)
+                        if impl is None:
                             raise Exception("Implementation is missing the {} "
                                 "processor in the v{} {} endpoint".format(
-                                    verb, version, funcName))
+                                    verb, version, name))
 
+                        # Look up the implementation's function now, so
+                        # dispatching a request is only unpacking its route
                         path = ('v' + str(version), api["endpoint"])
                         self.endpoints[verb][path] = (api, version, processor)
+                        self.routes[verb].add(
+                            path, Route(api, version, processor,
+                                        *(validators +
+                                          [cache, limiter, rateLimiter, pool,
+                                           processPool, impl.im_func,
+                                           funcName])))
+
+                        if cache is not None:
+                            self.responseCaches[
+                                (api["endpoint"], version)] = cache
+
+                        if rateLimiter is not None:
+                            self.rateLimiters[
+                                (verb, version, api["endpoint"])] = rateLimiter
+
+                        if limiter is not None:
+                            key = (verb, version, api["endpoint"])
+                            self.limiters[key] = limiter
+                            if metrics is not None:
+                                metrics.trackLimiter(key, limiter)
+
+
+    def _getThreadPool(self, blocking):
+        """
+        Get the thread pool for a processor's C{blocking}, which is either
+        C{True} for the C{default} pool, or the name of a pool.
+        """
+        if not blocking:
+            return None
+
+        name = "default" if blocking is True else blocking
+        pool = self.threadPools.get(name)
+
+        if pool is None:
+            pool = self.threadPools[name] = BlockingPool(
+                name, self._threadPoolSizes.get(name, DEFAULT_POOL_SIZE),
+                reactor=self.reactor)
+
+            if self.metrics is not None:
+                self.metrics.trackThreadPool(pool)
+
+        return pool
+
+
+    def _getProcessPool(self, process):
+        """
+        Get the process pool for a processor's C{process}, which is either
+        C{True} for the C{default} pool, or the name of a pool.
+        """
+        if not process:
+            return None
+
+        name = "default" if process is True else process
+        pool = self.processPools.get(name)
+
+        if pool is None:
+            pool = self.processPools[name] = ProcessPool(
+                name, reactor=self.reactor,
+                **self._processPoolOptions.get(name, {}))
+
+        return pool
+
+
+    def _makeCache(self, verb, api, processor):
+        """
+        Make the response cache described by a processor's C{cache}, if it
+        has one.
+        """
+        config = processor.get("cache")
+
+        if not config:
+            return None
+
+        if verb != "GET":
+            raise Exception("Only GET processors can be cached, but the {} "
+                "processor in {} has a cache".format(verb, api["endpoint"]))
+
+        return ResponseCache(config["ttl"], params=config.get("params"),
+                             auth=config.get("auth"),
+                             maxEntries=config.get("maxEntries", 1000),
+                             clock=self.reactor)
+
+
+    def invalidateCache(self, endpoint, version=None, args=(), params=None,
+                        auth=None):
+        """
+        Forget cached responses of the GET processors for C{endpoint}.
+
+        With only C{endpoint} (and optionally C{version}), every cached
+        response is forgotten. Otherwise, only the one for the call with
+        C{args}, C{params} and C{auth} is.
+
+        @param args: The groups captured from the path by a regex endpoint.
+        @param auth: The auth details the call was made with, eg.
+            C{{"username": "alice"}}.
+        """
+        everything = params is None and auth is None and not args
+
+        for (name, cacheVersion), cache in self.responseCaches.iteritems():
+            if name == endpoint and version in (None, cacheVersion):
+                if everything:
+                    cache.clear(cacheVersion)
+                else:
+                    cache.invalidate(cacheVersion, args, params, auth)
 
 
     def getResource(self):
@@ -364,6 +878,51 @@ class SaratogaAPI(object):
         return self.resource
 
 
+    def getSite(self):
+        """
+        Get a Twisted Web Site serving the API, which turns away request
+        bodies larger than C{maxBodySize} as they arrive.
+        """
+        return BodySizeLimitedSite(self.resource, self.maxBodySize)
+
+
+    def addTimingHook(self, hook):
+        """
+        Add a hook to be given the phase timings of every request. See
+        L{saratoga.timing} for the phases.
+
+        @param hook: An object with a C{requestTimed(method, version,
+            endpoint, phases)} method, like
+            L{saratoga.timing.AggregatingTimingSink}.
+        """
+        self.timingHooks.append(hook)
+
+
+    def removeTimingHook(self, hook):
+        self.timingHooks.remove(hook)
+
+
+    def getMetricsResource(self):
+        """
+        Get a Twisted Web Resource that serves this API's metrics in the
+        Prometheus text format.
+        """
+        if self.metrics is None:
+            raise Exception("This API was not given any metrics to record.")
+
+        return MetricsResource(self.metrics)
+
+
+    def getBatchResource(self, maxBatchSize=50):
+        """
+        Get a Twisted Web Resource that makes many calls to this API in one
+        request. See L{saratoga.batch}.
+
+        @param maxBatchSize: The most calls a batch can have.
+        """
+        return BatchResource(self, maxBatchSize)
+
+
     def test(self, path, params=None, headers=None, method="GET", useBody=True,
              replaceEmptyWithEmptyDict=False, enableHMAC=False):
 
@@ -371,11 +930,41 @@ class SaratogaAPI(object):
             method=method, useBody=useBody, enableHMAC=enableHMAC,
             replaceEmptyWithEmptyDict=replaceEmptyWithEmptyDict)
 
-    def run(self, port=8080): # pragma: no cover
+    def run(self, port=8080, workers=1, reusePort=False): # pragma: no cover
+        """
+        Serve the API on C{port}.
+
+        @param workers: How many processes to serve from. With more than one,
+            this program is run again for each worker, so everything before
+            calling C{run} must be safe to do once per worker. The workers are
+            restarted if they die.
+        @param reusePort: With more than one worker, have each listen on its
+            own socket with C{SO_REUSEPORT}, instead of sharing one socket.
 
-        from twisted.web.server import Site
+        In a worker of a L{saratoga.processes.ProcessPool}, this runs the
+        calls sent by the pool instead.
+        """
         from twisted.internet import reactor
+        from saratoga.workers import (
+            isWorker, listenAsWorker, WorkerSupervisor)
+        from saratoga.processes import isProcessWorker, serveCalls
+
+        if isProcessWorker():
+            return serveCalls(self)
+
+        factory = self.getSite()
+
+        if isWorker() or workers <= 1:
+            # Start the process pools now, rather than on their first call
+            for pool in self.processPools.values():
+                reactor.callWhenRunning(pool.start)
+
+        if isWorker():
+            listenAsWorker(reactor, factory)
+        elif workers > 1:
+            WorkerSupervisor(reactor, workers, port,
+                             reusePort=reusePort).start()
+        else:
+            reactor.listenTCP(port, factory)
 
-        factory = Site(self.resource)
-        reactor.listenTCP(port, factory)
         reactor.run()
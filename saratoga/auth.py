@@ -1,5 +1,13 @@
 from saratoga import AuthenticationFailed
+from saratoga.cache import ExpiringCache
+from saratoga.signatures import SignatureVerifier, parseSignatureHeader
 from twisted.internet import defer
+from twisted.internet.task import LoopingCall
+from twisted.python import log
+
+import csv
+import json
+import os
 
 
 class InMemoryStringSharedSecretSource(object):
@@ -18,6 +26,119 @@ class InMemoryStringSharedSecretSource(object):
 
 
 
+class FileSharedSecretSource(object):
+    """
+    A shared secret source that loads users from a JSON or CSV file, and
+    reloads them when the file changes.
+
+    A JSON file is a list of users like those given to
+    L{InMemoryStringSharedSecretSource}. A CSV file has a header row naming
+    the columns, such as C{username,password,canonicalUsername}.
+    """
+
+    def __init__(self, path, reloadInterval=5, fileFormat=None, clock=None):
+        """
+        @param path: The file to load.
+        @param reloadInterval: How many seconds between checking whether the
+            file has changed, or C{None} to never check.
+        @param fileFormat: C{"json"} or C{"csv"}. Defaults to the file's
+            extension.
+        @param clock: An C{IReactorTime} provider, for checking the file.
+        """
+        if fileFormat is None:
+            fileFormat = os.path.splitext(path)[1][1:].lower()
+
+        if fileFormat not in _fileFormats:
+            raise ValueError("Unknown user file format {!r}".format(
+                fileFormat))
+
+        self.path = path
+        self.fileFormat = fileFormat
+        self._users = {}
+        self._stat = None
+        self.load()
+
+        self._watcher = None
+
+        if reloadInterval is not None:
+            self._watcher = LoopingCall(self.reloadIfChanged)
+            if clock is not None:
+                self._watcher.clock = clock
+            self._watcher.start(reloadInterval, now=False)
+
+
+    def load(self):
+        """
+        Load the users from the file, replacing the ones loaded before.
+        """
+        stat = _fileStat(self.path)
+
+        with open(self.path, "rb") as f:
+            users = _fileFormats[self.fileFormat](f)
+
+        index = {}
+
+        for user in users:
+            index.setdefault(user.get("username"), user)
+
+        self._users, self._stat = index, stat
+
+
+    def reloadIfChanged(self):
+        """
+        Load the users again if the file has changed. If it can't be loaded,
+        the users loaded before are kept.
+        """
+        try:
+            if _fileStat(self.path) != self._stat:
+                self.load()
+                log.msg("Reloaded users from {}".format(self.path))
+        except Exception:
+            log.err(None, "Failed to reload users from {}".format(self.path))
+
+
+    def stopWatching(self):
+        """
+        Stop checking whether the file has changed.
+        """
+        if self._watcher and self._watcher.running:
+            self._watcher.stop()
+
+
+    def getUserDetails(self, username):
+
+        user = self._users.get(username)
+
+        if user is None:
+            raise AuthenticationFailed("Authentication failed.")
+
+        return defer.succeed(user)
+
+
+
+def _fileStat(path):
+    """
+    Things about a file which change when it is written or replaced.
+    """
+    stat = os.stat(path)
+    return (stat.st_mtime, stat.st_size, stat.st_ino)
+
+
+
+def _loadCSVUsers(f):
+    # Leave out empty fields, so that they act like missing keys do in JSON
+    return [{k: v for k, v in row.iteritems() if v}
+            for row in csv.DictReader(f)]
+
+
+
+_fileFormats = {
+    "json": json.load,
+    "csv": _loadCSVUsers,
+}
+
+
+
 class DummySharedSecretSource(object):
 
     def getUserDetails(self, username): # pragma: no cover
@@ -27,20 +148,82 @@ class DummySharedSecretSource(object):
 
 class DefaultAuthenticator(object):
 
-    def __init__(self, sharedSecretSource):
+    def __init__(self, sharedSecretSource, cacheTTL=0, negativeCacheTTL=0,
+                 cacheSize=1000, maxClockSkew=None, replayCacheSize=0,
+                 clock=None):
         """
         Initialise the Haddock Authenticator.
+
+        @param cacheTTL: How many seconds to remember a user's details for,
+            so that the shared secret source isn't asked on every request.
+            C{0} means they aren't remembered.
+        @param negativeCacheTTL: How many seconds to remember that the shared
+            secret source doesn't know a user.
+        @param cacheSize: How many users to remember.
+        @param maxClockSkew: How many seconds the C{Date} of a signed request
+            can be from now, or C{None} for any date.
+        @param replayCacheSize: How many signatures to remember, so that
+            signed requests can't be replayed. C{0} means none are.
+        @param clock: An C{IReactorTime} provider, for expiring users and
+            checking dates.
         """
         self.sharedSecretSource = sharedSecretSource
+        self.cacheTTL = cacheTTL
+        self.negativeCacheTTL = negativeCacheTTL
+        self._cache = None
+        self.signatureVerifier = SignatureVerifier(
+            maxClockSkew, replayCacheSize, clock=clock)
+
+        if cacheTTL or negativeCacheTTL:
+            self._cache = ExpiringCache(cacheSize, clock)
 
 
     def _getUserDetails(self, username):
 
-        if self.sharedSecretSource:
-            d = self.sharedSecretSource.getUserDetails(username)
-            return d
+        if not self.sharedSecretSource:
+            raise AuthenticationFailed("No Authentication Backend")
+
+        if self._cache is None:
+            return self.sharedSecretSource.getUserDetails(username)
+
+        cached = self._cache.get(username)
+
+        if isinstance(cached, AuthenticationFailed):
+            raise cached
+        elif cached is not None:
+            return defer.succeed(cached)
+
+        def _found(result):
+            if self.cacheTTL:
+                self._cache.set(username, result, self.cacheTTL)
+            return result
 
-        raise AuthenticationFailed("No Authentication Backend")
+        def _notFound(failure):
+            failure.trap(AuthenticationFailed)
+            if self.negativeCacheTTL:
+                self._cache.set(username, failure.value, self.negativeCacheTTL)
+            return failure
+
+        d = defer.maybeDeferred(self.sharedSecretSource.getUserDetails,
+                                username)
+        return d.addCallbacks(_found, _notFound)
+
+
+    def invalidateUser(self, username):
+        """
+        Forget what is remembered about C{username}, such as after their
+        password has changed.
+        """
+        if self._cache is not None:
+            self._cache.pop(username)
+
+
+    def clearCache(self):
+        """
+        Forget every remembered user.
+        """
+        if self._cache is not None:
+            self._cache.clear()
 
 
     def auth_usernameAndPassword(self, username, password):
@@ -60,21 +243,35 @@ class DefaultAuthenticator(object):
 
     def auth_HMAC(self, username, request):
 
-        def _continue(result):
+        try:
+            signature = parseSignatureHeader(
+                request.getHeader("Authorization") or "")
+        except ValueError:
+            return defer.fail(AuthenticationFailed(
+                "Malformed Authorization header."))
 
-            from httpsig_cffi import verify
+        if signature.keyId != username:
+            return defer.fail(AuthenticationFailed("Authentication failed."))
 
-            head = {x.lower():y[0] for x,y in request.requestHeaders.getAllRawHeaders()}
-            hs = verify.HeaderVerifier(headers=head,
-                                       secret=result.get("password"),
-                                       method=request.method,
-                                       path=request.path)
-            res = hs.verify()
+        return self.auth_signature(signature, request)
 
-            if res:
-                uName = result.get("canonicalUsername", )
-                return defer.succeed(uName)
 
-            raise AuthenticationFailed("Authentication failed.")
+    def auth_signature(self, signature, request):
+        """
+        Authenticate a request signed with HTTP Signatures.
 
-        return defer.maybeDeferred(self._getUserDetails, username).addCallback(_continue)
+        @param signature: The L{saratoga.signatures.Signature} parsed from the
+            request's C{Authorization} header.
+        """
+        def _continue(result):
+            # Checks freshness again, since the same request may have been
+            # verified while the user was being looked up
+            self.signatureVerifier.verify(
+                signature, result.get("password"), request)
+            return result.get("canonicalUsername")
+
+        # Turn away stale and replayed requests without looking anyone up
+        d = defer.maybeDeferred(
+            self.signatureVerifier.checkFresh, signature, request)
+        d.addCallback(lambda _: self._getUserDetails(signature.keyId))
+        return d.addCallback(_continue)
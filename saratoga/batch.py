@@ -0,0 +1,258 @@
+"""
+Making many API calls in one HTTP request.
+
+A batch is a JSON list of calls, each a dict of C{method} (defaulting to
+C{GET}), C{path} (such as C{/v1/planets}, optionally with a query string),
+and C{params}. The batch is authenticated once, from its own
+C{Authorization} header, and then every call is dispatched at once through
+the same routing, validation and processors as if it had been made on its
+own. The response is a JSend success with a list of each call's JSend
+response, in the same order, with its HTTP status code added as C{code}.
+
+Each call is a L{twisted.web.server.Request} on the batch's connection,
+with the batch's client address and C{Authorization} header, so processors
+can treat it like any other request. A call that fails only fails itself,
+and is given as an internal server error.
+"""
+
+from twisted.internet.defer import DeferredList, maybeDeferred, succeed
+from twisted.python import log
+from twisted.python.failure import Failure
+from twisted.web.http_headers import Headers
+from twisted.web.resource import Resource
+from twisted.web.server import Request
+
+from saratoga import APIError, BadRequestParams, RequestTooLarge
+
+from StringIO import StringIO
+from urlparse import parse_qs
+
+
+class _BatchRequest(Request):
+    """
+    One call in a batch, made on the batch's connection, which keeps its
+    response in memory rather than writing it out.
+    """
+
+    def __init__(self, batch, method, path, body):
+        """
+        @param batch: The request for the batch, whose connection, client
+            and credentials the call has too.
+        """
+        Request.__init__(self, batch.channel)
+        path, _, query = path.partition("?")
+        self.client = batch.client
+        self.host = batch.host
+        self.method = method
+        self.clientproto = batch.clientproto
+        self.path = self.uri = path
+        self.prepath = []
+        self.postpath = path.split("/")[1:]
+        self.args = parse_qs(query) if query else {}
+        self.content = StringIO(body)
+        self.requestHeaders = Headers({"Accept": ["application/json"]})
+
+        auth = batch.getHeader("Authorization")
+
+        if auth is not None:
+            self.requestHeaders.setRawHeaders("Authorization", [auth])
+
+        self._body = []
+
+
+    def write(self, data):
+        self._body.append(data)
+
+
+    def finish(self):
+        self.finished = True
+        self._notify(None)
+
+
+    def _notify(self, result):
+        notifications, self.notifications = self.notifications, []
+
+        for d in notifications:
+            d.callback(result)
+
+
+    def registerProducer(self, producer, streaming):
+        # Streamed responses are read all at once, since the whole response
+        # is needed anyway
+        self.producer = producer
+
+        while self.producer is not None:
+            producer.resumeProducing()
+
+
+    def unregisterProducer(self):
+        self.producer = None
+
+
+    def loseConnection(self):
+        # A streamed response failed part way through, which mustn't close
+        # the batch's connection
+        self.producer = None
+        self._notify(Failure(APIError("Error while streaming a response.")))
+
+
+    def getBody(self):
+        return "".join(self._body)
+
+
+
+class BatchResource(Resource):
+    """
+    Runs batches of calls to an API.
+    """
+    isLeaf = True
+
+    def __init__(self, api, maxBatchSize=50):
+        """
+        @param api: The L{saratoga.api.SaratogaAPI} to make the calls to.
+        @param maxBatchSize: The most calls a batch can have.
+        """
+        Resource.__init__(self)
+        self.api = api
+        self.maxBatchSize = maxBatchSize
+
+
+    def render_POST(self, request):
+
+        registry = self.api.outputRegistry
+        outputFormat = registry.getFormat(request)
+
+        if not outputFormat:
+            request.setResponseCode(406)
+            return "406 Not Acceptable, please use one of: {}".format(
+                ", ".join(registry._outputFormatsPreference))
+
+        request.setHeader("Content-Type", registry.getContentType(outputFormat))
+
+        def _respond(status, data, code=200):
+            request.setResponseCode(code)
+            request.write(registry.renderAutomaticResponse(
+                request, status, data, outputFormat))
+            request.finish()
+
+        def _error(failure):
+            error = failure.value
+            code = getattr(error, "code", 500)
+
+            if code == 500:
+                log.err(failure)
+                _respond("error", "Internal server error.", 500)
+            else:
+                _respond("fail", error.message, code)
+
+        try:
+            calls = self._parse(request)
+            authenticate = None
+
+            if request.getHeader("Authorization") and \
+               hasattr(self.api.serviceClass, "auth"):
+                authenticate = self.api.resource._authenticator(request)
+        except APIError:
+            _error(Failure())
+            return 1
+
+        # Make the calls now, while the batch still has a connection
+        codec = self.api.jsonCodec
+        subRequests = [
+            _BatchRequest(request,
+                          call.get("method", "GET").upper().encode("utf-8"),
+                          call["path"].encode("utf-8"),
+                          codec.dumps(call.get("params", {})))
+            for call in calls]
+
+        if authenticate is not None:
+            d = authenticate()
+        else:
+            # Calls that need authentication will fail on their own
+            d = succeed(None)
+
+        d.addCallback(self._runCalls, subRequests)
+        d.addCallback(lambda results: _respond("success", results))
+        d.addErrback(_error)
+        return 1
+
+
+    def _parse(self, request):
+        """
+        Read the calls from the body of C{request}.
+
+        @raise APIError: If they aren't valid.
+        """
+        maxBodySize = self.api.maxBodySize
+        body = request.content.read(
+            maxBodySize + 1 if maxBodySize is not None else -1)
+
+        if maxBodySize is not None and len(body) > maxBodySize:
+            raise RequestTooLarge("Request body is too large.")
+
+        try:
+            calls = self.api.jsonCodec.loads(body)
+        except ValueError:
+            raise BadRequestParams("Batch is not valid JSON.")
+
+        if not isinstance(calls, list):
+            raise BadRequestParams("Batch must be a list of calls.")
+
+        if len(calls) > self.maxBatchSize:
+            raise RequestTooLarge(
+                "Batch has {} calls, but at most {} are allowed.".format(
+                    len(calls), self.maxBatchSize))
+
+        for call in calls:
+            if not isinstance(call, dict) or \
+               not isinstance(call.get("path"), basestring) or \
+               not isinstance(call.get("method", "GET"), basestring) or \
+               not isinstance(call.get("params", {}), dict):
+                raise BadRequestParams(
+                    "Each call must have a path, and optionally a method and "
+                    "a dict of params.")
+
+        return calls
+
+
+    def _runCalls(self, authenticated, subRequests):
+        """
+        Dispatch every call at once.
+
+        @return: A L{Deferred} firing with a list of their JSend responses.
+        """
+        resource = self.api.resource
+        codec = self.api.jsonCodec
+        finished = []
+
+        for subRequest in subRequests:
+            done = subRequest.notifyFinish()
+            d = maybeDeferred(resource.render, subRequest,
+                              authenticated=authenticated)
+            d.addCallback(lambda _, done=done: done)
+            d.addCallback(lambda _, subRequest=subRequest: subRequest)
+            finished.append(d)
+
+        def _collect(results):
+            responses = []
+
+            for success, result in results:
+                if not success:
+                    log.err(result, "Error in a batched call")
+                    responses.append({"status": "error", "code": 500,
+                                      "data": "Internal server error."})
+                    continue
+
+                try:
+                    response = codec.loads(result.getBody())
+                except ValueError:
+                    # Such as a 406, which isn't JSend
+                    response = {"status": "error", "data": result.getBody()}
+
+                response["code"] = result.code
+                responses.append(response)
+
+            return responses
+
+        d = DeferredList(finished, consumeErrors=True)
+        return d.addCallback(_collect)
@@ -0,0 +1,55 @@
+"""
+Benchmarks for Saratoga.
+
+Each module can be run with C{python -m saratoga.benchmark.<name>}.
+"""
+
+from timeit import default_timer
+
+import gc
+
+
+def timeIt(func, iterations):
+    """
+    Call C{func} C{iterations} times.
+
+    @return: The number of calls per second.
+    """
+    start = default_timer()
+    for x in xrange(iterations):
+        func()
+    return iterations / (default_timer() - start)
+
+
+
+def retainedObjects(func, iterations):
+    """
+    Call C{func} C{iterations} times.
+
+    @return: How many more objects the garbage collector knows about
+        afterwards, per call.
+    """
+    gc.collect()
+    before = len(gc.get_objects())
+
+    for x in xrange(iterations):
+        func()
+
+    gc.collect()
+    return (len(gc.get_objects()) - before) / float(iterations)
+
+
+
+def report(name, results):
+    """
+    Print a table of C{(label, calls per second)} results, which can also
+    have a note after them.
+    """
+    print name
+    print "-" * len(name)
+    for result in results:
+        line = "{:<40} {:>14,.0f}/s".format(*result[:2])
+        if len(result) > 2:
+            line += "  " + result[2]
+        print line
+    print
@@ -0,0 +1,73 @@
+"""
+Compare the binary output formats with JSON, on the size of typical
+responses, how fast they are serialised, and how fast clients and request
+bodies are parsed from them. Formats whose library isn't installed are left
+out.
+"""
+
+from saratoga.benchmark import timeIt, report
+from saratoga import inputFormats, jsoncodec, outputFormats
+
+import sys
+import zlib
+
+
+def makeItem(i):
+    return {"id": i, "name": u"item {}".format(i), "tags": ["a", "b", "c"],
+            "price": i * 1.5, "active": bool(i % 2), "parent": None}
+
+
+payloads = [
+    ("small", makeItem(1), 50000),
+    ("large (1000 items)", [makeItem(i) for i in xrange(1000)], 50),
+]
+
+
+def formats():
+    """
+    Find the C{(name, dumps, loads)} of every output format that can be
+    used, where C{dumps} is the output format.
+    """
+    found = [("JSON", outputFormats.JSendJSONOutputFormat,
+              jsoncodec.defaultCodec.loads)]
+
+    if outputFormats.msgpack is not None:
+        found.append(("MessagePack",
+                      outputFormats.JSendMessagePackOutputFormat,
+                      inputFormats.loadMessagePack))
+
+    if outputFormats.cbor2 is not None:
+        found.append(("CBOR", outputFormats.JSendCBOROutputFormat,
+                      inputFormats.loadCBOR))
+
+    return found
+
+
+
+def main():
+    found = formats()
+
+    for label, data, iterations in payloads:
+        serialised = [(name, dumps("success", data), loads)
+                      for name, dumps, loads in found]
+
+        name = "Size of {} response".format(label)
+        print name
+        print "-" * len(name)
+        for formatName, body, loads in serialised:
+            print "{:<40} {:>8,} bytes {:>8,} gzipped".format(
+                formatName, len(body), len(zlib.compress(body, 6)))
+        print
+
+        report("Serialising {} response".format(label), [
+            (formatName, timeIt(lambda: dumps("success", data), iterations))
+            for formatName, dumps, loads in found])
+
+        report("Parsing {} response".format(label), [
+            (formatName, timeIt(lambda: loads(body), iterations))
+            for formatName, body, loads in serialised])
+
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+"""
+Compare the JSON libraries that are installed, parsing and serialising
+typical request and response payloads. This is what L{saratoga.jsoncodec}
+picks its default codec from, although it never picks simplejson.
+"""
+
+from saratoga.benchmark import timeIt, report
+from saratoga import jsoncodec
+
+import json
+import sys
+
+
+def makeItem(i):
+    return {"id": i, "name": u"item {}".format(i), "tags": ["a", "b", "c"],
+            "price": i * 1.5, "active": bool(i % 2), "parent": None}
+
+
+payloads = [
+    ("small", {"status": "success", "data": makeItem(1)}, 50000),
+    ("large (1000 items)",
+     {"status": "success", "data": [makeItem(i) for i in xrange(1000)]}, 50),
+]
+
+
+def codecs():
+    """
+    Find the C{(name, loads, dumps)} of every installed JSON library.
+    """
+    found = [("json", json.loads, json.dumps)]
+
+    try:
+        import simplejson._speedups
+    except ImportError:
+        pass
+    else:
+        found.append(("simplejson", simplejson.loads, simplejson.dumps))
+
+    try:
+        import ujson
+    except ImportError:
+        pass
+    else:
+        found.append(("ujson", jsoncodec._ujsonLoads(), ujson.dumps))
+
+    return found
+
+
+
+def main():
+    print "Default codec: {!r}".format(jsoncodec.defaultCodec)
+    print
+
+    for label, payload, iterations in payloads:
+        serialised = jsoncodec.stdlibCodec.dumps(payload)
+
+        report("Parsing {} payload".format(label), [
+            (name, timeIt(lambda: loads(serialised), iterations))
+            for name, loads, dumps in codecs()])
+
+        report("Serialising {} payload".format(label), [
+            (name, timeIt(lambda: dumps(payload), iterations))
+            for name, loads, dumps in codecs()])
+
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+"""
+Load test a Saratoga service over loopback, with many concurrent keep-alive
+connections, and report its throughput and latency percentiles for each
+path.
+
+Unlike the in-process benchmarks, this includes the cost of sockets and HTTP
+parsing. The service can be started by the harness, for example, to test the
+planets example::
+
+    python -m saratoga.benchmark.load --command "python planets.py" \\
+        --cwd examples --port 8094 \\
+        "/v1/yearlength?name=earth" "/v1/yearlength?name=pluto"
+
+Without C{--command}, it tests a service that is already running.
+"""
+
+from twisted.internet.defer import inlineCallbacks, DeferredList, returnValue
+from twisted.internet.task import react
+from twisted.web.client import Agent, HTTPConnectionPool, readBody
+
+from itertools import cycle
+from timeit import default_timer
+
+import argparse
+import math
+import shlex
+import socket
+import subprocess
+import sys
+import time
+
+PERCENTILES = [50, 95, 99, 99.9]
+
+
+def percentile(values, p):
+    """
+    Get the C{p}th percentile of sorted C{values}, by the nearest rank.
+    """
+    if not values:
+        return None
+    rank = int(math.ceil(p / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+
+class PathStats(object):
+    """
+    What happened to the requests for one path.
+    """
+
+    def __init__(self):
+        self.latencies = []
+        self.codes = {}
+        self.errors = 0
+
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        return {
+            "requests": len(latencies),
+            "errors": self.errors,
+            "codes": self.codes,
+            "percentiles": [(p, percentile(latencies, p))
+                            for p in PERCENTILES],
+        }
+
+
+
+class LoadGenerator(object):
+    """
+    Makes GET requests to a list of paths, round robin, over a number of
+    concurrent persistent connections.
+    """
+
+    def __init__(self, reactor, baseURL, paths, connections=10,
+                 timer=default_timer):
+        self.baseURL = baseURL
+        self.paths = paths
+        self.connections = connections
+        self.timer = timer
+        self.pool = HTTPConnectionPool(reactor, persistent=True)
+        self.pool.maxPersistentPerHost = connections
+        self.agent = Agent(reactor, pool=self.pool)
+
+
+    @inlineCallbacks
+    def run(self, requests):
+        """
+        Make C{requests} requests.
+
+        @return: A L{Deferred} firing with a tuple of the requests per
+            second, and a dict of paths to L{PathStats}.
+        """
+        stats = {path: PathStats() for path in self.paths}
+        state = {"remaining": requests, "paths": cycle(self.paths)}
+
+        started = self.timer()
+        yield DeferredList([self._connection(state, stats)
+                            for x in xrange(self.connections)])
+        elapsed = self.timer() - started
+
+        returnValue((requests / elapsed, stats))
+
+
+    @inlineCallbacks
+    def _connection(self, state, stats):
+
+        while state["remaining"] > 0:
+            state["remaining"] -= 1
+            path = next(state["paths"])
+            pathStats = stats[path]
+            started = self.timer()
+
+            try:
+                response = yield self.agent.request(
+                    "GET", self.baseURL + path)
+                yield readBody(response)
+            except Exception:
+                pathStats.errors += 1
+                continue
+
+            pathStats.latencies.append(self.timer() - started)
+            pathStats.codes[response.code] = pathStats.codes.get(
+                response.code, 0) + 1
+
+
+    def close(self):
+        return self.pool.closeCachedConnections()
+
+
+
+def waitForPort(host, port, timeout=30, process=None):
+    """
+    Wait until something is listening on C{port}.
+
+    @param process: The C{subprocess.Popen} that should be starting to
+        listen, to stop waiting if it ends.
+    """
+    deadline = time.time() + timeout
+
+    while True:
+        try:
+            socket.create_connection((host, port), 1).close()
+            return
+        except socket.error:
+            if process is not None and process.poll() is not None:
+                raise Exception("The service ended with {}".format(
+                    process.returncode))
+            if time.time() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+
+def report(rate, stats):
+
+    print "{:,.0f} requests/s".format(rate)
+    print
+
+    header = "{:<40} {:>9} {:>7}".format("Path", "Requests", "Errors")
+    for p in PERCENTILES:
+        header += " {:>9}".format("p{:g}".format(p))
+    print header
+    print "-" * len(header)
+
+    for path in sorted(stats):
+        summary = stats[path].summary()
+        line = "{:<40} {:>9,} {:>7,}".format(
+            path, summary["requests"], summary["errors"])
+        for p, value in summary["percentiles"]:
+            line += " {:>9}".format(
+                "-" if value is None else "{:.2f}ms".format(value * 1000))
+        print line
+
+        codes = ", ".join("{}: {:,}".format(code, count)
+                          for code, count in sorted(summary["codes"].items()))
+        print "    status codes: {}".format(codes or "none")
+
+
+
+@inlineCallbacks
+def _run(reactor, options):
+
+    generator = LoadGenerator(
+        reactor, "http://{}:{}".format(options.host, options.port),
+        options.paths, connections=options.connections)
+
+    try:
+        if options.warmup:
+            yield generator.run(options.warmup)
+
+        rate, stats = yield generator.run(options.requests)
+        report(rate, stats)
+    finally:
+        yield generator.close()
+
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(
+        description="Load test a Saratoga service over loopback.")
+    parser.add_argument("paths", nargs="+",
+                        help="Paths to request, such as /v1/example.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8094)
+    parser.add_argument("--command",
+                        help="Start the service by running this, and stop "
+                             "it afterwards.")
+    parser.add_argument("--cwd", help="Run the command in this directory.")
+    parser.add_argument("--connections", type=int, default=50,
+                        help="How many connections to make requests on.")
+    parser.add_argument("--requests", type=int, default=20000,
+                        help="How many requests to measure.")
+    parser.add_argument("--warmup", type=int, default=1000,
+                        help="How many requests to make before measuring.")
+    options = parser.parse_args(argv)
+
+    process = None
+
+    if options.command:
+        process = subprocess.Popen(shlex.split(options.command),
+                                   cwd=options.cwd)
+
+    try:
+        waitForPort(options.host, options.port, process=process)
+        react(_run, [options])
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,270 @@
+"""
+Measure the throughput of the whole request pipeline, by rendering requests
+with L{saratoga.api.SaratogaResource} in-process.
+
+It covers routing with static and dynamic endpoints, request schemas,
+authentication, and response sizes. For each, it reports requests per second,
+and how many objects each request leaves behind (which should be none, once
+any caches have filled up).
+
+Run it with C{python -m saratoga.benchmark.pipeline}. To check for
+regressions, save the results from one version with C{--save FILE}, and
+compare another version with them with C{--compare FILE}.
+"""
+
+from twisted.web import server
+from twisted.web.http_headers import Headers
+from twisted.web.test.test_web import DummyChannel
+
+from saratoga.api import SaratogaAPI
+from saratoga import auth
+from saratoga.benchmark import timeIt, report, retainedObjects
+from saratoga.benchmark.schemas import itemSchema, listSchema, makeItem
+
+from base64 import b64encode
+from itertools import cycle
+from StringIO import StringIO
+
+import argparse
+import httpsig_cffi
+import json
+import sys
+
+
+def makeRequest(path, method="GET", body="", headers=None, args=None):
+    """
+    Make a request like Twisted Web would, without any mocking.
+    """
+    request = server.Request(DummyChannel(), False)
+    request.content = StringIO(body)
+    request.args = args or {}
+    request.requestHeaders = Headers(headers or {})
+    request.setHost("localhost", 8080)
+    request.uri = request.path = path
+    request.prepath = []
+    request.postpath = path.split("/")[1:]
+    request.method = method
+    request.clientproto = "HTTP/1.1"
+    return request
+
+
+
+def driver(api, requests):
+    """
+    Make a function that renders the next of C{requests} every time it's
+    called.
+
+    @param requests: A list of C{(path, method, body, headers)}.
+    """
+    resource = api.getResource()
+    requests = cycle(requests)
+
+    def render():
+        path, method, body, headers = next(requests)
+        request = makeRequest(path, method, body, headers)
+        resource.render(request)
+
+        if request.code != 200 or not request.finished:
+            raise Exception("Request to {} failed with {}".format(
+                path, request.code))
+
+    return render
+
+
+
+class Implementation(object):
+    """
+    Every endpoint goes to one of these.
+    """
+    class v1(object):
+        def static_GET(self, request, params):
+            return {"hello": "world"}
+
+        def dynamic_GET(self, request, params, itemID):
+            return {"id": itemID}
+
+        def items_POST(self, request, params):
+            return {"count": len(params["params"].get("items", []))}
+
+        def small_GET(self, request, params):
+            return makeItem(1)
+
+        def large_GET(self, request, params):
+            return [makeItem(i) for i in xrange(1000)]
+
+        def auth_GET(self, request, params):
+            return params["auth"]
+
+
+
+def makeAPI(endpoints, **kwargs):
+    users = [{"username": "alice", "password": "wonderland",
+              "canonicalUsername": "alice@example.com"}]
+
+    class ServiceClass(object):
+        auth = auth.DefaultAuthenticator(
+            auth.InMemoryStringSharedSecretSource(users))
+
+    definition = {"metadata": {"versions": [1]}, "endpoints": endpoints}
+    return SaratogaAPI(Implementation, definition, ServiceClass(), **kwargs)
+
+
+
+def routingCases():
+
+    for count in [10, 100, 1000]:
+
+        static = makeAPI([
+            {"endpoint": "static{}".format(i), "func": "static",
+             "getProcessors": [{"versions": [1]}]}
+            for i in xrange(count)])
+        yield ("static, {} endpoints".format(count), driver(static, [
+            ("/v1/static{}".format(i), "GET", "", None)
+            for i in xrange(count)]))
+
+        dynamic = makeAPI([
+            {"endpoint": r"dynamic{}/(\d+)".format(i), "func": "dynamic",
+             "getProcessors": [{"versions": [1]}]}
+            for i in xrange(count)])
+        # Enough different paths that they can't all be cached
+        yield ("dynamic, {} endpoints".format(count), driver(dynamic, [
+            ("/v1/dynamic{}/{}".format(i % count, i), "GET", "", None)
+            for i in xrange(4096)]))
+
+
+
+def schemaCases():
+
+    body = json.dumps({"items": [makeItem(i) for i in xrange(100)]})
+    requests = [("/v1/items", "POST", body, None)]
+
+    yield ("no schema", driver(makeAPI([
+        {"endpoint": "items", "postProcessors": [{"versions": [1]}]}]),
+        requests))
+
+    for engine in ["jsonschema", "compiled"]:
+        yield ("large schema ({})".format(engine), driver(makeAPI([
+            {"endpoint": "items", "postProcessors": [{
+                "versions": [1],
+                "requestSchema": listSchema,
+                "responseSchema": {"type": "object", "properties": {
+                    "count": {"type": "integer"}}}}]}],
+            validationEngine=engine), requests))
+
+    yield ("small schema (compiled)", driver(makeAPI([
+        {"endpoint": "items", "postProcessors": [{
+            "versions": [1], "requestSchema": itemSchema}]}],
+        validationEngine="compiled"),
+        [("/v1/items", "POST", json.dumps(makeItem(1)), None)]))
+
+
+
+def authCases():
+
+    api = makeAPI([{"endpoint": "auth", "requiresAuthentication": True,
+                    "getProcessors": [{"versions": [1]}]},
+                   {"endpoint": "static",
+                    "getProcessors": [{"versions": [1]}]}])
+
+    signer = httpsig_cffi.HeaderSigner("alice", "wonderland",
+                                       algorithm="hmac-sha256")
+    signed = signer.sign({"Date": "Tue, 01 Jan 2014 01:01:01 GMT"},
+                         method="GET", path="/v1/auth")
+
+    yield ("no auth", driver(api, [("/v1/static", "GET", "", None)]))
+    yield ("Basic", driver(api, [("/v1/auth", "GET", "", {
+        "Authorization": ["Basic " + b64encode("alice:wonderland")]})]))
+    yield ("HMAC", driver(api, [("/v1/auth", "GET", "", {
+        x: [y] for x, y in signed.iteritems()})]))
+
+
+
+def responseCases():
+
+    api = makeAPI([{"endpoint": "small",
+                    "getProcessors": [{"versions": [1]}]},
+                   {"endpoint": "large",
+                    "getProcessors": [{"versions": [1]}]}])
+
+    yield ("small response", driver(api, [("/v1/small", "GET", "", None)]))
+    yield ("large response (1000 items)", driver(
+        api, [("/v1/large", "GET", "", None)]))
+
+
+
+groups = [
+    ("Routing", routingCases, 5000),
+    ("Request schemas", schemaCases, 500),
+    ("Authentication", authCases, 5000),
+    ("Responses", responseCases, 200),
+]
+
+
+def run(scale=1.0):
+    """
+    Run every benchmark.
+
+    @param scale: What to multiply the number of iterations by.
+    @return: A dict of group names to lists of C{(label, requests per second,
+        retained objects per request)}.
+    """
+    results = {}
+
+    for name, cases, iterations in groups:
+        iterations = max(int(iterations * scale), 1)
+        results[name] = []
+
+        for label, render in cases():
+            # Warm up, so that caches are filled and the first request's
+            # one-off costs aren't counted
+            for x in xrange(min(iterations, 1000)):
+                render()
+
+            results[name].append((
+                label, timeIt(render, iterations),
+                retainedObjects(render, iterations)))
+
+    return results
+
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark the Saratoga request pipeline.")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="Multiply the number of iterations by this.")
+    parser.add_argument("--save", help="Save the results to this file.")
+    parser.add_argument("--compare",
+                        help="Compare the results with ones saved before.")
+    options = parser.parse_args(argv)
+
+    results = run(options.scale)
+    previous = {}
+
+    if options.compare:
+        with open(options.compare) as f:
+            previous = json.load(f)
+
+    for name, cases, iterations in groups:
+        before = dict((label, rate)
+                      for label, rate, retained in previous.get(name, []))
+        rows = []
+
+        for label, rate, retained in results[name]:
+            note = "{:+.2f} objects/req".format(retained)
+            if label in before:
+                note += ", {:+.1%} vs saved".format(
+                    rate / before[label] - 1)
+            rows.append((label, rate, note))
+
+        report(name, rows)
+
+    if options.save:
+        with open(options.save, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+
+if __name__ == "__main__":
+    sys.exit(main())
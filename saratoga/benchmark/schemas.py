@@ -0,0 +1,59 @@
+"""
+Compare the validation engines on small and large request payloads.
+"""
+
+from saratoga.benchmark import timeIt, report
+from saratoga.validation import engines
+
+import sys
+
+
+itemSchema = {
+    "type": "object",
+    "properties": {
+        "id": {"type": "integer", "minimum": 0},
+        "name": {"type": "string", "minLength": 1, "maxLength": 64},
+        "tags": {"type": "array", "items": {"type": "string"}},
+        "price": {"type": "number"},
+        "active": {"type": "boolean"}
+    },
+    "required": ["id", "name"],
+    "additionalProperties": False
+}
+
+listSchema = {
+    "type": "object",
+    "properties": {
+        "items": {"type": "array", "items": itemSchema},
+        "cursor": {"type": ["string", "null"]}
+    },
+    "required": ["items"]
+}
+
+
+def makeItem(i):
+    return {"id": i, "name": "item {}".format(i), "tags": ["a", "b", "c"],
+            "price": i * 1.5, "active": bool(i % 2)}
+
+
+payloads = [
+    ("small", itemSchema, makeItem(1), 20000),
+    ("large (1000 items)", listSchema,
+     {"items": [makeItem(i) for i in xrange(1000)], "cursor": None}, 50),
+    ("invalid", itemSchema, {"id": -1, "extra": True}, 20000),
+]
+
+
+def main():
+    for label, schema, payload, iterations in payloads:
+        results = []
+        for name in sorted(engines):
+            validator = engines[name](schema)
+            results.append((name, timeIt(
+                lambda: validator.check(payload), iterations)))
+        report("Validating {} payload".format(label), results)
+
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,39 @@
+"""
+Compare verifying HMAC-signed requests with httpsig_cffi and with
+L{saratoga.signatures.SignatureVerifier}.
+"""
+
+from saratoga.benchmark import timeIt, report
+from saratoga.signatures import SignatureVerifier, parseSignatureHeader
+from saratoga.test.test_signatures import signedRequest
+
+from httpsig_cffi import verify
+
+import sys
+
+
+def main():
+    request, _ = signedRequest(
+        headers=["date", "host", "(request-target)"])
+    verifier = SignatureVerifier()
+
+    def httpsig():
+        head = {x.lower(): y[0]
+                for x, y in request.requestHeaders.getAllRawHeaders()}
+        assert verify.HeaderVerifier(headers=head, secret="secret",
+                                     method=request.method,
+                                     path=request.path).verify()
+
+    def saratoga():
+        signature = parseSignatureHeader(request.getHeader("Authorization"))
+        verifier.verify(signature, "secret", request)
+
+    report("Verifying a signed request", [
+        ("httpsig_cffi", timeIt(httpsig, 20000)),
+        ("SignatureVerifier", timeIt(saratoga, 20000)),
+    ])
+
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,237 @@
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    A bounded mapping that evicts the least recently used entry when full.
+    """
+
+    def __init__(self, maxSize):
+        self.maxSize = maxSize
+        self._entries = OrderedDict()
+
+
+    def get(self, key, default=None):
+        """
+        Get C{key} from the cache, marking it as recently used.
+        """
+        try:
+            value = self._entries.pop(key)
+        except KeyError:
+            return default
+
+        self._entries[key] = value
+        return value
+
+
+    def set(self, key, value):
+        """
+        Put C{key} into the cache, evicting the oldest entry if it is full.
+        """
+        self._entries.pop(key, None)
+        self._entries[key] = value
+
+        if len(self._entries) > self.maxSize:
+            self._entries.popitem(last=False)
+
+
+    def pop(self, key, default=None):
+        return self._entries.pop(key, default)
+
+
+    def clear(self):
+        self._entries.clear()
+
+
+    def keys(self):
+        return self._entries.keys()
+
+
+    def __contains__(self, key):
+        return key in self._entries
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+
+class ExpiringCache(object):
+    """
+    An L{LRUCache} whose entries are forgotten after a time.
+    """
+
+    def __init__(self, maxSize, clock=None):
+        """
+        @param clock: An C{IReactorTime} provider, for checking expiry.
+        """
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self.clock = clock
+        self._entries = LRUCache(maxSize)
+
+
+    def get(self, key, default=None):
+        """
+        Get C{key} from the cache, if it hasn't expired.
+        """
+        entry = self._entries.get(key)
+
+        if entry is not None:
+            expires, value = entry
+
+            if expires > self.clock.seconds():
+                return value
+
+            self._entries.pop(key)
+
+        return default
+
+
+    def set(self, key, value, ttl):
+        """
+        Put C{key} into the cache for C{ttl} seconds.
+        """
+        self._entries.set(key, (self.clock.seconds() + ttl, value))
+
+
+    def pop(self, key, default=None):
+        entry = self._entries.pop(key)
+        return default if entry is None else entry[1]
+
+
+    def clear(self):
+        self._entries.clear()
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+
+def _freeze(value):
+    """
+    Make C{value}, which may have come from any input format, into something
+    hashable that is equal for equal values.
+    """
+    if isinstance(value, dict):
+        return (dict, tuple(sorted(
+            (k, _freeze(v)) for k, v in value.iteritems())))
+    elif isinstance(value, (list, tuple)):
+        return (list, tuple(_freeze(v) for v in value))
+    elif isinstance(value, (set, frozenset)):
+        return (set, frozenset(_freeze(v) for v in value))
+
+    try:
+        hash(value)
+    except TypeError:
+        return (type(value), repr(value))
+
+    return value
+
+
+
+class ResponseCache(object):
+    """
+    Serialised responses of a GET processor, so that repeat calls can be
+    answered without running the implementation again.
+
+    Responses are keyed by the API version, the groups captured from the
+    path, and the chosen params and auth fields. Each key holds the response
+    for every variant (such as the output format and content encoding) that
+    has been asked for.
+    """
+
+    def __init__(self, ttl, params=None, auth=None, maxEntries=1000,
+                 clock=None):
+        """
+        @param ttl: How many seconds a response is served from the cache.
+        @param params: The names of the params that change the response, or
+            C{None} to use all of them.
+        @param auth: The names of the auth fields (eg. C{"username"}) that
+            change the response, or C{None} to use all of them.
+        @param maxEntries: How many keys to keep responses for.
+        @param clock: An C{IReactorTime} provider, for checking expiry.
+        """
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self.ttl = ttl
+        self.params = params
+        self.auth = auth
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = LRUCache(maxEntries)
+
+
+    def key(self, version, args=(), params=None, auth=None):
+        """
+        Make the key for a call.
+        """
+        params = params or {}
+
+        if self.params is not None:
+            params = {k: params[k] for k in self.params if k in params}
+        if self.auth is not None and auth is not None:
+            auth = {k: auth[k] for k in self.auth if k in auth}
+
+        return (version, tuple(args), _freeze(params), _freeze(auth))
+
+
+    def get(self, key, variant):
+        """
+        Get the cached response for C{key} in C{variant} (eg. the output
+        format), or C{None}.
+        """
+        variants = self._entries.get(key)
+        response = variants and variants.get(variant)
+
+        if response is not None:
+            expires, body = response
+
+            if expires > self.clock.seconds():
+                self.hits += 1
+                return body
+
+            del variants[variant]
+
+        self.misses += 1
+        return None
+
+
+    def set(self, key, variant, body):
+        """
+        Cache C{body} as the response for C{key} in C{variant}.
+        """
+        variants = self._entries.get(key)
+
+        if variants is None:
+            variants = {}
+            self._entries.set(key, variants)
+
+        variants[variant] = (self.clock.seconds() + self.ttl, body)
+
+
+    def invalidate(self, version, args=(), params=None, auth=None):
+        """
+        Forget the cached response for a call, in every variant.
+        """
+        self._entries.pop(self.key(version, args, params, auth))
+
+
+    def clear(self, version=None):
+        """
+        Forget every cached response, or only those for C{version}.
+        """
+        if version is None:
+            self._entries.clear()
+        else:
+            for key in self._entries.keys():
+                if key[0] == version:
+                    self._entries.pop(key)
+
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,135 @@
+"""
+Compressing responses with gzip or deflate, negotiated from the request's
+C{Accept-Encoding} header.
+"""
+
+from saratoga.cache import LRUCache
+
+import zlib
+
+_missing = object()
+
+# The window bits that make zlib write each format
+_wbits = {
+    "gzip": 16 + zlib.MAX_WBITS,
+    "deflate": zlib.MAX_WBITS,
+}
+
+
+class Compression(object):
+    """
+    How responses are compressed.
+    """
+
+    def __init__(self, minimumSize=1024, level=6,
+                 encodings=("gzip", "deflate"), cacheSize=256):
+        """
+        @param minimumSize: The smallest response, in bytes, that is
+            compressed. Smaller ones aren't worth the time, and can end up
+            bigger. Streamed responses are always compressed.
+        @param level: The zlib compression level, from 1 (fastest) to 9
+            (smallest).
+        @param encodings: The encodings to offer, most preferred first.
+        @param cacheSize: How many different C{Accept-Encoding} headers to
+            remember the negotiated encoding of.
+        """
+        for encoding in encodings:
+            if encoding not in _wbits:
+                raise ValueError("Unknown encoding {}".format(encoding))
+
+        self.minimumSize = minimumSize
+        self.level = level
+        self.encodings = list(encodings)
+        self._negotiated = LRUCache(cacheSize)
+
+
+    def negotiate(self, request):
+        """
+        Get the encoding to compress the response to C{request} with, or
+        C{None} if it shouldn't be.
+
+        Like output formats, results are cached by the raw header.
+        """
+        header = request.requestHeaders.getRawHeaders(
+            "Accept-Encoding", [None])[0]
+
+        if header is None:
+            return None
+
+        encoding = self._negotiated.get(header, _missing)
+
+        if encoding is _missing:
+            encoding = self._negotiate(header)
+            self._negotiated.set(header, encoding)
+
+        return encoding
+
+
+    def _negotiate(self, header):
+
+        qualities = {}
+
+        for item in header.split(","):
+            parts = item.split(";")
+            name = parts[0].strip().lower()
+            quality = 1.0
+
+            for param in parts[1:]:
+                key, _, value = param.partition("=")
+                if key.strip().lower() == "q":
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+
+            if name:
+                qualities[name] = quality
+
+        best, bestQuality = None, 0.0
+
+        for encoding in self.encodings:
+            quality = qualities.get(encoding, qualities.get("*", 0.0))
+            if quality > bestQuality:
+                best, bestQuality = encoding, quality
+
+        return best
+
+
+    def compressor(self, encoding):
+        """
+        Make a zlib compression object for C{encoding}.
+        """
+        return zlib.compressobj(self.level, zlib.DEFLATED, _wbits[encoding])
+
+
+    def encode(self, encoding, body):
+        """
+        Compress C{body} with C{encoding}, if it's big enough to be worth it.
+
+        @return: A tuple of the C{Content-Encoding} (or C{None}, if it wasn't
+            compressed), and the body.
+        """
+        if len(body) < self.minimumSize:
+            return None, body
+
+        compressor = self.compressor(encoding)
+        return encoding, compressor.compress(body) + compressor.flush()
+
+
+    def encodeChunks(self, encoding, chunks):
+        """
+        Compress the strings from C{chunks} with C{encoding}, as they come.
+        """
+        compressor = self.compressor(encoding)
+
+        try:
+            for chunk in chunks:
+                data = compressor.compress(chunk)
+                if data:
+                    yield data
+        finally:
+            close = getattr(chunks, "close", None)
+            if close:
+                close()
+
+        yield compressor.flush()
@@ -0,0 +1,130 @@
+from saratoga import BadRequestParams
+
+from io import BytesIO
+from urlparse import parse_qs
+
+try:
+    import msgpack
+except ImportError: # pragma: no cover
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError: # pragma: no cover
+    cbor2 = None
+
+
+class InputRegistry(object):
+    """
+    Parsers for request bodies, picked by their C{Content-Type}.
+    """
+
+    def __init__(self, defaultInputFormat):
+        """
+        @param defaultInputFormat: The format that bodies which don't say
+            what they are, or are something without a parser, are parsed
+            as. If they aren't valid, they are ignored.
+        """
+        self._parsers = {}
+        self.defaultInputFormat = defaultInputFormat
+
+
+    def getParser(self, contentType):
+        """
+        Get the parser for C{contentType}, a C{Content-Type} header which
+        may have parameters, or C{None} if there isn't one.
+        """
+        return self._parsers.get(contentType.split(";", 1)[0].strip().lower())
+
+
+    def parse(self, request, body):
+        """
+        Parse C{body}, the body of C{request}, according to its
+        C{Content-Type}.
+
+        @return: The parsed body, or C{None} if it is empty, or isn't valid
+            and didn't say what it is.
+        @raise BadRequestParams: If the body isn't valid, but said what it
+            is.
+        """
+        if not body:
+            return None
+
+        contentType = request.getHeader("Content-Type")
+        parser = self.getParser(contentType) if contentType else None
+
+        if parser is not None:
+            try:
+                return parser(body)
+            except ValueError:
+                raise BadRequestParams(
+                    "Request body is not valid {}.".format(
+                        contentType.split(";", 1)[0].strip()))
+
+        try:
+            return self._parsers[self.defaultInputFormat](body)
+        except ValueError:
+            return None
+
+
+    def register(self, contentType, func):
+        """
+        Register a parser for request bodies.
+
+        @param func: A function which takes the body, and returns what it
+            was parsed into, raising C{ValueError} if it isn't valid.
+        """
+        self._parsers[contentType.lower()] = func
+
+def loadFormURLEncoded(body, jsonLoads=None):
+    """
+    Parse an C{application/x-www-form-urlencoded} request body, with keys
+    that are only given once having a single value, like query arguments.
+
+    @param jsonLoads: If given, bodies that are a JSON object are parsed with
+        it instead, since many clients (such as C{curl -d}) say that JSON
+        they send is form data.
+    """
+    if jsonLoads is not None and body.lstrip()[:1] == "{":
+        try:
+            return jsonLoads(body)
+        except ValueError:
+            pass
+
+    params = parse_qs(body, keep_blank_values=True)
+
+    for key, val in params.iteritems():
+        if len(val) == 1:
+            params[key] = val[0]
+
+    return params
+
+def loadMessagePack(body):
+    """
+    Parse a MessagePack request body, with text as C{unicode} like JSON.
+
+    @raise ValueError: If it isn't valid MessagePack.
+    """
+    try:
+        return msgpack.unpackb(body, raw=False)
+    except (ValueError, TypeError, msgpack.UnpackException) as e:
+        raise ValueError(str(e))
+
+def loadCBOR(body):
+    """
+    Parse a CBOR request body.
+
+    @raise ValueError: If it isn't valid CBOR, or has anything after the
+        first value.
+    """
+    fp = BytesIO(body)
+
+    try:
+        result = cbor2.CBORDecoder(fp).decode()
+    except (ValueError, TypeError, cbor2.CBORDecodeError) as e:
+        raise ValueError(str(e))
+
+    if fp.tell() != len(body):
+        raise ValueError("Extra data after the CBOR value.")
+
+    return result
@@ -0,0 +1,90 @@
+"""
+Codecs for parsing request bodies and serialising responses as JSON.
+
+The stdlib's json module is always there, but request bodies are parsed with
+ujson when it is installed. Responses are always serialised by json, so that
+their bytes are the same wherever Saratoga runs, even though ujson is faster
+at it.
+
+simplejson isn't used, since it parses ASCII strings into C{str} rather than
+C{unicode}, which changes the params implementations are given and the text
+of validation errors.
+"""
+
+import json
+
+
+class JSONCodec(object):
+    """
+    A pair of functions for decoding and encoding JSON.
+    """
+
+    def __init__(self, name, loads, dumps):
+        """
+        @param loads: Parses a string of JSON, raising C{ValueError} if it
+            isn't valid.
+        @param dumps: Serialises an object, taking the same keyword arguments
+            as C{json.dumps}, and giving exactly the same output.
+        """
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+
+
+    def __repr__(self):
+        return "<JSONCodec {}>".format(self.name)
+
+
+
+stdlibCodec = JSONCodec("json", json.loads, json.dumps)
+
+
+def _ujsonLoads():
+    """
+    Get ujson's C{loads}, if it's installed and parses floats exactly like
+    json does.
+    """
+    try:
+        import ujson
+    except ImportError:
+        return None
+
+    try:
+        ujson.loads("1.1", precise_float=True)
+    except TypeError:
+        # ujson 2 dropped precise_float, and is always precise
+        precise = ujson.loads
+    else:
+        precise = lambda s: ujson.loads(s, precise_float=True)
+
+    probe = "[0.0495435087091941, 9.385958677423489e-12, 0.1]"
+
+    if precise(probe) != json.loads(probe):
+        return None
+
+    def loads(s):
+        try:
+            return precise(s)
+        except (ValueError, OverflowError):
+            # ujson can't do integers bigger than 64 bits, so let json have a
+            # go, which will also give the usual error for bad JSON
+            return json.loads(s)
+
+    return loads
+
+
+
+def findCodec():
+    """
+    Make the fastest codec with the installed libraries.
+    """
+    loads = _ujsonLoads()
+
+    if loads:
+        return JSONCodec("ujson", loads, json.dumps)
+
+    return stdlibCodec
+
+
+
+defaultCodec = findCodec()
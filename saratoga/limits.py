@@ -0,0 +1,256 @@
+"""
+Limits on how many requests an endpoint handles at once, how often each
+user can make them, and how large their bodies can be.
+"""
+
+from saratoga import ServiceUnavailable, TooManyRequests
+
+from twisted.internet.defer import Deferred, succeed
+from twisted.web.server import Request, Site
+
+from collections import deque
+import json
+
+
+class ConcurrencyLimiter(object):
+    """
+    Lets C{maxConcurrent} requests run at once, queueing up to C{maxQueued}
+    more, and turning away the rest with L{ServiceUnavailable}.
+
+    @ivar active: How many requests are running.
+    @ivar shed: How many requests have been turned away.
+    """
+
+    def __init__(self, maxConcurrent, maxQueued=0, retryAfter=1):
+        """
+        @param retryAfter: The C{Retry-After}, in seconds, to give requests
+            that are turned away.
+        """
+        self.maxConcurrent = maxConcurrent
+        self.maxQueued = maxQueued
+        self.retryAfter = retryAfter
+        self.active = 0
+        self.shed = 0
+        self._waiting = deque()
+
+
+    @property
+    def queued(self):
+        """
+        How many requests are waiting to run.
+        """
+        return len(self._waiting)
+
+
+    def acquire(self):
+        """
+        Wait for a turn to run.
+
+        @return: A L{Deferred} that fires when it's this request's turn.
+            Cancelling it gives up its place in the queue.
+        @raise ServiceUnavailable: If the queue is full.
+        """
+        if self.active < self.maxConcurrent:
+            self.active += 1
+            return succeed(None)
+
+        if len(self._waiting) >= self.maxQueued:
+            self.shed += 1
+            raise ServiceUnavailable(
+                "Service unavailable, try again later.",
+                retryAfter=self.retryAfter)
+
+        d = Deferred(self._waiting.remove)
+        self._waiting.append(d)
+        return d
+
+
+    def release(self):
+        """
+        Finish a turn, letting the next request in the queue run.
+        """
+        if self._waiting:
+            self._waiting.popleft().callback(None)
+        else:
+            self.active -= 1
+
+
+    def hold(self, request):
+        """
+        Wait for a turn for C{request}, which ends when the request finishes.
+        If the request is lost while it's queued, it gives up its place.
+
+        @return: See L{acquire}.
+        @raise ServiceUnavailable: See L{acquire}.
+        """
+        d = self.acquire()
+        running = []
+
+        def _running(result):
+            running.append(True)
+            return result
+
+        def _finished(_):
+            if running:
+                self.release()
+            else:
+                d.cancel()
+
+        d.addCallback(_running)
+        request.notifyFinish().addBoth(_finished)
+        return d
+
+
+
+class RateLimiter(object):
+    """
+    Lets each user make C{requests} requests every C{seconds} seconds, in
+    bursts of up to C{burst} at once, and turns away the rest with
+    L{TooManyRequests}.
+
+    Each user has a token bucket, which is stored as just the time that it
+    will be full again. Buckets that have been idle long enough to fill up
+    are the same as new ones, so they are forgotten: the buckets are kept in
+    two generations, and each time a bucket's fill time passes, the older
+    one is thrown away. Memory is only used for users seen recently.
+
+    @ivar limited: How many requests have been turned away.
+    """
+
+    def __init__(self, requests, seconds=1, burst=None, clock=None):
+        """
+        @param burst: How many requests can be made at once, after not
+            making any for a while. Defaults to C{requests}.
+        @param clock: An L{twisted.internet.interfaces.IReactorTime} to tell
+            the time with. Defaults to the global reactor.
+        """
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self.interval = seconds / float(requests)
+        self.burst = burst or requests
+        self.limited = 0
+        self._clock = clock
+        self._fillTime = self.interval * self.burst
+        self._current = {}
+        self._previous = {}
+        self._rotateAt = 0
+
+
+    @property
+    def buckets(self):
+        """
+        How many users' buckets are being kept.
+        """
+        return len(self._current) + len(self._previous)
+
+
+    def take(self, key):
+        """
+        Take a token from C{key}'s bucket.
+
+        @raise TooManyRequests: If it's empty.
+        """
+        now = self._clock.seconds()
+
+        if now >= self._rotateAt:
+            # Everything in the older generation has been idle since before
+            # the last rotation, so its buckets are full
+            if now >= self._rotateAt + self._fillTime:
+                self._previous = {}
+            else:
+                self._previous = self._current
+            self._current = {}
+            self._rotateAt = now + self._fillTime
+
+        full = self._current.get(key)
+
+        if full is None:
+            full = self._previous.pop(key, now)
+
+        full = max(full, now)
+        wait = full + self.interval - now - self._fillTime
+
+        if wait > 0:
+            self._current[key] = full
+            self.limited += 1
+            raise TooManyRequests("Too many requests, try again later.",
+                                  retryAfter=wait)
+
+        self._current[key] = full + self.interval
+
+
+
+class BodySizeLimitedRequest(Request):
+    """
+    A request that turns away a body larger than its site's C{maxBodySize}
+    as it arrives, rather than reading all of it first. It is answered with
+    a 413 and the connection is closed, without being rendered.
+    """
+    _received = 0
+    _refused = False
+
+    def gotLength(self, length):
+        maxBodySize = self.channel.site.maxBodySize
+
+        if (maxBodySize is not None and length is not None
+                and length > maxBodySize):
+            # It says it's too big, so say no before any of it is sent, and
+            # don't ask for it either
+            self.requestHeaders.removeHeader("Expect")
+            self._refuse()
+            length = 0
+
+        Request.gotLength(self, length)
+
+
+    def handleContentChunk(self, data):
+        if self._refused:
+            return
+
+        maxBodySize = self.channel.site.maxBodySize
+        self._received += len(data)
+
+        if maxBodySize is not None and self._received > maxBodySize:
+            self._refuse()
+        else:
+            Request.handleContentChunk(self, data)
+
+
+    def requestReceived(self, command, path, version):
+        # The rest of the body may have come in along with the part that
+        # was too much
+        if not self._refused:
+            Request.requestReceived(self, command, path, version)
+
+
+    def _refuse(self):
+        """
+        Answer with a 413, and hang up.
+        """
+        self._refused = True
+        body = json.dumps(
+            {"status": "fail", "data": "Request body is too large."})
+        self.channel.transport.write(
+            "HTTP/1.1 413 Request Entity Too Large\r\n"
+            "Content-Type: application/json\r\n"
+            "Content-Length: %d\r\n"
+            "Connection: close\r\n\r\n%s" % (len(body), body))
+        self.channel.loseConnection()
+
+
+
+class BodySizeLimitedSite(Site):
+    """
+    A L{Site} that turns away request bodies larger than C{maxBodySize}
+    bytes as they arrive, with L{BodySizeLimitedRequest}.
+    """
+    requestFactory = BodySizeLimitedRequest
+
+    def __init__(self, resource, maxBodySize=None, *args, **kwargs):
+        """
+        @param maxBodySize: The largest request body, in bytes, that will be
+            read. C{None} means there is no limit.
+        """
+        Site.__init__(self, resource, *args, **kwargs)
+        self.maxBodySize = maxBodySize
@@ -0,0 +1,263 @@
+"""
+In-process request metrics, kept per route, and a resource that serves them
+in the Prometheus text format.
+"""
+
+from twisted.web.resource import Resource
+
+from bisect import bisect_left
+
+# In seconds, like Prometheus' client libraries
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram(object):
+    """
+    Counts of observations that fell into each bucket.
+    """
+    __slots__ = ["buckets", "counts", "count", "sum"]
+
+    def __init__(self, buckets):
+        """
+        @param buckets: The upper bounds of the buckets, in ascending order.
+        """
+        self.buckets = buckets
+        # The last one is for everything above the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+    def cumulativeCounts(self):
+        """
+        @return: A list of C{(upper bound, count)}, where each count includes
+            every observation at or below that bound, ending with C{+Inf}.
+        """
+        total = 0
+        result = []
+
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            result.append((bound, total))
+
+        return result
+
+
+
+class RouteMetrics(object):
+    """
+    The metrics for one route.
+    """
+    __slots__ = ["codes", "latency"]
+
+    def __init__(self, buckets):
+        self.codes = {}
+        self.latency = Histogram(buckets)
+
+
+
+class Metrics(object):
+    """
+    Request counts, status codes and latencies, for each route.
+
+    Routes are keyed by C{(method, version, endpoint)}. Requests that didn't
+    resolve to a route are all kept under a version and endpoint of C{None},
+    and ones with methods the API doesn't serve under a method of C{other},
+    so that made up requests can't make the metrics grow.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        @param buckets: The upper bounds of the latency histogram buckets, in
+            seconds.
+        """
+        self.buckets = tuple(buckets)
+        self.routes = {}
+        self.limiters = {}
+        self.threadPools = {}
+
+
+    def record(self, method, version, endpoint, code, duration):
+        """
+        Record a finished request.
+
+        @param duration: How long it took, in seconds.
+        """
+        key = (method, version, endpoint)
+        route = self.routes.get(key)
+
+        if route is None:
+            route = self.routes[key] = RouteMetrics(self.buckets)
+
+        route.codes[code] = route.codes.get(code, 0) + 1
+        route.latency.observe(duration)
+
+
+    def trackLimiter(self, route, limiter):
+        """
+        Report how many requests are running, queued and turned away by
+        C{limiter}.
+
+        @param route: The C{(method, version, endpoint)} it limits.
+        @param limiter: A L{saratoga.limits.ConcurrencyLimiter}.
+        """
+        self.limiters[route] = limiter
+
+
+    def trackThreadPool(self, pool):
+        """
+        Report how long calls wait for C{pool}'s threads, and how busy they
+        are.
+
+        @param pool: A L{saratoga.threadpools.BlockingPool}.
+        """
+        self.threadPools[pool.name] = pool
+
+
+    def prometheus(self):
+        """
+        Render the metrics in the Prometheus text exposition format.
+        """
+        lines = [
+            "# HELP saratoga_requests_total Requests handled, by route and "
+            "status code.",
+            "# TYPE saratoga_requests_total counter"]
+
+        routes = sorted(self.routes.iteritems())
+
+        for key, route in routes:
+            for code, count in sorted(route.codes.iteritems()):
+                lines.append("saratoga_requests_total{{{},code=\"{}\"}} {}"
+                             .format(_labels(key), code, count))
+
+        lines.extend([
+            "# HELP saratoga_request_duration_seconds How long requests took "
+            "to handle, by route.",
+            "# TYPE saratoga_request_duration_seconds histogram"])
+
+        for key, route in routes:
+            lines.extend(_histogram("saratoga_request_duration_seconds",
+                                    _labels(key), route.latency))
+
+        limiters = sorted(self.limiters.iteritems())
+
+        for name, kind, description, attribute in _limiterMetrics:
+            if not limiters:
+                break
+
+            lines.extend(["# HELP {} {}".format(name, description),
+                          "# TYPE {} {}".format(name, kind)])
+
+            for key, limiter in limiters:
+                lines.append("{}{{{}}} {}".format(
+                    name, _labels(key), getattr(limiter, attribute)))
+
+        pools = sorted(self.threadPools.iteritems())
+
+        if pools:
+            lines.extend([
+                "# HELP saratoga_threadpool_queue_wait_seconds How long "
+                "calls waited for a thread, by pool.",
+                "# TYPE saratoga_threadpool_queue_wait_seconds histogram"])
+
+            for name, pool in pools:
+                lines.extend(_histogram(
+                    "saratoga_threadpool_queue_wait_seconds",
+                    'pool="{}"'.format(_escape(name)), pool.queueWait))
+
+        for name, kind, description, attribute in _threadPoolMetrics:
+            if not pools:
+                break
+
+            lines.extend(["# HELP {} {}".format(name, description),
+                          "# TYPE {} {}".format(name, kind)])
+
+            for poolName, pool in pools:
+                lines.append('{}{{pool="{}"}} {}'.format(
+                    name, _escape(poolName),
+                    _number(getattr(pool, attribute))))
+
+        return "\n".join(lines) + "\n"
+
+
+
+_limiterMetrics = [
+    ("saratoga_requests_active", "gauge",
+     "Requests running, by route.", "active"),
+    ("saratoga_requests_queued", "gauge",
+     "Requests waiting to run, by route.", "queued"),
+    ("saratoga_requests_shed_total", "counter",
+     "Requests turned away because the queue was full, by route.", "shed"),
+]
+
+_threadPoolMetrics = [
+    ("saratoga_threadpool_threads", "gauge",
+     "The most threads that can run at once, by pool.", "size"),
+    ("saratoga_threadpool_busy_threads", "gauge",
+     "Threads running a call, by pool.", "busy"),
+    ("saratoga_threadpool_queued_calls", "gauge",
+     "Calls waiting for a thread, by pool.", "queued"),
+    ("saratoga_threadpool_busy_seconds_total", "counter",
+     "Time spent running calls, summed over threads, by pool.", "busyTime"),
+]
+
+
+def _histogram(name, labels, histogram):
+    """
+    Render the lines of a L{Histogram}.
+    """
+    lines = []
+
+    for bound, count in histogram.cumulativeCounts():
+        lines.append("{}_bucket{{{},le=\"{}\"}} {}".format(
+            name, labels, _number(bound), count))
+
+    lines.append("{}_sum{{{}}} {}".format(name, labels, repr(histogram.sum)))
+    lines.append("{}_count{{{}}} {}".format(name, labels, histogram.count))
+    return lines
+
+
+
+def _labels(key):
+    method, version, endpoint = key
+    return 'method="{}",version="{}",endpoint="{}"'.format(
+        _escape(method), "" if version is None else version,
+        _escape(endpoint or ""))
+
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace(
+        '"', '\\"')
+
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(value)
+
+
+
+class MetricsResource(Resource):
+    """
+    Serves L{Metrics} in the Prometheus text format, for scraping.
+    """
+    isLeaf = True
+
+    def __init__(self, metrics):
+        Resource.__init__(self)
+        self.metrics = metrics
+
+
+    def render_GET(self, request):
+        request.setHeader("Content-Type", "text/plain; version=0.0.4; "
+                          "charset=utf-8")
+        return self.metrics.prometheus()
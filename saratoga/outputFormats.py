@@ -1,46 +1,141 @@
 from negotiator import ContentNegotiator, AcceptParameters, ContentType
-import json
+from saratoga.cache import LRUCache
+from saratoga.jsoncodec import defaultCodec
+
+from io import BytesIO
+
+try:
+    import msgpack
+except ImportError: # pragma: no cover
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError: # pragma: no cover
+    cbor2 = None
+
+_missing = object()
 
 
 class OutputRegistry(object):
 
-    def __init__(self, defaultOutputFormat):
+    def __init__(self, defaultOutputFormat, cacheSize=256):
         self._outputFormats = {}
+        self._streamingOutputFormats = {}
+        self._contentTypes = {}
         self._outputFormatsPreference = []
+        self._negotiated = LRUCache(cacheSize)
         self.defaultOutputFormat = defaultOutputFormat
 
-    def getFormat(self, request):
 
+    @property
+    def defaultOutputFormat(self):
+        return self._defaultOutputFormat
+
+
+    @defaultOutputFormat.setter
+    def defaultOutputFormat(self, value):
+        self._defaultOutputFormat = value
+        self._buildNegotiator()
+
+
+    def _buildNegotiator(self):
+        """
+        Build the negotiator for the registered formats, and forget anything
+        negotiated with the old one.
+        """
         defaultOutput = AcceptParameters(
             ContentType(self.defaultOutputFormat, params='q=0'))
 
         acceptable = [defaultOutput] + [AcceptParameters(ContentType(x)) for x in self._outputFormatsPreference]
 
-        cn = ContentNegotiator(defaultOutput, acceptable)
-        if request.requestHeaders.hasHeader("Accept"):
-            kwargs = {"accept": request.requestHeaders.getRawHeaders("Accept")[0]}
-        else:
-            kwargs = {}
+        self._negotiator = ContentNegotiator(defaultOutput, acceptable)
+        self._negotiated.clear()
+
+
+    def getFormat(self, request):
+        """
+        Get the output format to use for C{request}, from its Accept header.
+
+        Results are cached by the raw header, since real clients only ever
+        send a handful of different ones.
+        """
+        accept = request.requestHeaders.getRawHeaders("Accept", [None])[0]
+        outputFormat = self._negotiated.get(accept, _missing)
 
-        accp = cn.negotiate(**kwargs)
+        if outputFormat is _missing:
+            if accept is not None:
+                kwargs = {"accept": accept}
+            else:
+                kwargs = {}
 
-        return str(accp.content_type) if accp else None
+            accp = self._negotiator.negotiate(**kwargs)
+            outputFormat = str(accp.content_type) if accp else None
+            self._negotiated.set(accept, outputFormat)
 
+        return outputFormat
 
-    def renderAutomaticResponse(self, request, status, data):
 
-        f = self.getFormat(request)
+    def renderAutomaticResponse(self, request, status, data,
+                                outputFormat=None):
+        """
+        Render C{data} with the given JSend C{status}.
+
+        @param outputFormat: The format to render in, if it has already been
+            negotiated for this request.
+        """
+        f = outputFormat or self.getFormat(request)
         return self._outputFormats[f](status, data)
 
 
-    def register(self, acceptHeader, func):
+    def renderStreamingResponse(self, request, status, items,
+                                outputFormat=None):
+        """
+        Render the list made of C{items} with the given JSend C{status}, a
+        piece at a time.
+
+        @return: An iterable of strings. If the output format can't be
+            streamed, it will have the whole response as one string.
+        """
+        f = outputFormat or self.getFormat(request)
+        streamingFunc = self._streamingOutputFormats.get(f)
+
+        if streamingFunc is None:
+            return [self._outputFormats[f](status, list(items))]
+
+        return streamingFunc(status, items)
+
+
+    def getContentType(self, outputFormat):
+        """
+        Get the C{Content-Type} header for responses in C{outputFormat}.
+        """
+        return self._contentTypes[outputFormat]
+
+
+    def register(self, acceptHeader, func, streamingFunc=None, binary=False):
         """
         Register an output format.
+
+        @param streamingFunc: Optionally, a function which takes a status and
+            an iterable, and returns an iterable of strings that together make
+            the same response as C{func} would for a list of the items.
+        @param binary: Whether the format is binary, rather than UTF-8 text,
+            so its C{Content-Type} doesn't have a charset.
         """
         self._outputFormats[acceptHeader] = func
+        self._contentTypes[acceptHeader] = (
+            acceptHeader if binary else acceptHeader + "; charset=utf-8")
         self._outputFormatsPreference.append(acceptHeader)
 
-def JSendJSONOutputFormat(status, data):
+        if streamingFunc:
+            self._streamingOutputFormats[acceptHeader] = streamingFunc
+        else:
+            self._streamingOutputFormats.pop(acceptHeader, None)
+
+        self._buildNegotiator()
+
+def JSendJSONOutputFormat(status, data, codec=defaultCodec):
     """
     Implements the JSend output format, serialised to JSON.
     """
@@ -50,13 +145,100 @@ def JSendJSONOutputFormat(status, data):
         "data": data
     }
 
-    return json.dumps(resp)
+    return codec.dumps(resp)
+
+def JSendJSONStreamingOutputFormat(status, items, codec=defaultCodec):
+    """
+    Implements the JSend output format, serialised to JSON an item at a time.
+    The result is the same as L{JSendJSONOutputFormat} for a list of the
+    items.
+    """
+    prefix, suffix = codec.dumps({
+        "status": status,
+        "data": []
+    }).rsplit("[]", 1)
+
+    yield prefix + "["
+
+    separator = ""
+    for item in items:
+        yield separator + codec.dumps(item)
+        separator = ", "
+
+    yield "]" + suffix
+
+def DebuggableJSendJSONOutputFormat(status, data, codec=defaultCodec):
+
+    resp = {
+        "status": status,
+        "data": data
+    }
+
+    return codec.dumps(resp, sort_keys=True, indent=4, separators=(',', ': '))
+
+def JSendMessagePackOutputFormat(status, data):
+    """
+    Implements the JSend output format, serialised to MessagePack. Byte
+    strings are written as text, like they are in JSON.
+    """
+
+    resp = {
+        "status": status,
+        "data": data
+    }
+
+    return msgpack.packb(resp, use_bin_type=False)
 
-def DebuggableJSendJSONOutputFormat(status, data):
+def _decodeText(obj):
+    """
+    Make the byte strings in C{obj} text. cbor2 writes byte strings as CBOR
+    byte strings, but they are text everywhere else in Saratoga.
+    """
+    if isinstance(obj, str):
+        return obj.decode("utf-8")
+    elif isinstance(obj, dict):
+        return {_decodeText(k): _decodeText(v) for k, v in obj.iteritems()}
+    elif isinstance(obj, (list, tuple)):
+        return [_decodeText(x) for x in obj]
+
+    return obj
+
+def _dumpCBOR(fp, obj):
+    cbor2.dump(_decodeText(obj), fp)
+
+def JSendCBOROutputFormat(status, data):
+    """
+    Implements the JSend output format, serialised to CBOR. Byte strings are
+    written as text, like they are in JSON.
+    """
 
     resp = {
         "status": status,
         "data": data
     }
 
-    return json.dumps(resp, sort_keys=True, indent=4, separators=(',', ': '))
+    fp = BytesIO()
+    _dumpCBOR(fp, resp)
+    return fp.getvalue()
+
+def JSendCBORStreamingOutputFormat(status, items):
+    """
+    Implements the JSend output format, serialised to CBOR an item at a time,
+    with the items in an indefinite-length array.
+    """
+    fp = BytesIO()
+    # A map of two pairs, the last of which is data, and the array's start
+    fp.write("\xa2")
+    _dumpCBOR(fp, u"status")
+    _dumpCBOR(fp, status)
+    _dumpCBOR(fp, u"data")
+    fp.write("\x9f")
+
+    yield fp.getvalue()
+
+    for item in items:
+        fp = BytesIO()
+        _dumpCBOR(fp, item)
+        yield fp.getvalue()
+
+    yield "\xff"
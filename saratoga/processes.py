@@ -0,0 +1,440 @@
+"""
+Running CPU-bound processors in a pool of worker processes, so that they can
+use more than one core, and don't hold up the reactor while they compute.
+
+Like the workers started by L{saratoga.workers}, each worker process runs
+the same program again. When the program gets to C{SaratogaAPI.run} in a
+worker, it serves calls from the pool rather than HTTP requests. Calls are
+sent over a pair of pipes, as the processor's name, version, params and
+args, and the result is sent back. Both are pickled, so they must be
+picklable, and processors run like this are given C{None} instead of the
+request.
+"""
+
+from twisted.internet.defer import Deferred, DeferredList
+from twisted.internet.protocol import ProcessProtocol
+from twisted.python import log
+
+from saratoga import ServiceUnavailable
+from saratoga.workers import WORKER_FD, WORKER_PORT, _signal
+
+from collections import deque
+
+import cPickle as pickle
+import os
+import struct
+import sys
+import traceback
+
+# Set in the environment of process pool workers, to the file descriptors
+# that calls are read from and results are written to.
+PROCESS_WORKER_FDS = "SARATOGA_PROCESS_WORKER_FDS"
+
+_CALLS_FD = 3
+_RESULTS_FD = 4
+_header = struct.Struct("!I")
+
+
+class TaskTimedOut(Exception):
+    """
+    A call took longer than the pool's timeout, so its worker was killed.
+    """
+
+
+
+class WorkerDied(Exception):
+    """
+    The worker process running a call ended before it finished.
+    """
+
+
+
+class RemoteError(Exception):
+    """
+    A call raised an exception that couldn't be sent back from the worker, in
+    which case the message is the worker's traceback, or its result couldn't
+    be read.
+    """
+
+
+
+def isProcessWorker(environ=os.environ):
+    """
+    Is this process a worker started by a L{ProcessPool}?
+    """
+    return PROCESS_WORKER_FDS in environ
+
+
+
+def _frame(message):
+    data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    return _header.pack(len(data)) + data
+
+
+
+def serveCalls(api, environ=os.environ):
+    """
+    Run calls sent by a L{ProcessPool}, with the processors of C{api}, until
+    the pool closes the pipe.
+    """
+    callsFD, resultsFD = [int(x) for x in
+                          environ[PROCESS_WORKER_FDS].split(",")]
+    calls = os.fdopen(callsFD, "rb")
+    results = os.fdopen(resultsFD, "wb")
+
+    while True:
+        header = calls.read(_header.size)
+
+        if len(header) < _header.size:
+            return
+
+        name, version, params, args = pickle.loads(
+            calls.read(_header.unpack(header)[0]))
+
+        try:
+            versionClass = getattr(api.implementation, "v{}".format(version))
+            func = getattr(versionClass, name).im_func
+            frame = _frame((True, func(api.serviceClass, None, params,
+                                       *args)))
+        except Exception as e:
+            error = traceback.format_exc()
+            try:
+                frame = _frame((False, e))
+            except Exception:
+                frame = _frame((False, RemoteError(error)))
+
+        results.write(frame)
+        results.flush()
+
+
+
+class _PoolWorker(ProcessProtocol):
+    """
+    The parent's end of one worker process, which runs one call at a time.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.ended = Deferred()
+        self.task = None
+        self.timeout = None
+        self.tasksRun = 0
+        self._buffer = ""
+
+
+    def send(self, task, message):
+        self.task = task
+        self.transport.writeToChild(_CALLS_FD, _frame(message))
+
+        if self.pool.timeout is not None:
+            self.timeout = self.pool.reactor.callLater(
+                self.pool.timeout, self._timedOut)
+
+
+    def close(self):
+        """
+        Ask the worker to end, once it has finished its call.
+        """
+        self.transport.closeChildFD(_CALLS_FD)
+
+
+    def childDataReceived(self, childFD, data):
+
+        if childFD != _RESULTS_FD:
+            return
+
+        self._buffer += data
+
+        while len(self._buffer) >= _header.size:
+            length = _header.unpack(self._buffer[:_header.size])[0]
+            end = _header.size + length
+
+            if len(self._buffer) < end:
+                return
+
+            try:
+                ok, result = pickle.loads(self._buffer[_header.size:end])
+            except Exception:
+                # Something the worker could pickle, but that can't be
+                # unpickled here, eg. an exception with odd arguments
+                log.err(None, "Unreadable result from process pool {}".format(
+                    self.pool.name))
+                ok, result = False, RemoteError(
+                    "The call's result couldn't be read.")
+
+            self._buffer = self._buffer[end:]
+            self._finished(ok, result)
+
+
+    def _finished(self, ok, result):
+
+        task, self.task = self.task, None
+
+        if task is None:
+            # It timed out, and is being killed
+            return
+
+        self._cancelTimeout()
+        self.tasksRun += 1
+        self.pool._workerFinished(self)
+
+        if ok:
+            task.callback(result)
+        else:
+            task.errback(result)
+
+
+    def _timedOut(self):
+        self.timeout = None
+        task, self.task = self.task, None
+        _signal(self.transport, "KILL")
+        self.pool._workerTimedOut(self)
+        task.errback(TaskTimedOut("Call took longer than {} seconds.".format(
+            self.pool.timeout)))
+
+
+    def _cancelTimeout(self):
+        if self.timeout is not None:
+            self.timeout.cancel()
+            self.timeout = None
+
+
+    def processEnded(self, reason):
+
+        self._cancelTimeout()
+        task, self.task = self.task, None
+        self.pool._workerEnded(self)
+
+        if task is not None:
+            task.errback(WorkerDied("Worker ended while running a call: "
+                                    "{}".format(reason.getErrorMessage())))
+
+        self.ended.callback(None)
+
+
+
+class ProcessPool(object):
+    """
+    A pool of worker processes, which run one call each at a time.
+
+    Calls that come in while every worker is busy wait for one, up to
+    C{maxQueued} of them, after which they are turned away with
+    L{ServiceUnavailable}.
+
+    @ivar queued: How many calls are waiting for a worker.
+    @ivar busy: How many workers are running a call.
+    @ivar completed: How many calls have finished, including ones that
+        raised.
+    @ivar timedOut: How many calls took too long.
+    @ivar shed: How many calls have been turned away.
+    @ivar recycled: How many workers have been replaced after C{maxTasks}
+        calls.
+    """
+
+    def __init__(self, name, size=None, maxTasks=None, timeout=None,
+                 maxQueued=0, retryAfter=1, restartDelay=1,
+                 shutdownTimeout=10, reactor=None, argv=None,
+                 executable=sys.executable):
+        """
+        @param size: How many workers to run. Defaults to the number of CPUs.
+        @param maxTasks: How many calls a worker runs before it is replaced
+            with a new one, to stop leaks from building up. C{None} means
+            workers are never replaced.
+        @param timeout: How many seconds a call can take before its worker
+            is killed and replaced. C{None} means there is no limit.
+        @param maxQueued: How many calls can wait for a worker.
+        @param retryAfter: The C{Retry-After}, in seconds, to give calls
+            that are turned away.
+        @param restartDelay: How long to wait before replacing a worker that
+            died on its own, so that a broken program isn't run over and over
+            as fast as it can be.
+        @param shutdownTimeout: How long to let workers finish their calls
+            when stopping, before killing them.
+        @param argv: The arguments to run workers with, defaulting to the
+            ones this process was run with.
+        """
+        if reactor is None:
+            from twisted.internet import reactor
+
+        if size is None:
+            from multiprocessing import cpu_count
+            size = cpu_count()
+
+        self.name = name
+        self.size = size
+        self.maxTasks = maxTasks
+        self.timeout = timeout
+        self.maxQueued = maxQueued
+        self.retryAfter = retryAfter
+        self.restartDelay = restartDelay
+        self.shutdownTimeout = shutdownTimeout
+        self.reactor = reactor
+        self.argv = argv if argv is not None else sys.argv
+        self.executable = executable
+
+        self.completed = 0
+        self.timedOut = 0
+        self.shed = 0
+        self.recycled = 0
+        self.processes = {}
+        self._idle = deque()
+        self._waiting = deque()
+        self._started = False
+        self._stopping = False
+        self._shutdownTrigger = None
+
+
+    @property
+    def queued(self):
+        return len(self._waiting)
+
+
+    @property
+    def busy(self):
+        return len(self.processes) - len(self._idle)
+
+
+    def start(self):
+        """
+        Start the workers, and stop them when the reactor shuts down.
+        """
+        if self._started:
+            return
+
+        self._started = True
+        self._stopping = False
+
+        if self._shutdownTrigger is None:
+            self._shutdownTrigger = self.reactor.addSystemEventTrigger(
+                "before", "shutdown", self.stop)
+
+        for x in range(self.size):
+            self._spawn()
+
+
+    def _spawn(self):
+
+        env = dict(os.environ)
+        env[PROCESS_WORKER_FDS] = "{},{}".format(_CALLS_FD, _RESULTS_FD)
+        # Workers of a worker started by saratoga.workers aren't serving HTTP
+        env.pop(WORKER_FD, None)
+        env.pop(WORKER_PORT, None)
+
+        worker = _PoolWorker(self)
+        process = self.reactor.spawnProcess(
+            worker, self.executable, [self.executable] + list(self.argv),
+            env=env, childFDs={0: 0, 1: 1, 2: 2, _CALLS_FD: "w",
+                               _RESULTS_FD: "r"})
+
+        self.processes[worker] = process
+        self._idle.append(worker)
+        self._dispatch()
+
+
+    def run(self, version, name, params, args=()):
+        """
+        Call the processor method C{name} of C{version}, in a worker.
+
+        @return: A L{Deferred} firing with what it returns.
+        @raise ServiceUnavailable: If every worker is busy and the queue is
+            full.
+        """
+        self.start()
+
+        if not self._idle and len(self._waiting) >= self.maxQueued:
+            self.shed += 1
+            raise ServiceUnavailable("Service unavailable, try again later.",
+                                     retryAfter=self.retryAfter)
+
+        d = Deferred()
+        self._waiting.append((d, (name, version, params, tuple(args))))
+        self._dispatch()
+        return d
+
+
+    def _dispatch(self):
+        while self._idle and self._waiting:
+            task, message = self._waiting.popleft()
+            self._idle.popleft().send(task, message)
+
+
+    def _workerFinished(self, worker):
+
+        self.completed += 1
+
+        if self.maxTasks is not None and worker.tasksRun >= self.maxTasks:
+            self.recycled += 1
+            worker.close()
+            self._replace(worker)
+        else:
+            self._idle.append(worker)
+            self._dispatch()
+
+
+    def _workerTimedOut(self, worker):
+        self.completed += 1
+        self.timedOut += 1
+        self._replace(worker)
+
+
+    def _replace(self, worker):
+        """
+        Stop handing C{worker} calls, and start its replacement straight
+        away.
+        """
+        del self.processes[worker]
+
+        if not self._stopping:
+            self._spawn()
+
+
+    def _workerEnded(self, worker):
+
+        if worker in self._idle:
+            self._idle.remove(worker)
+
+        if self.processes.pop(worker, None) is None or self._stopping:
+            # It was replaced already, or is meant to be ending
+            return
+
+        log.msg("Process pool {} worker ended, restarting".format(self.name))
+        self.reactor.callLater(self.restartDelay, self._restart)
+
+
+    def _restart(self):
+        if not self._stopping:
+            self._spawn()
+
+
+    def stop(self):
+        """
+        Ask the workers to stop once they have finished their calls, and kill
+        any that haven't after C{shutdownTimeout}. Calls waiting for a worker
+        fail with L{WorkerDied}.
+
+        @return: A L{Deferred} that fires when all of the workers have ended.
+        """
+        self._stopping = True
+        self._started = False
+
+        while self._waiting:
+            task, message = self._waiting.popleft()
+            task.errback(WorkerDied("The process pool was stopped."))
+
+        ended = [worker.ended for worker in self.processes]
+
+        for worker in self.processes:
+            worker.close()
+
+        kill = self.reactor.callLater(self.shutdownTimeout, self._kill)
+
+        def _stopped(_):
+            if kill.active():
+                kill.cancel()
+
+        return DeferredList(ended).addCallback(_stopped)
+
+
+    def _kill(self):
+        for process in self.processes.values():
+            _signal(process, "KILL")
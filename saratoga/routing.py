@@ -0,0 +1,130 @@
+from saratoga.cache import LRUCache
+
+import re
+
+# Segments made of only these characters mean the same thing as a regex as
+# they do as a literal, so they can go straight into the tree.
+_literalSegment = re.compile(r"^[\w\-~]*$")
+
+# Segments starting with one of these apply it to the slash before them
+_quantifiers = set("?*+{")
+
+_missing = object()
+
+
+class _Node(object):
+    """
+    A node in the routing tree, keyed by one path segment.
+    """
+    __slots__ = ["children", "value", "dynamic"]
+
+    def __init__(self):
+        self.children = {}
+        self.value = None
+        self.dynamic = []
+
+
+
+class Router(object):
+    """
+    Resolves request paths to route entries.
+
+    Literal endpoints live in a tree of path segments, so looking them up does
+    not depend on how many routes there are. Regex endpoints are compiled once
+    and hung off the deepest literal prefix they share, so only the few
+    patterns under that prefix are ever tried. Resolved paths are kept in an
+    LRU cache.
+    """
+
+    def __init__(self, cacheSize=1024):
+        self._root = _Node()
+        self._cache = LRUCache(cacheSize)
+
+
+    def add(self, path, value):
+        """
+        Add a route.
+
+        @param path: A tuple of the version segment (eg. C{"v1"}) and the
+            endpoint, which may be a regular expression.
+        @param value: What C{lookup} returns for requests to this path.
+        """
+        pattern = "/".join(path)
+        segments = pattern.split("/")
+
+        if "|" in pattern:
+            # A top-level alternation can't be split up safely, so match it
+            # against the whole path like we always have.
+            literal = []
+        else:
+            literal = []
+            for i, segment in enumerate(segments):
+                if not _literalSegment.match(segment):
+                    break
+                if i + 1 < len(segments) and \
+                   segments[i + 1][:1] in _quantifiers:
+                    # The slash after this segment is optional or repeated
+                    # (like "planets/?"), so this segment can't be split
+                    # from the rest
+                    break
+                literal.append(segment)
+
+        node = self._root
+        for segment in literal:
+            node = node.children.setdefault(segment, _Node())
+
+        if len(literal) == len(segments):
+            node.value = value
+        else:
+            remainder = "/".join(segments[len(literal):])
+            node.dynamic.append((re.compile("^%s$" % (remainder,)), value))
+
+        self._cache.clear()
+
+
+    def lookup(self, segments):
+        """
+        Find the route for a request path.
+
+        @param segments: The path segments, eg. C{request.postpath}.
+        @return: A tuple of the route's value and the regex groups captured
+            from the path, or C{None} if there is no such route.
+        """
+        key = "/".join(segments)
+        result = self._cache.get(key, _missing)
+
+        if result is _missing:
+            result = self._resolve(segments)
+            self._cache.set(key, result)
+
+        return result
+
+
+    def _resolve(self, segments):
+
+        node = self._root
+        candidates = []
+        depth = 0
+
+        for segment in segments:
+            if node.dynamic:
+                candidates.append((depth, node))
+            node = node.children.get(segment)
+            if node is None:
+                break
+            depth += 1
+        else:
+            if node.value is not None:
+                return (node.value, ())
+            if node.dynamic:
+                candidates.append((depth, node))
+
+        # Try the most specific patterns first
+        for depth, node in reversed(candidates):
+            remainder = "/".join(segments[depth:])
+            for regex, value in node.dynamic:
+                match = regex.match(remainder)
+                if match:
+                    return (value, match.groups())
+
+        return None
@@ -0,0 +1,386 @@
+"""
+Compiles JSON Schemas into specialised Python functions.
+
+The generated code follows the Draft 4 semantics of jsonschema's
+C{Draft4Validator}, and produces the same error messages in the same order,
+but does the walking of the schema once at compile time rather than on every
+instance. Schemas using keywords that it doesn't know how to compile raise
+L{UnsupportedSchema}, so that the caller can fall back to jsonschema.
+"""
+
+from jsonschema._utils import unbool, uniq
+
+from operator import itemgetter
+
+import numbers
+import re
+
+
+class UnsupportedSchema(Exception):
+    """
+    The schema uses something that the compiler can't turn into code.
+    """
+
+
+
+# Keywords that Draft4Validator acts on, but we don't compile.
+_unsupported = frozenset([
+    "$ref", "additionalItems", "dependencies", "oneOf", "patternProperties"])
+
+_typeChecks = {
+    "array": "isinstance({0}, list)",
+    "boolean": "isinstance({0}, bool)",
+    "integer": "(isinstance({0}, (int, long)) and "
+               "not isinstance({0}, bool))",
+    "null": "{0} is None",
+    "number": "(isinstance({0}, _Number) and not isinstance({0}, bool))",
+    "object": "isinstance({0}, dict)",
+    "string": "isinstance({0}, basestring)",
+}
+
+
+
+class _Compiler(object):
+
+    def __init__(self):
+        self.namespace = {"_Number": numbers.Number, "_uniq": uniq,
+                          "_unbool": unbool}
+        self.functions = []
+        self._counter = 0
+
+
+    def name(self, prefix):
+        self._counter += 1
+        return "{}{}".format(prefix, self._counter)
+
+
+    def constant(self, value):
+        """
+        Put C{value} in the namespace of the generated code, and return the
+        name it can be found under.
+        """
+        name = self.name("_c")
+        self.namespace[name] = value
+        return name
+
+
+    def function(self, schema):
+        """
+        Compile C{schema} into a function that takes an instance and a list,
+        and appends C{(path, message)} to the list for every error.
+
+        @return: The name of the function in the generated code.
+        """
+        name = self.name("_f")
+        lines = ["def {}(x0, errors):".format(name)]
+        self.schema(schema, "x0", [], lines, 1)
+        lines.append("    return errors")
+        self.functions.append("\n".join(lines))
+        return name
+
+
+    def schema(self, schema, var, path, lines, depth):
+        """
+        Generate the checks for C{schema} against the instance in C{var}.
+
+        @param path: Code fragments which make up the path to this instance,
+            only evaluated when there's an error.
+        """
+        if not isinstance(schema, dict):
+            raise UnsupportedSchema("Subschemas must be objects.")
+
+        if "$ref" in schema:
+            raise UnsupportedSchema("$ref is not supported.")
+
+        for keyword, value in schema.iteritems():
+            if keyword in _unsupported:
+                raise UnsupportedSchema(
+                    "{} is not supported.".format(keyword))
+
+            method = getattr(self, "keyword_" + keyword, None)
+            if method:
+                method(value, schema, var, path, lines, depth)
+
+
+    def block(self, schema, var, path, lines, depth):
+        """
+        Like C{schema}, but for the body of a block, which can't be empty.
+        """
+        length = len(lines)
+        self.schema(schema, var, path, lines, depth)
+
+        if len(lines) == length:
+            self.emit(lines, depth, "pass")
+
+
+    def emit(self, lines, depth, line):
+        lines.append("    " * depth + line)
+
+
+    def error(self, lines, depth, path, message):
+        """
+        Generate code that records an error, where C{message} is an expression.
+        """
+        pathCode = "(" + "".join(x + ", " for x in path) + ")"
+        self.emit(lines, depth, "errors.append(({}, {}))".format(
+            pathCode, message))
+
+
+    def typeCheck(self, typeName, var):
+        if not isinstance(typeName, basestring) or \
+           typeName not in _typeChecks:
+            raise UnsupportedSchema("Unknown type {!r}.".format(typeName))
+        return _typeChecks[typeName].format(var)
+
+
+    def keyword_type(self, types, schema, var, path, lines, depth):
+        if not isinstance(types, list):
+            types = [types]
+
+        checks = " or ".join(self.typeCheck(t, var) for t in types)
+        message = self.constant(
+            " is not of type " + ", ".join(repr(t) for t in types))
+
+        self.emit(lines, depth, "if not ({}):".format(checks))
+        self.error(lines, depth + 1, path,
+                   "repr({}) + {}".format(var, message))
+
+
+    def keyword_enum(self, enums, schema, var, path, lines, depth):
+        # Like jsonschema 3, booleans only equal booleans, and not 0 or 1
+        unbooled = self.constant([unbool(x) for x in enums])
+        enums = self.constant(enums)
+        message = "'%r is not one of %r' % ({}, {})".format(var, enums)
+
+        self.emit(lines, depth, "if {0} == 0 or {0} == 1:".format(var))
+        self.emit(lines, depth + 1, "if _unbool({}) not in {}:".format(
+            var, unbooled))
+        self.error(lines, depth + 2, path, message)
+        self.emit(lines, depth, "elif {} not in {}:".format(var, enums))
+        self.error(lines, depth + 1, path, message)
+
+
+    def _bound(self, limit, exclusive, words, var, path, lines, depth,
+               operators):
+
+        operator, word = (operators[1], words[1]) if exclusive else \
+                         (operators[0], words[0])
+        limit = self.constant(limit)
+
+        self.emit(lines, depth, "if {} and {} {} {}:".format(
+            self.typeCheck("number", var), var, operator, limit))
+        self.error(lines, depth + 1, path, "'%r is {} %r' % ({}, {})".format(
+            word, var, limit))
+
+
+    def keyword_minimum(self, minimum, schema, var, path, lines, depth):
+        self._bound(minimum, schema.get("exclusiveMinimum", False),
+                    ("less than the minimum of",
+                     "less than or equal to the minimum of"),
+                    var, path, lines, depth, ("<", "<="))
+
+
+    def keyword_maximum(self, maximum, schema, var, path, lines, depth):
+        self._bound(maximum, schema.get("exclusiveMaximum", False),
+                    ("greater than the maximum of",
+                     "greater than or equal to the maximum of"),
+                    var, path, lines, depth, (">", ">="))
+
+
+    def keyword_multipleOf(self, dB, schema, var, path, lines, depth):
+        name = self.constant(dB)
+
+        if isinstance(dB, float):
+            failed = "int({0} / {1}) != {0} / {1}".format(var, name)
+        else:
+            failed = "{} % {}".format(var, name)
+
+        self.emit(lines, depth, "if {} and {}:".format(
+            self.typeCheck("number", var), failed))
+        self.error(lines, depth + 1, path,
+                   "'%r is not a multiple of %r' % ({}, {})".format(var, name))
+
+
+    def _length(self, typeName, limit, operator, message, var, path, lines,
+                depth):
+        self.emit(lines, depth, "if {} and len({}) {} {!r}:".format(
+            self.typeCheck(typeName, var), var, operator, limit))
+        self.error(lines, depth + 1, path, "'%r {}' % ({},)".format(
+            message, var))
+
+
+    def keyword_minLength(self, limit, schema, var, path, lines, depth):
+        self._length("string", limit, "<", "is too short", var, path,
+                     lines, depth)
+
+
+    def keyword_maxLength(self, limit, schema, var, path, lines, depth):
+        self._length("string", limit, ">", "is too long", var, path,
+                     lines, depth)
+
+
+    def keyword_minItems(self, limit, schema, var, path, lines, depth):
+        self._length("array", limit, "<", "is too short", var, path,
+                     lines, depth)
+
+
+    def keyword_maxItems(self, limit, schema, var, path, lines, depth):
+        self._length("array", limit, ">", "is too long", var, path,
+                     lines, depth)
+
+
+    def keyword_minProperties(self, limit, schema, var, path, lines, depth):
+        self._length("object", limit, "<", "does not have enough properties",
+                     var, path, lines, depth)
+
+
+    def keyword_maxProperties(self, limit, schema, var, path, lines, depth):
+        self._length("object", limit, ">", "has too many properties",
+                     var, path, lines, depth)
+
+
+    def keyword_uniqueItems(self, unique, schema, var, path, lines, depth):
+        if not unique:
+            return
+
+        self.emit(lines, depth, "if {} and not _uniq({}):".format(
+            self.typeCheck("array", var), var))
+        self.error(lines, depth + 1, path,
+                   "'%r has non-unique elements' % ({},)".format(var))
+
+
+    def keyword_pattern(self, pattern, schema, var, path, lines, depth):
+        search = self.constant(re.compile(pattern).search)
+        name = self.constant(pattern)
+
+        self.emit(lines, depth, "if {} and not {}({}):".format(
+            self.typeCheck("string", var), search, var))
+        self.error(lines, depth + 1, path,
+                   "'%r does not match %r' % ({}, {})".format(var, name))
+
+
+    def keyword_required(self, required, schema, var, path, lines, depth):
+        if not required:
+            return
+
+        self.emit(lines, depth, "if {}:".format(self.typeCheck("object", var)))
+        for prop in required:
+            self.emit(lines, depth + 1, "if {} not in {}:".format(
+                self.constant(prop), var))
+            self.error(lines, depth + 2, path, self.constant(
+                "%r is a required property" % (prop,)))
+
+
+    def keyword_properties(self, properties, schema, var, path, lines, depth):
+        if not properties:
+            return
+
+        inner = self.name("x")
+        self.emit(lines, depth, "if {}:".format(self.typeCheck("object", var)))
+
+        for prop, subschema in properties.iteritems():
+            key = self.constant(prop)
+            self.emit(lines, depth + 1, "if {} in {}:".format(key, var))
+            self.emit(lines, depth + 2, "{} = {}[{}]".format(inner, var, key))
+            self.block(subschema, inner, path + [key], lines, depth + 2)
+
+
+    def keyword_additionalProperties(self, aP, schema, var, path, lines,
+                                     depth):
+        if aP is True or aP == {}:
+            return
+
+        known = self.constant(frozenset(schema.get("properties", {})))
+        extras = self.name("extras")
+
+        self.emit(lines, depth, "if {}:".format(self.typeCheck("object", var)))
+        self.emit(lines, depth + 1, "{} = set(k for k in {} if k not in {})"
+                  .format(extras, var, known))
+
+        if isinstance(aP, dict):
+            key, inner = self.name("k"), self.name("x")
+            self.emit(lines, depth + 1, "for {} in {}:".format(key, extras))
+            self.emit(lines, depth + 2, "{} = {}[{}]".format(inner, var, key))
+            self.block(aP, inner, path + [key], lines, depth + 2)
+        else:
+            self.emit(lines, depth + 1, "if {}:".format(extras))
+            self.error(
+                lines, depth + 2, path,
+                "'Additional properties are not allowed (%s %s unexpected)'"
+                " % (', '.join(repr(e) for e in {0}), "
+                "'was' if len({0}) == 1 else 'were')".format(extras))
+
+
+    def keyword_items(self, items, schema, var, path, lines, depth):
+        inner = self.name("x")
+        self.emit(lines, depth, "if {}:".format(self.typeCheck("array", var)))
+
+        if isinstance(items, dict):
+            index = self.name("i")
+            self.emit(lines, depth + 1, "for {}, {} in enumerate({}):".format(
+                index, inner, var))
+            self.block(items, inner, path + [index], lines, depth + 2)
+        else:
+            for index, subschema in enumerate(items):
+                self.emit(lines, depth + 1, "if len({}) > {}:".format(
+                    var, index))
+                self.emit(lines, depth + 2, "{} = {}[{}]".format(
+                    inner, var, index))
+                self.block(subschema, inner, path + [repr(index)], lines,
+                            depth + 2)
+
+
+    def keyword_allOf(self, allOf, schema, var, path, lines, depth):
+        for subschema in allOf:
+            self.schema(subschema, var, path, lines, depth)
+
+
+    def keyword_anyOf(self, anyOf, schema, var, path, lines, depth):
+        functions = ", ".join(self.function(s) for s in anyOf)
+
+        self.emit(lines, depth, "for f in ({},):".format(functions))
+        self.emit(lines, depth + 1, "if not f({}, []):".format(var))
+        self.emit(lines, depth + 2, "break")
+        self.emit(lines, depth, "else:")
+        self.error(lines, depth + 1, path,
+                   "'%r is not valid under any of the given schemas' % ({},)"
+                   .format(var))
+
+
+    def keyword_not(self, notSchema, schema, var, path, lines, depth):
+        function = self.function(notSchema)
+        name = self.constant(notSchema)
+
+        self.emit(lines, depth, "if not {}({}, []):".format(function, var))
+        self.error(lines, depth + 1, path,
+                   "'%r is not allowed for %r' % ({}, {})".format(name, var))
+
+
+
+def compileSchema(schema):
+    """
+    Compile C{schema} into a function.
+
+    @return: A function that takes an instance, and returns a list of
+        C{(path, message)} tuples for every error, in the order that
+        C{Draft4Validator.iter_errors} would give them.
+    @raise UnsupportedSchema: If the schema can't be compiled.
+    """
+    compiler = _Compiler()
+    name = compiler.function(schema)
+
+    source = "\n\n".join(compiler.functions)
+    code = compile(source, "<saratoga schema {}>".format(name), "exec")
+    exec code in compiler.namespace
+
+    return compiler.namespace[name]
+
+
+
+def formatErrors(errors):
+    """
+    Turn the errors from a compiled schema into a message, sorted by path the
+    same way L{saratoga.validation.JSONSchemaValidator} does.
+    """
+    errors.sort(key=itemgetter(0))
+    return ", ".join(message for path, message in errors)
@@ -0,0 +1,216 @@
+"""
+Verifying HTTP Signatures (draft-cavage-http-signatures) signed with HMAC.
+
+This does the same checks as C{httpsig_cffi}'s C{HeaderVerifier}, but parses
+the C{Authorization} header once, keeps the keyed HMAC state for each secret
+so that only the message has to be hashed, and turns away stale and replayed
+requests before doing any hashing at all.
+"""
+
+from saratoga import AuthenticationFailed
+from saratoga.cache import LRUCache, ExpiringCache
+
+from twisted.web.http import stringToDatetime
+
+from base64 import b64decode
+from collections import namedtuple
+from urllib2 import parse_http_list
+
+import binascii
+import hashlib
+import hmac
+
+
+Signature = namedtuple("Signature", ["keyId", "algorithm", "headers",
+                                     "signature"])
+
+_digests = {
+    "hmac-sha1": hashlib.sha1,
+    "hmac-sha256": hashlib.sha256,
+    "hmac-sha512": hashlib.sha512,
+}
+
+
+def parseSignatureHeader(header):
+    """
+    Parse an C{Authorization: Signature ...} header.
+
+    @return: A L{Signature}, with C{headers} as a list of lowercase header
+        names.
+    @raise ValueError: If it isn't a valid signature header.
+    """
+    scheme, _, params = header.partition(" ")
+
+    if scheme.lower() != "signature":
+        raise ValueError("Not a signature.")
+
+    values = {}
+
+    for item in parse_http_list(params):
+        key, sep, value = item.partition("=")
+        if sep and key and value:
+            if value[0] == '"':
+                value = value[1:-1]
+            values[key.strip().lower()] = value
+
+    if "keyid" not in values or "signature" not in values:
+        raise ValueError("keyId and signature are required.")
+
+    return Signature(values["keyid"], values.get("algorithm", "").lower(),
+                     values.get("headers", "date").lower().split(),
+                     values["signature"])
+
+
+
+class SignatureVerifier(object):
+    """
+    Verifies signed requests against users' secrets.
+    """
+
+    def __init__(self, maxClockSkew=None, replayCacheSize=0,
+                 keyCacheSize=1024, clock=None):
+        """
+        @param maxClockSkew: How many seconds the request's C{Date} header can
+            be from now. Requests outside of that are rejected before
+            checking their signatures. C{None} means any date is allowed.
+        @param replayCacheSize: How many recently seen signatures to remember,
+            so that a request can't be sent again. They are remembered for
+            twice C{maxClockSkew}, after which the C{Date} check rejects them
+            anyway. C{0} turns off replay protection. Requests are told apart
+            only by their signatures, so clients must sign something that
+            makes each request different, like C{(request-target)} and a
+            nonce or C{Digest} header, or two identical requests made in the
+            same second will look like a replay.
+        @param keyCacheSize: How many secrets to keep HMAC state for.
+        @param clock: An C{IReactorTime} provider, for checking dates.
+        """
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self.maxClockSkew = maxClockSkew
+        self.clock = clock
+        self._keys = LRUCache(keyCacheSize)
+        self._seen = None
+
+        if replayCacheSize:
+            self._seen = ExpiringCache(replayCacheSize, clock)
+            self._replayWindow = (2 * maxClockSkew if maxClockSkew is not None
+                                  else float("inf"))
+
+
+    def checkFresh(self, signature, request):
+        """
+        Check that C{request} is recent and hasn't been made before. This
+        doesn't need the secret, so it can be done before looking it up.
+
+        @param signature: The L{Signature} from the request.
+        @raise AuthenticationFailed: If it isn't.
+        """
+        if "date" not in signature.headers:
+            raise AuthenticationFailed("Authentication failed.")
+
+        if self.maxClockSkew is not None:
+            self._checkDate(request)
+
+        if self._seen is not None and \
+           self._seen.get(signature.signature) is not None:
+            raise AuthenticationFailed("Request has already been made.")
+
+
+    def verify(self, signature, secret, request):
+        """
+        Check that C{request} is fresh (see L{checkFresh}), and was signed
+        with C{secret}.
+
+        @param signature: The L{Signature} from the request.
+        @raise AuthenticationFailed: If it wasn't.
+        """
+        self.checkFresh(signature, request)
+
+        if not self._checkSignature(signature, secret, request):
+            raise AuthenticationFailed("Authentication failed.")
+
+        if self._seen is not None:
+            self._seen.set(signature.signature, True, self._replayWindow)
+
+
+    def _checkDate(self, request):
+
+        date = request.getHeader("Date")
+
+        try:
+            date = stringToDatetime(date)
+        except (ValueError, AttributeError, TypeError):
+            raise AuthenticationFailed("Authentication failed.")
+
+        if abs(self.clock.seconds() - date) > self.maxClockSkew:
+            raise AuthenticationFailed("Request date is out of range.")
+
+
+    def _checkSignature(self, signature, secret, request):
+
+        digest = _digests.get(signature.algorithm)
+
+        if digest is None:
+            # Leave anything other than HMAC, like RSA, to httpsig_cffi
+            return _verifyWithHTTPSig(secret, request)
+
+        try:
+            expected = b64decode(signature.signature)
+            message = _signingString(signature.headers, request)
+        except (TypeError, binascii.Error, KeyError, UnicodeError):
+            return False
+
+        if isinstance(secret, unicode):
+            secret = secret.encode("utf-8")
+        elif not isinstance(secret, str):
+            return False
+
+        key = (signature.algorithm, secret)
+        keyed = self._keys.get(key)
+
+        if keyed is None:
+            keyed = hmac.new(secret, digestmod=digest)
+            self._keys.set(key, keyed)
+
+        mac = keyed.copy()
+        mac.update(message)
+        return hmac.compare_digest(mac.digest(), expected)
+
+
+
+def _signingString(headers, request):
+    """
+    Make the string that was signed, from the C{headers} of C{request}.
+
+    @raise KeyError: If one of the headers is missing.
+    """
+    lines = []
+
+    for name in headers:
+        if name == "(request-target)":
+            value = "{} {}".format(request.method.lower(), request.path)
+        else:
+            values = request.requestHeaders.getRawHeaders(name)
+            if not values:
+                raise KeyError(name)
+            value = values[0]
+
+        lines.append("{}: {}".format(name, value))
+
+    return "\n".join(lines).encode("ascii")
+
+
+
+def _verifyWithHTTPSig(secret, request): # pragma: no cover
+    from httpsig_cffi import verify
+
+    head = {x.lower(): y[0]
+            for x, y in request.requestHeaders.getAllRawHeaders()}
+
+    try:
+        return verify.HeaderVerifier(headers=head, secret=secret,
+                                     method=request.method,
+                                     path=request.path).verify()
+    except Exception:
+        return False
@@ -0,0 +1,102 @@
+from twisted.internet.defer import Deferred
+from twisted.internet.interfaces import IPullProducer
+from twisted.python import log
+from twisted.python.failure import Failure
+
+from zope.interface import implementer
+
+import collections
+
+
+def isStream(result):
+    """
+    Should C{result} be streamed to the client, rather than serialised all at
+    once? Lists, dicts and strings are not streams; generators and other
+    iterators are.
+    """
+    return isinstance(result, collections.Iterator)
+
+
+
+@implementer(IPullProducer)
+class ChunkProducer(object):
+    """
+    Writes the strings from an iterable to a request, only asking for more
+    when the transport is ready for it, so that the whole response is never
+    in memory at once.
+    """
+
+    def __init__(self, request, chunks, chunkSize=65536):
+        """
+        @param chunkSize: Write when at least this many bytes have been
+            produced, rather than for every string.
+        """
+        self.request = request
+        self.chunkSize = chunkSize
+        self._chunks = iter(chunks)
+        self._deferred = Deferred()
+        self._started = False
+
+
+    def start(self):
+        """
+        Start writing to the request.
+
+        @return: A L{Deferred} that fires when the response is finished, or
+            has been abandoned. If the iterable raises before anything has
+            been written, it fails with that error instead, so that the
+            usual error response can still be given.
+        """
+        self.request.registerProducer(self, False)
+        return self._deferred
+
+
+    def resumeProducing(self):
+
+        buffered, size = [], 0
+
+        try:
+            while size < self.chunkSize:
+                chunk = next(self._chunks)
+                buffered.append(chunk)
+                size += len(chunk)
+        except StopIteration:
+            self.request.write("".join(buffered))
+            self._done()
+            self.request.finish()
+            return
+        except Exception:
+            if not self._started:
+                # Nothing, not even the status, has been sent yet, so the
+                # usual error response can be given instead
+                self._done(Failure())
+                return
+
+            log.err(None, "Error while streaming a response")
+            self._done()
+            # The status and some of the body have already been sent, so the
+            # only way left to tell the client is to not finish the response.
+            self.request.loseConnection()
+            return
+
+        self._started = True
+        self.request.write("".join(buffered))
+
+
+    def stopProducing(self):
+        """
+        The connection has gone away, so stop iterating.
+        """
+        close = getattr(self._chunks, "close", None)
+        if close:
+            close()
+        self._done()
+
+
+    def _done(self, result=None):
+        self.request.unregisterProducer()
+
+        if isinstance(result, Failure):
+            self._deferred.errback(result)
+        else:
+            self._deferred.callback(result)
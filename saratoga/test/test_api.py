@@ -1,3 +1,5 @@
+from twisted.internet.task import Clock
+from twisted.test.proto_helpers import StringTransport
 from twisted.trial.unittest import TestCase
 from twisted.python.modules import getModule
 from twisted.web.resource import Resource, getChildForRequest
@@ -5,6 +7,7 @@ from twisted.web.resource import Resource, getChildForRequest
 from shutil import copy
 
 from saratoga.api import SaratogaAPI, DoesNotExist
+from saratoga import auth
 from saratoga.outputFormats import OutputRegistry
 from saratoga.test.requestMock import requestMock, _render
 
@@ -204,6 +207,23 @@ class SaratogaErrorCatchingTests(TestCase):
                 "endpoint")
 
 
+    def test_unknownValidationEngine(self):
+        APIDef = {
+            "metadata": {"versions": [1]},
+            "endpoints": [
+                {
+                    "endpoint": "example",
+                    "validationEngine": "magic",
+                    "getProcessors": [{"versions": [1]}]
+                }
+            ]
+        }
+
+        e = self.assertRaises(Exception, SaratogaAPI, APIImpl, APIDef)
+        self.assertEqual(e.message,
+            "Unknown validation engine magic in example")
+
+
 
 class SaratogaAPITests(TestCase):
 
@@ -294,6 +314,24 @@ class SaratogaAPITests(TestCase):
         return self.api.test("/v1/example").addCallback(rendered)
 
 
+    def test_dispatchLookedUpOnce(self):
+        """
+        The implementation's functions are looked up when the API is made,
+        rather than for every request.
+        """
+        self.assertEqual(self.api.routes["GET"].lookup(["v1", "example"])[0]
+                         .funcName, "example_GET")
+        self.patch(self.api, "implementation", None)
+
+        def rendered(request):
+            self.assertEqual(
+                json.loads(request.getWrittenData()),
+                {"status": "success", "data": {}}
+            )
+
+        return self.api.test("/v1/example").addCallback(rendered)
+
+
     def test_basicNothing(self):
         """
         Double check we handle functons that return nothing.
@@ -677,3 +715,392 @@ class SaratogaAPITests(TestCase):
             )
 
         return self.api.test("/v1/example", method="WAFFlE").addCallback(rendered)
+
+
+
+class SaratogaCompiledValidationTests(SaratogaAPITests):
+    """
+    Run the API tests again, with compiled schema validation.
+    """
+
+    def setUp(self):
+        fp = getModule(__name__).filePath
+        copy(fp.parent().child("jsonschemaext.json").path, "jsonschemaext.json")
+
+        self.api = SaratogaAPI(APIImpl, APIDef, validationEngine="compiled")
+
+
+
+class SaratogaBodySizeTests(TestCase):
+
+    def setUp(self):
+        self.api = SaratogaAPI(APIImpl, APIDef, maxBodySize=30)
+
+
+    def test_smallBody(self):
+        """
+        Bodies up to C{maxBodySize} are read and parsed.
+        """
+        def rendered(request):
+            self.assertEqual(
+                json.loads(request.getWrittenData()),
+                {"status": "success", "data": {"hello": "there"}}
+            )
+
+        return self.api.test("/v1/example", params={"hello": "there"}
+                             ).addCallback(rendered)
+
+
+    def test_contentLengthTooLarge(self):
+        """
+        Bodies that say they are larger than C{maxBodySize} are rejected with
+        a 413, without being read.
+        """
+        def rendered(_):
+            self.assertEqual(request.code, 413)
+            self.assertEqual(
+                json.loads(request.getWrittenData()),
+                {"status": "fail", "data": "Request body is too large."}
+            )
+            self.assertEqual(reads, [])
+
+        request = requestMock("/v1/example", body=json.dumps({"a": "b"}),
+                              headers={"Content-Length": ["31"]})
+        reads = []
+        request.content.read = lambda *args: reads.append(args)
+
+        return _render(self.api.getResource(), request).addCallback(rendered)
+
+
+    def test_bodyTooLarge(self):
+        """
+        Bodies that are larger than C{maxBodySize}, but don't say so, are
+        rejected with a 413.
+        """
+        def rendered(request):
+            self.assertEqual(request.code, 413)
+            self.assertEqual(
+                json.loads(request.getWrittenData()),
+                {"status": "fail", "data": "Request body is too large."}
+            )
+
+        return self.api.test("/v1/example", params={"hello": "there" * 10}
+                             ).addCallback(rendered)
+
+
+    def _serve(self, *data):
+        """
+        Send C{data} to a connection to the API's site, a piece at a time.
+
+        @return: The transport of the connection.
+        """
+        site = self.api.getSite()
+        site.timeOut = None
+        channel = site.buildProtocol(None)
+        transport = StringTransport()
+        channel.makeConnection(transport)
+
+        for piece in data:
+            channel.dataReceived(piece)
+
+        return transport
+
+
+    def _assertRefused(self, transport):
+        """
+        The connection was answered with a 413 and closed.
+        """
+        head, body = transport.value().split("\r\n\r\n", 1)
+        self.assertTrue(head.startswith("HTTP/1.1 413 "))
+        self.assertEqual(
+            json.loads(body),
+            {"status": "fail", "data": "Request body is too large."}
+        )
+        self.assertTrue(transport.disconnecting)
+
+
+    def test_siteSmallBody(self):
+        """
+        The site from C{getSite} serves bodies up to C{maxBodySize}.
+        """
+        body = json.dumps({"hello": "there"})
+        transport = self._serve(
+            "GET /v1/example HTTP/1.1\r\n"
+            "Content-Length: %d\r\n\r\n" % (len(body),), body)
+
+        head, body = transport.value().split("\r\n\r\n", 1)
+        self.assertTrue(head.startswith("HTTP/1.1 200 "))
+        self.assertIn('"hello": "there"', body)
+        self.assertFalse(transport.disconnecting)
+
+
+    def test_siteContentLengthTooLarge(self):
+        """
+        The site from C{getSite} answers requests that say their bodies are
+        larger than C{maxBodySize} with a 413 once it has their headers,
+        without asking for the body.
+        """
+        transport = self._serve(
+            "GET /v1/example HTTP/1.1\r\n"
+            "Content-Length: 31\r\n"
+            "Expect: 100-continue\r\n\r\n")
+
+        self._assertRefused(transport)
+        self.assertNotIn("100 Continue", transport.value())
+
+
+    def test_siteChunkedTooLarge(self):
+        """
+        The site from C{getSite} answers requests whose bodies don't say how
+        large they are with a 413 as soon as too much of them arrives, and
+        doesn't keep the rest.
+        """
+        transport = self._serve(
+            "GET /v1/example HTTP/1.1\r\n"
+            "Transfer-Encoding: chunked\r\n\r\n",
+            "14\r\n" + "a" * 20 + "\r\n",
+            "14\r\n" + "a" * 20 + "\r\n" + "14\r\n" + "a" * 20 +
+            "\r\n0\r\n\r\n")
+
+        self._assertRefused(transport)
+
+
+    def test_siteNoLimit(self):
+        """
+        Without a C{maxBodySize}, the site from C{getSite} serves bodies of
+        any size.
+        """
+        self.api = SaratogaAPI(APIImpl, APIDef)
+        body = json.dumps({"hello": "there" * 10})
+        transport = self._serve(
+            "GET /v1/example HTTP/1.1\r\n"
+            "Transfer-Encoding: chunked\r\n\r\n",
+            "%x\r\n%s\r\n0\r\n\r\n" % (len(body), body))
+
+        self.assertTrue(transport.value().startswith("HTTP/1.1 200 "))
+
+
+
+class CachedAPIImpl(object):
+    class v1(object):
+        def cached_GET(self, request, params):
+            self.calls.append(params["params"])
+            if params["params"].get("missing"):
+                raise DoesNotExist("Not here.")
+            request.setHeader("X-Call", str(len(self.calls)))
+            return {"call": len(self.calls), "auth": params["auth"]}
+
+        cachedByUser_GET = cached_GET
+
+
+
+CachedAPIDef = {
+    "metadata": {"versions": [1]},
+    "endpoints": [
+        {
+            "endpoint": "cached",
+            "getProcessors": [{
+                "versions": [1],
+                "cache": {"ttl": 60, "params": ["a", "missing"]}
+            }]
+        },
+        {
+            "endpoint": "cachedByUser",
+            "requiresAuthentication": True,
+            "getProcessors": [{
+                "versions": [1],
+                "cache": {"ttl": 60, "auth": ["username"]}
+            }]
+        }
+    ]
+}
+
+
+
+class CachedAPIServiceClass(object):
+
+    def __init__(self):
+        self.calls = []
+        self.auth = auth.DefaultAuthenticator(
+            auth.InMemoryStringSharedSecretSource([
+                {"username": "bob", "password": "pass",
+                 "canonicalUsername": "bob"},
+                {"username": "alice", "password": "word",
+                 "canonicalUsername": "alice"}]))
+
+
+
+class SaratogaResponseCacheTests(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.api = SaratogaAPI(CachedAPIImpl, CachedAPIDef,
+                               CachedAPIServiceClass(), reactor=self.clock)
+        self.calls = self.api.serviceClass.calls
+
+
+    def get(self, path, params=None, headers=None):
+        return self.api.test(path, params=params, headers=headers,
+                             useBody=False).addCallback(
+            lambda request: (request.code,
+                             json.loads(request.getWrittenData())))
+
+
+    def test_repeatCallsCached(self):
+        """
+        Repeat calls are answered from the cache, without calling the
+        implementation, until the TTL is up.
+        """
+        cache = self.api.responseCaches[("cached", 1)]
+
+        d = self.get("/v1/cached", {"a": ["1"], "b": ["1"]})
+        d.addCallback(lambda _: self.get(
+            "/v1/cached", {"a": ["1"], "b": ["2"]}))
+
+        def cached(result):
+            self.assertEqual(result, (200, {"status": "success",
+                                            "data": {"call": 1,
+                                                     "auth": None}}))
+            self.assertEqual(len(self.calls), 1)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+            self.clock.advance(60)
+            return self.get("/v1/cached", {"a": ["1"]})
+
+        def expired(result):
+            self.assertEqual(result[1]["data"]["call"], 2)
+
+        return d.addCallback(cached).addCallback(expired)
+
+
+    def test_headersCached(self):
+        """
+        Responses from the cache have the headers the implementation set.
+        """
+        d = self.api.test("/v1/cached", params={"a": ["1"]}, useBody=False)
+        d.addCallback(lambda _: self.api.test(
+            "/v1/cached", params={"a": ["1"]}, useBody=False))
+
+        def cached(request):
+            self.assertEqual(len(self.calls), 1)
+            self.assertEqual(request.responseHeaders.getRawHeaders("X-Call"),
+                             ["1"])
+            self.assertEqual(
+                request.responseHeaders.getRawHeaders("Content-Type"),
+                ["application/json; charset=utf-8"])
+
+        return d.addCallback(cached)
+
+
+    def test_keyedByParams(self):
+        """
+        Calls with different params in the key are cached separately.
+        """
+        d = self.get("/v1/cached", {"a": ["1"]})
+        d.addCallback(lambda _: self.get("/v1/cached", {"a": ["2"]}))
+
+        def rendered(result):
+            self.assertEqual(result[1]["data"]["call"], 2)
+
+        return d.addCallback(rendered)
+
+
+    def test_errorsNotCached(self):
+        """
+        Calls that fail aren't cached, so the implementation is called
+        every time.
+        """
+        d = self.get("/v1/cached", {"missing": ["1"]})
+        d.addCallback(lambda _: self.get("/v1/cached", {"missing": ["1"]}))
+
+        def rendered(result):
+            self.assertEqual(result[0], 404)
+            self.assertEqual(len(self.calls), 2)
+            self.assertEqual(len(self.flushLoggedErrors(DoesNotExist)), 2)
+
+        return d.addCallback(rendered)
+
+
+    def test_invalidate(self):
+        """
+        Service code can drop cached responses.
+        """
+        d = self.get("/v1/cached", {"a": ["1"]})
+
+        def invalidate(_):
+            self.api.invalidateCache("cached", params={"a": "1"})
+            return self.get("/v1/cached", {"a": ["1"]})
+
+        def invalidateAll(result):
+            self.assertEqual(result[1]["data"]["call"], 2)
+            self.api.invalidateCache("cached", version=1)
+            return self.get("/v1/cached", {"a": ["1"]})
+
+        def rendered(result):
+            self.assertEqual(result[1]["data"]["call"], 3)
+
+        return d.addCallback(invalidate).addCallback(
+            invalidateAll).addCallback(rendered)
+
+
+    def test_invalidateOtherEndpoints(self):
+        """
+        Dropping the cached responses for one endpoint leaves the others.
+        """
+        cache = self.api.responseCaches[("cachedByUser", 1)]
+        d = self.get("/v1/cachedByUser", headers={
+            "Authorization": ["Basic {}".format(
+                "bob:pass".encode("base64").strip())]})
+
+        def invalidate(_):
+            self.assertEqual(len(cache), 1)
+            self.api.invalidateCache("cached")
+            self.assertEqual(len(cache), 1)
+
+        return d.addCallback(invalidate)
+
+
+    def test_keyedByUser(self):
+        """
+        Responses are only cached after authenticating, and are kept apart
+        for each user when the auth fields are in the key.
+        """
+        def headers(credentials):
+            return {"Authorization": ["Basic {}".format(
+                credentials.encode("base64").strip())]}
+
+        d = self.get("/v1/cachedByUser", headers=headers("bob:pass"))
+        d.addCallback(lambda _: self.get(
+            "/v1/cachedByUser", headers=headers("alice:word")))
+
+        def alice(result):
+            self.assertEqual(result[1]["data"],
+                             {"call": 2, "auth": {"username": "alice"}})
+            return self.get("/v1/cachedByUser", headers=headers("bob:word"))
+
+        def wrongPassword(result):
+            self.assertEqual(result[0], 403)
+            return self.get("/v1/cachedByUser", headers=headers("bob:pass"))
+
+        def bob(result):
+            self.assertEqual(result[1]["data"],
+                             {"call": 1, "auth": {"username": "bob"}})
+
+        return d.addCallback(alice).addCallback(wrongPassword).addCallback(bob)
+
+
+    def test_onlyGET(self):
+        """
+        Only GET processors can have a cache.
+        """
+        definition = {
+            "metadata": {"versions": [1]},
+            "endpoints": [{
+                "endpoint": "example",
+                "postProcessors": [{"versions": [1], "cache": {"ttl": 1}}]
+            }]
+        }
+
+        e = self.assertRaises(Exception, SaratogaAPI, APIImpl, definition)
+        self.assertEqual(str(e), "Only GET processors can be cached, but "
+                         "the POST processor in example has a cache")
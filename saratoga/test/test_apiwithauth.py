@@ -166,3 +166,85 @@ class SaratogaAPITestsWithAuthenticator(TestCase):
             "Authorization": ['Signature signature="dXoOMfIkyAUFrnATzPoR2lpXpW'
             '9Ei5irJByzfKG3hpc=",algorithm="hmac-sha256",keyId="alice"']
             }).addCallback(rendered)
+
+
+    def test_malformedSignature(self):
+        def rendered(request):
+            self.assertEqual(
+                json.loads(request.getWrittenData()),
+                {"status": "fail", "data": "Malformed Authorization header."}
+            )
+
+        return self.api.test("/v1/requiresAuth", headers={
+            "Authorization": ['Signature algorithm="hmac-sha256"']
+            }).addCallback(rendered)
+
+
+    def test_replayedHMACAuth(self):
+        """
+        With replay protection on, a signed request can't be made twice.
+        """
+        self.api.serviceClass.auth = auth.DefaultAuthenticator(
+            self.api.serviceClass.auth.sharedSecretSource, replayCacheSize=10)
+
+        def replay(request):
+            self.assertEqual(request.code, 200)
+            return self.api.test("/v1/requiresAuth", params={},
+                                 enableHMAC=("bob", "pass"))
+
+        def rendered(request):
+            self.assertEqual(
+                json.loads(request.getWrittenData()),
+                {"status": "fail", "data": "Request has already been made."}
+            )
+
+        d = self.api.test("/v1/requiresAuth", params={},
+                          enableHMAC=("bob", "pass"))
+        return d.addCallback(replay).addCallback(rendered)
+
+
+    def test_staleHMACAuthNotLookedUp(self):
+        """
+        Signed requests with a stale date are turned away before the user is
+        looked up.
+        """
+        source = self.api.serviceClass.auth.sharedSecretSource
+        self.api.serviceClass.auth = auth.DefaultAuthenticator(
+            source, maxClockSkew=300)
+        lookups = []
+        self.patch(source, "getUserDetails", lookups.append)
+
+        def rendered(request):
+            self.assertEqual(
+                json.loads(request.getWrittenData()),
+                {"status": "fail", "data": "Request date is out of range."}
+            )
+            self.assertEqual(lookups, [])
+
+        # requestMock's Date is long past
+        return self.api.test("/v1/requiresAuth", params={},
+                             enableHMAC=("bob", "pass")).addCallback(rendered)
+
+
+    def test_HMACWithOtherAuthenticator(self):
+        """
+        Authenticators without C{auth_signature} are given the key ID.
+        """
+        calls = []
+
+        class Authenticator(object):
+            def auth_HMAC(self, username, request):
+                calls.append(username)
+                return "someone"
+
+        self.api.serviceClass.auth = Authenticator()
+
+        def rendered(request):
+            self.assertEqual(calls, ["bob"])
+            self.assertEqual(
+                json.loads(request.getWrittenData()),
+                {"status": "success", "data": {"username": "someone"}}
+            )
+
+        return self.api.test("/v1/requiresAuth", params={},
+                             enableHMAC=("bob", "pass")).addCallback(rendered)
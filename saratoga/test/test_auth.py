@@ -2,6 +2,7 @@ from saratoga import auth
 from saratoga import AuthenticationFailed
 
 
+from twisted.internet.task import Clock
 from twisted.web import server
 from twisted.web.http_headers import Headers
 from twisted.web.test.test_web import DummyChannel
@@ -10,6 +11,8 @@ from twisted.trial import unittest
 
 from StringIO import StringIO
 
+import json
+
 
 class AuthTests(unittest.TestCase):
 
@@ -102,3 +105,267 @@ class AuthTests(unittest.TestCase):
         authDeferred = authenticator.auth_HMAC("alice", request)
 
         return authDeferred
+
+
+    def test_HMACBadHeader(self):
+        """
+        Malformed C{Authorization} headers, and signatures by another key than
+        the username, fail to authenticate.
+        """
+        authenticator = auth.DefaultAuthenticator(
+            auth.InMemoryStringSharedSecretSource(
+                [{"username": "alice", "password": "wonderland"}]))
+
+        for header, username in [
+                ("Basic YWxpY2U6d29uZGVybGFuZA==", "alice"),
+                ('Signature keyId="bob",signature="abc"', "alice")]:
+            request = server.Request(DummyChannel(), False)
+            request.requestHeaders = Headers({"Authorization": [header]})
+
+            f = authenticator.auth_HMAC(username, request)
+            self.assertIsInstance(self.failureResultOf(f).value,
+                                  AuthenticationFailed)
+
+
+
+class CountingSharedSecretSource(auth.InMemoryStringSharedSecretSource):
+
+    def __init__(self, users):
+        auth.InMemoryStringSharedSecretSource.__init__(self, users)
+        self.lookups = []
+
+
+    def getUserDetails(self, username):
+        self.lookups.append(username)
+        return auth.InMemoryStringSharedSecretSource.getUserDetails(
+            self, username)
+
+
+
+class CachingAuthTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.source = CountingSharedSecretSource([
+            {"username": "alice", "canonicalUsername": "alice@example.com",
+             "password": "wonderland"}])
+        self.authenticator = auth.DefaultAuthenticator(
+            self.source, cacheTTL=60, negativeCacheTTL=5, clock=self.clock)
+
+
+    def login(self, username, password):
+        return self.successResultOf(
+            self.authenticator.auth_usernameAndPassword(username, password))
+
+
+    def loginFails(self, username, password):
+        d = self.authenticator.auth_usernameAndPassword(username, password)
+        self.failureResultOf(d, AuthenticationFailed)
+
+
+    def test_cachesUsers(self):
+        """
+        Users' details are only looked up again once C{cacheTTL} is up, and
+        are still checked against the password every time.
+        """
+        self.assertEqual(self.login("alice", "wonderland"),
+                         "alice@example.com")
+        self.loginFails("alice", "looking glass")
+        self.clock.advance(59)
+        self.assertEqual(self.login("alice", "wonderland"),
+                         "alice@example.com")
+        self.assertEqual(self.source.lookups, ["alice"])
+
+        self.clock.advance(1)
+        self.login("alice", "wonderland")
+        self.assertEqual(self.source.lookups, ["alice", "alice"])
+
+
+    def test_cachesMissingUsers(self):
+        """
+        Users that don't exist are remembered for C{negativeCacheTTL}.
+        """
+        self.loginFails("bob", "pass")
+        self.loginFails("bob", "pass")
+        self.assertEqual(self.source.lookups, ["bob"])
+
+        self.clock.advance(5)
+        self.loginFails("bob", "pass")
+        self.assertEqual(self.source.lookups, ["bob", "bob"])
+
+
+    def test_otherErrorsNotCached(self):
+        """
+        Errors from the shared secret source other than unknown users, such
+        as its database being unavailable, aren't remembered.
+        """
+        def getUserDetails(username):
+            self.source.lookups.append(username)
+            raise IOError("Database is down.")
+
+        self.source.getUserDetails = getUserDetails
+
+        for i in range(2):
+            d = self.authenticator.auth_usernameAndPassword("alice", "pass")
+            self.failureResultOf(d, IOError)
+
+        self.assertEqual(self.source.lookups, ["alice", "alice"])
+
+
+    def test_onlyNegativeCache(self):
+        """
+        With no C{cacheTTL}, only users that don't exist are remembered.
+        """
+        self.authenticator = auth.DefaultAuthenticator(
+            self.source, negativeCacheTTL=5, clock=self.clock)
+
+        self.login("alice", "wonderland")
+        self.login("alice", "wonderland")
+        self.loginFails("bob", "pass")
+        self.loginFails("bob", "pass")
+        self.assertEqual(self.source.lookups, ["alice", "alice", "bob"])
+
+
+    def test_onlyPositiveCache(self):
+        """
+        With no C{negativeCacheTTL}, only users that exist are remembered.
+        """
+        self.authenticator = auth.DefaultAuthenticator(
+            self.source, cacheTTL=60, clock=self.clock)
+
+        self.login("alice", "wonderland")
+        self.login("alice", "wonderland")
+        self.loginFails("bob", "pass")
+        self.loginFails("bob", "pass")
+        self.assertEqual(self.source.lookups, ["alice", "bob", "bob"])
+
+
+    def test_invalidate(self):
+        self.login("alice", "wonderland")
+        self.authenticator.invalidateUser("alice")
+        self.login("alice", "wonderland")
+        self.authenticator.clearCache()
+        self.login("alice", "wonderland")
+
+        self.assertEqual(self.source.lookups, ["alice"] * 3)
+
+
+    def test_noCacheByDefault(self):
+        authenticator = auth.DefaultAuthenticator(self.source)
+        authenticator.auth_usernameAndPassword("alice", "wonderland")
+        authenticator.auth_usernameAndPassword("alice", "wonderland")
+        authenticator.invalidateUser("alice")
+        authenticator.clearCache()
+
+        self.assertEqual(self.source.lookups, ["alice", "alice"])
+
+
+
+class FileSharedSecretSourceTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.path = self.mktemp() + ".json"
+        self.write([{"username": "alice", "password": "wonderland"}])
+
+
+    def write(self, users):
+        with open(self.path, "wb") as f:
+            json.dump(users, f)
+
+
+    def lookup(self, source, username):
+        return self.successResultOf(source.getUserDetails(username))
+
+
+    def test_lookup(self):
+        source = auth.FileSharedSecretSource(self.path, clock=self.clock)
+
+        self.assertEqual(self.lookup(source, "alice"),
+                         {"username": "alice", "password": "wonderland"})
+        self.assertRaises(AuthenticationFailed, source.getUserDetails, "bob")
+
+
+    def test_csv(self):
+        path = self.mktemp() + ".csv"
+
+        with open(path, "wb") as f:
+            f.write("username,password,canonicalUsername\n"
+                    "alice,wonderland,alice@example.com\n"
+                    "bob,pass,\n")
+
+        source = auth.FileSharedSecretSource(path, reloadInterval=None)
+
+        self.assertEqual(self.lookup(source, "alice"),
+                         {"username": "alice", "password": "wonderland",
+                          "canonicalUsername": "alice@example.com"})
+        self.assertEqual(self.lookup(source, "bob"),
+                         {"username": "bob", "password": "pass"})
+
+        # There's nothing to stop
+        source.stopWatching()
+
+
+    def test_unknownFormat(self):
+        self.assertRaises(ValueError, auth.FileSharedSecretSource,
+                          self.path, fileFormat="yaml")
+
+
+    def test_reloads(self):
+        """
+        When the file changes, the users are loaded again.
+        """
+        source = auth.FileSharedSecretSource(self.path, reloadInterval=5,
+                                             clock=self.clock)
+        self.write([{"username": "bob", "password": "a longer password"}])
+
+        self.clock.advance(5)
+        self.assertRaises(AuthenticationFailed, source.getUserDetails,
+                          "alice")
+        self.assertEqual(self.lookup(source, "bob")["password"],
+                         "a longer password")
+
+        source.stopWatching()
+        self.write([])
+        self.clock.advance(5)
+        self.lookup(source, "bob")
+
+
+    def test_unchangedNotReloaded(self):
+        """
+        The file is only loaded again if it has changed.
+        """
+        source = auth.FileSharedSecretSource(self.path, reloadInterval=5,
+                                             clock=self.clock)
+        source.load = lambda: self.fail("Reloaded.")
+
+        self.clock.advance(5)
+        self.lookup(source, "alice")
+        source.stopWatching()
+
+
+    def test_defaultClock(self):
+        """
+        Without a clock, the file is checked on the global reactor.
+        """
+        from twisted.internet import reactor
+
+        source = auth.FileSharedSecretSource(self.path, reloadInterval=5)
+        self.addCleanup(source.stopWatching)
+        self.assertIs(source._watcher.clock, reactor)
+
+
+    def test_badReloadKeepsUsers(self):
+        """
+        If the changed file can't be loaded, the old users are kept.
+        """
+        source = auth.FileSharedSecretSource(self.path, reloadInterval=5,
+                                             clock=self.clock)
+
+        with open(self.path, "wb") as f:
+            f.write("[{not json")
+
+        self.clock.advance(5)
+        self.assertEqual(len(self.flushLoggedErrors(ValueError)), 1)
+        self.lookup(source, "alice")
+        source.stopWatching()
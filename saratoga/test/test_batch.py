@@ -0,0 +1,420 @@
+import json
+
+from base64 import b64encode
+
+from twisted.internet.defer import Deferred
+from twisted.trial.unittest import TestCase
+
+from saratoga import APIError, AuthenticationFailed, NoSuchEndpoint
+from saratoga.api import SaratogaAPI
+from saratoga.outputFormats import OutputRegistry, JSendJSONOutputFormat
+from saratoga.test.requestMock import requestMock, _render
+
+
+class BatchAPIImpl(object):
+    class v1(object):
+        def hello_GET(self, request, params):
+            return {"hello": params["params"].get("name", "world")}
+
+        def item_GET(self, request, params, itemID):
+            return {"id": itemID}
+
+        def named_POST(self, request, params):
+            return params["params"]
+
+        def secret_GET(self, request, params):
+            return params["auth"]
+
+        def slow_GET(self, request, params):
+            d = Deferred()
+            self.waiting.append(d)
+            return d
+
+        def stream_GET(self, request, params):
+            return iter([1, 2, 3])
+
+        def broken_GET(self, request, params):
+            raise ValueError("Oh no")
+
+        def limited_GET(self, request, params):
+            return {}
+
+        def connection_GET(self, request, params):
+            return {"client": request.getClientAddress().host,
+                    "host": request.getHost().port,
+                    "secure": request.isSecure(),
+                    "user": request.getUser()}
+
+        def brokenStream_GET(self, request, params):
+            # More than a chunk, so that some of it is written first
+            yield "x" * 65536
+            raise ValueError("Oh no")
+
+
+
+class CountingAuthenticator(object):
+
+    def __init__(self):
+        self.calls = 0
+
+
+    def auth_usernameAndPassword(self, username, password):
+        self.calls += 1
+        if password == "explode":
+            raise ValueError("Oh no")
+        if password != "pass":
+            raise AuthenticationFailed("Authentication failed.")
+        return username + "@example.com"
+
+
+
+class BatchServiceClass(object):
+
+    def __init__(self):
+        self.auth = CountingAuthenticator()
+        self.waiting = []
+
+
+
+BatchAPIDef = {
+    "metadata": {"versions": [1]},
+    "endpoints": [
+        {"endpoint": "hello", "getProcessors": [{"versions": [1]}]},
+        {"endpoint": "item/(\\d+)", "func": "item",
+         "getProcessors": [{"versions": [1]}]},
+        {"endpoint": "named", "postProcessors": [{
+            "versions": [1], "paramsType": "jsonbody",
+            "requestSchema": {
+                "type": "object", "required": ["name"],
+                "properties": {"name": {"type": "string"}}}}]},
+        {"endpoint": "secret", "requiresAuthentication": True,
+         "getProcessors": [{"versions": [1]}]},
+        {"endpoint": "slow", "getProcessors": [{"versions": [1]}]},
+        {"endpoint": "stream", "getProcessors": [{"versions": [1]}]},
+        {"endpoint": "broken", "getProcessors": [{"versions": [1]}]},
+        {"endpoint": "brokenStream", "getProcessors": [{"versions": [1]}]},
+        {"endpoint": "limited", "getProcessors": [
+            {"versions": [1], "rateLimit": {"requests": 2}}]},
+        {"endpoint": "connection", "getProcessors": [{"versions": [1]}]}
+    ]
+}
+
+
+
+class BatchTests(TestCase):
+
+    def setUp(self):
+        self.serviceClass = BatchServiceClass()
+        self.api = SaratogaAPI(BatchAPIImpl, BatchAPIDef,
+                               serviceClass=self.serviceClass)
+        self.resource = self.api.getBatchResource(maxBatchSize=5)
+
+
+    def batch(self, calls, auth=None, accept=None):
+        headers = {}
+
+        if auth:
+            headers["Authorization"] = ["Basic " + b64encode(auth)]
+
+        if accept:
+            headers["Accept"] = [accept]
+
+        body = calls if isinstance(calls, str) else json.dumps(calls)
+        request = requestMock("/batch", method="POST", body=body,
+                              headers=headers)
+        return _render(self.resource, request).addCallback(
+            lambda _: (request.code, json.loads(request.getWrittenData())))
+
+
+    def test_batch(self):
+        """
+        Each call goes through the API's routing and validation, and their
+        responses are returned in order.
+        """
+        d = self.batch([
+            {"path": "/v1/hello", "params": {"name": "batch"}},
+            {"path": "/v1/hello?name=query"},
+            {"method": "get", "path": "/v1/item/42"},
+            {"method": "POST", "path": "/v1/named", "params": {"name": "a"}},
+            {"method": "POST", "path": "/v1/named", "params": {}},
+        ])
+
+        def rendered(result):
+            code, body = result
+            self.assertEqual(code, 200)
+            self.assertEqual(body["status"], "success")
+
+            hello, query, item, named, invalid = body["data"]
+            self.assertEqual(hello, {"status": "success", "code": 200,
+                                     "data": {"hello": "batch"}})
+            self.assertEqual(query["data"], {"hello": "query"})
+            self.assertEqual(item["data"], {"id": "42"})
+            self.assertEqual(named["data"], {"name": "a"})
+            self.assertEqual((invalid["status"], invalid["code"]),
+                             ("fail", 400))
+
+        return d.addCallback(rendered)
+
+
+    def test_failures(self):
+        """
+        Calls that fail don't stop the others.
+        """
+        d = self.batch([
+            {"path": "/v1/nothing"},
+            {"path": "/v1/broken"},
+            {"path": "/v1/stream"},
+        ])
+
+        def rendered(result):
+            code, body = result
+            missing, broken, stream = body["data"]
+            self.assertEqual((missing["status"], missing["code"]),
+                             ("error", 404))
+            self.assertEqual((broken["status"], broken["code"]),
+                             ("error", 500))
+            self.assertEqual(stream["data"], [1, 2, 3])
+            self.flushLoggedErrors(NoSuchEndpoint, ValueError)
+
+        return d.addCallback(rendered)
+
+
+    def test_concurrent(self):
+        """
+        Every call is dispatched before any of them finish.
+        """
+        d = self.batch([{"path": "/v1/slow"}, {"path": "/v1/slow"}])
+
+        self.assertEqual(len(self.serviceClass.waiting), 2)
+        self.assertNoResult(d)
+
+        for i, waiting in enumerate(reversed(self.serviceClass.waiting)):
+            waiting.callback({"finished": i})
+
+        def rendered(result):
+            code, body = result
+            self.assertEqual([x["data"] for x in body["data"]],
+                             [{"finished": 1}, {"finished": 0}])
+
+        return d.addCallback(rendered)
+
+
+    def test_authenticatedOnce(self):
+        """
+        The batch is authenticated once, and calls that need it are given
+        the result.
+        """
+        d = self.batch([{"path": "/v1/secret"}, {"path": "/v1/secret"},
+                        {"path": "/v1/hello"}], auth="alice:pass")
+
+        def rendered(result):
+            code, body = result
+            self.assertEqual([x["data"] for x in body["data"][:2]],
+                             [{"username": "alice@example.com"}] * 2)
+            self.assertEqual(self.serviceClass.auth.calls, 1)
+
+        return d.addCallback(rendered)
+
+
+    def test_authenticationFailed(self):
+        """
+        If the batch fails to authenticate, none of it is run.
+        """
+        d = self.batch([{"path": "/v1/hello"}], auth="alice:wrong")
+
+        def rendered(result):
+            self.assertEqual(result, (403, {
+                "status": "fail", "data": "Authentication failed."}))
+
+        return d.addCallback(rendered)
+
+
+    def test_unauthenticated(self):
+        """
+        Without authenticating the batch, calls that need it fail.
+        """
+        d = self.batch([{"path": "/v1/secret"}, {"path": "/v1/hello"}])
+
+        def rendered(result):
+            code, body = result
+            self.assertEqual([x["code"] for x in body["data"]], [401, 200])
+
+        return d.addCallback(rendered)
+
+
+    def test_noAuthenticator(self):
+        """
+        Batches with an C{Authorization} header for an API without an
+        authenticator are run without authenticating, like single calls.
+        """
+        self.api.serviceClass = object()
+        d = self.batch([{"path": "/v1/hello"}, {"path": "/v1/secret"}],
+                       auth="alice:pass")
+
+        def rendered(result):
+            code, body = result
+            self.assertEqual(code, 200)
+            self.assertEqual([x["code"] for x in body["data"]], [200, 500])
+            self.flushLoggedErrors(APIError)
+
+        return d.addCallback(rendered)
+
+
+    def test_connection(self):
+        """
+        Calls are made on the batch's connection, from its client, and with
+        its credentials.
+        """
+        d = self.batch([{"path": "/v1/connection"}], auth="alice:pass")
+
+        def rendered(result):
+            code, body = result
+            self.assertEqual(body["data"][0]["data"], {
+                "client": "192.168.1.1", "host": 8080, "secure": False,
+                "user": "alice"})
+
+        return d.addCallback(rendered)
+
+
+    def test_renderFailed(self):
+        """
+        A call that fails to render only fails itself.
+        """
+        render = self.api.resource.render
+
+        def brokenRender(request, **kwargs):
+            if request.path == "/v1/broken":
+                raise ValueError("Oh no")
+            return render(request, **kwargs)
+
+        self.patch(self.api.resource, "render", brokenRender)
+        d = self.batch([{"path": "/v1/broken"}, {"path": "/v1/hello"}])
+
+        def rendered(result):
+            code, body = result
+            self.assertEqual(code, 200)
+            self.assertEqual([x["code"] for x in body["data"]], [500, 200])
+            self.assertEqual(len(self.flushLoggedErrors(ValueError)), 1)
+
+        return d.addCallback(rendered)
+
+
+    def test_tooLarge(self):
+        """
+        Batches with more than C{maxBatchSize} calls are turned away.
+        """
+        d = self.batch([{"path": "/v1/hello"}] * 6)
+
+        def rendered(result):
+            self.assertEqual(result, (413, {
+                "status": "fail",
+                "data": "Batch has 6 calls, but at most 5 are allowed."}))
+
+        return d.addCallback(rendered)
+
+
+    def test_bodyTooLarge(self):
+        """
+        Batches bigger than the API's C{maxBodySize} are turned away.
+        """
+        self.api.maxBodySize = 10
+        d = self.batch([{"path": "/v1/hello"}])
+        d.addCallback(self.assertEqual, (413, {
+            "status": "fail", "data": "Request body is too large."}))
+        return d
+
+
+    def test_notAcceptable(self):
+        """
+        Batches asking for an output format the API doesn't have get a 406.
+        """
+        request = requestMock("/batch", method="POST", body="[]",
+                              headers={"Accept": ["application/whatever"]})
+        self.assertEqual(self.resource.render(request),
+                         "406 Not Acceptable, please use one of: " +
+                         ", ".join(self.api.outputRegistry
+                                   ._outputFormatsPreference))
+        self.assertEqual(request.code, 406)
+
+
+    def test_authenticationError(self):
+        """
+        If authenticating the batch raises an unexpected error, it is logged
+        and the batch gets a 500.
+        """
+        d = self.batch([{"path": "/v1/hello"}], auth="alice:explode")
+
+        def rendered(result):
+            self.assertEqual(result, (500, {
+                "status": "error", "data": "Internal server error."}))
+            self.assertEqual(len(self.flushLoggedErrors(ValueError)), 1)
+
+        return d.addCallback(rendered)
+
+
+    def test_streamFailed(self):
+        """
+        A call whose response fails part way through streaming is logged,
+        and given as an internal server error.
+        """
+        d = self.batch([{"path": "/v1/brokenStream"}, {"path": "/v1/hello"}])
+
+        def rendered(result):
+            code, body = result
+            broken, hello = body["data"]
+            self.assertEqual(broken, {"status": "error", "code": 500,
+                                      "data": "Internal server error."})
+            self.assertEqual(hello["code"], 200)
+            self.flushLoggedErrors(ValueError, APIError)
+
+        return d.addCallback(rendered)
+
+
+    def test_notJSend(self):
+        """
+        Responses to calls which aren't JSend, such as when the API can't
+        give JSON, are given as errors with the response as their data.
+        """
+        registry = OutputRegistry("application/x-other")
+        registry.register("application/x-other", JSendJSONOutputFormat)
+        self.api.outputRegistry = registry
+
+        d = self.batch([{"path": "/v1/hello"}], accept="application/x-other")
+
+        def rendered(result):
+            code, body = result
+            self.assertEqual(body["data"], [{
+                "status": "error", "code": 406,
+                "data": "406 Not Acceptable, please use one of: "
+                        "application/x-other"}])
+
+        return d.addCallback(rendered)
+
+
+    def test_invalid(self):
+        """
+        Batches that aren't a list of calls are turned away.
+        """
+        invalid = ["not json", json.dumps({"path": "/v1/hello"}),
+                   json.dumps([1]), json.dumps([{"method": "GET"}]),
+                   json.dumps([{"path": "/v1/hello", "params": []}])]
+        results = []
+
+        for body in invalid:
+            self.batch(body).addCallback(results.append)
+
+        self.assertEqual([code for code, body in results], [400] * 5)
+
+
+    def test_rateLimited(self):
+        """
+        Each call counts against the rate limit of whoever made the batch.
+        """
+        d = self.batch([{"path": "/v1/limited"}] * 3)
+
+        def rendered(result):
+            code, body = result
+            self.assertEqual([x["code"] for x in body["data"]],
+                             [200, 200, 429])
+
+        return d.addCallback(rendered)
@@ -0,0 +1,180 @@
+from datetime import datetime
+
+from twisted.internet import reactor
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from saratoga.cache import LRUCache, ExpiringCache, ResponseCache
+
+
+class LRUCacheTests(TestCase):
+
+    def test_evictsLeastRecentlyUsed(self):
+        """
+        When full, the entry that was used longest ago is evicted.
+        """
+        cache = LRUCache(2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)
+
+        self.assertEqual(len(cache), 2)
+        self.assertNotIn("b", cache)
+        self.assertEqual(cache.get("b", "gone"), "gone")
+        self.assertEqual(sorted(cache.keys()), ["a", "c"])
+
+
+    def test_popAndClear(self):
+        cache = LRUCache(2)
+        cache.set("a", 1)
+        cache.set("a", 2)
+        self.assertEqual(cache.pop("a"), 2)
+        self.assertEqual(cache.pop("a"), None)
+
+        cache.set("b", 1)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+
+
+class ExpiringCacheTests(TestCase):
+
+    def test_expiry(self):
+        clock = Clock()
+        cache = ExpiringCache(10, clock)
+        cache.set("a", 1, 5)
+        cache.set("b", 2, 10)
+
+        clock.advance(5)
+        self.assertEqual(cache.get("a", "gone"), "gone")
+        self.assertEqual(cache.get("b"), 2)
+        self.assertEqual(len(cache), 1)
+
+        self.assertEqual(cache.pop("b"), 2)
+        self.assertEqual(cache.pop("b", "gone"), "gone")
+
+        cache.set("c", 3, 1)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+
+    def test_defaultClock(self):
+        """
+        Without a clock, the reactor is used.
+        """
+        self.assertIs(ExpiringCache(10).clock, reactor)
+
+
+
+class ResponseCacheTests(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+
+
+    def test_expiry(self):
+        """
+        Responses are served until their TTL is up, counting hits and misses.
+        """
+        cache = ResponseCache(10, clock=self.clock)
+        key = cache.key(1, (), {"a": 1})
+
+        self.assertIs(cache.get(key, "application/json"), None)
+        cache.set(key, "application/json", "body")
+
+        self.clock.advance(9)
+        self.assertEqual(cache.get(key, "application/json"), "body")
+        self.assertIs(cache.get(key, "text/html"), None)
+
+        self.clock.advance(1)
+        self.assertIs(cache.get(key, "application/json"), None)
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+
+
+    def test_defaultClock(self):
+        """
+        Without a clock, the reactor is used.
+        """
+        self.assertIs(ResponseCache(10).clock, reactor)
+
+
+    def test_keyFields(self):
+        """
+        Only the params and auth fields that are asked for are in the key.
+        """
+        cache = ResponseCache(10, params=["a"], auth=["username"],
+                              clock=self.clock)
+
+        self.assertEqual(
+            cache.key(1, (), {"a": 1, "b": 2}, {"username": "x", "y": 1}),
+            cache.key(1, [], {"a": 1, "b": 3}, {"username": "x"}))
+        self.assertNotEqual(cache.key(1, (), {"a": 1}),
+                            cache.key(1, (), {"a": 2}))
+        self.assertNotEqual(cache.key(1, (), {}, {"username": "x"}),
+                            cache.key(1, (), {}, {"username": "y"}))
+        self.assertNotEqual(cache.key(1, ("x",)), cache.key(2, ("x",)))
+
+
+    def test_allFieldsByDefault(self):
+        cache = ResponseCache(10, clock=self.clock)
+
+        self.assertNotEqual(cache.key(1, (), {"a": 1, "b": 2}),
+                            cache.key(1, (), {"a": 1, "b": 3}))
+        self.assertEqual(cache.key(1, (), {"a": [1], "b": {"c": 2}}),
+                         cache.key(1, (), {"b": {"c": 2}, "a": [1]}))
+
+
+    def test_anyParams(self):
+        """
+        Params from any input format can be in the key, such as bytes and
+        datetimes from MessagePack or CBOR, and the key is the same for
+        equal params.
+        """
+        cache = ResponseCache(10, clock=self.clock)
+
+        def params():
+            return {"a": b"\xff\x00", "b": datetime(2020, 1, 2),
+                    "c": [{"d": set([1, 2])}, bytearray(b"e")]}
+
+        self.assertEqual(cache.key(1, (), params()), cache.key(1, (), params()))
+        self.assertEqual(len(set([cache.key(1, (), params()),
+                                  cache.key(1, (), params())])), 1)
+        self.assertNotEqual(cache.key(1, (), {"a": 1}),
+                            cache.key(1, (), {"a": [1]}))
+        self.assertNotEqual(cache.key(1, (), {"a": {"b": 1}}),
+                            cache.key(1, (), {"a": [["b", 1]]}))
+        self.assertNotEqual(cache.key(1, (), {"a": bytearray(b"b")}),
+                            cache.key(1, (), {"a": bytearray(b"c")}))
+
+
+    def test_maxEntries(self):
+        """
+        The least recently used keys are evicted, with all their variants.
+        """
+        cache = ResponseCache(10, maxEntries=2, clock=self.clock)
+
+        for i in range(3):
+            key = cache.key(1, (), {"i": i})
+            cache.set(key, "a", "body")
+            cache.set(key, "b", "body")
+
+        self.assertEqual(len(cache), 2)
+        self.assertIs(cache.get(cache.key(1, (), {"i": 0}), "a"), None)
+
+
+    def test_invalidate(self):
+        cache = ResponseCache(10, clock=self.clock)
+        cache.set(cache.key(1, (), {"a": 1}), "a", "body")
+        cache.set(cache.key(1, (), {"a": 2}), "a", "body")
+        cache.set(cache.key(2, (), {"a": 1}), "a", "body")
+
+        cache.invalidate(1, (), {"a": 1})
+        self.assertIs(cache.get(cache.key(1, (), {"a": 1}), "a"), None)
+        self.assertEqual(len(cache), 2)
+
+        cache.clear(1)
+        self.assertEqual(len(cache), 1)
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
@@ -0,0 +1,275 @@
+import json
+import zlib
+
+from twisted.trial.unittest import TestCase
+
+from saratoga.api import SaratogaAPI
+from saratoga.compression import Compression
+from saratoga.test.requestMock import requestMock
+from saratoga.test.test_timing import RecordingSink
+
+
+def gunzip(data):
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+
+
+class CompressedAPIImpl(object):
+    class v1(object):
+        def large_GET(self, request, params):
+            self.calls += 1
+            return [{"id": i, "name": "item"} for i in range(200)]
+
+        def small_GET(self, request, params):
+            return {"id": 1}
+
+        def stream_GET(self, request, params):
+            return ({"id": i} for i in range(200))
+
+        def brokenStream_GET(self, request, params):
+            raise ValueError("Broken.")
+            yield
+
+
+
+class CompressedServiceClass(object):
+
+    def __init__(self):
+        self.calls = 0
+
+
+
+CompressedAPIDef = {
+    "metadata": {"versions": [1]},
+    "endpoints": [
+        {"endpoint": "large", "getProcessors": [
+            {"versions": [1], "cache": {"ttl": 10}}]},
+        {"endpoint": "small", "getProcessors": [{"versions": [1]}]},
+        {"endpoint": "stream", "getProcessors": [{"versions": [1]}]},
+        {"endpoint": "brokenStream", "getProcessors": [{"versions": [1]}]}
+    ]
+}
+
+
+
+class CompressionTests(TestCase):
+
+    def negotiate(self, header, **kwargs):
+        headers = {"Accept-Encoding": [header]} if header is not None else {}
+        return Compression(**kwargs).negotiate(
+            requestMock("/", headers=headers))
+
+
+    def test_negotiate(self):
+        self.assertEqual(self.negotiate(None), None)
+        self.assertEqual(self.negotiate("gzip, deflate"), "gzip")
+        self.assertEqual(self.negotiate("deflate"), "deflate")
+        self.assertEqual(self.negotiate("GZIP"), "gzip")
+        self.assertEqual(self.negotiate("*"), "gzip")
+        self.assertEqual(self.negotiate("identity"), None)
+        self.assertEqual(self.negotiate("br"), None)
+
+
+    def test_qualities(self):
+        """
+        The encoding with the highest quality wins, and ones with a quality
+        of 0 aren't used.
+        """
+        self.assertEqual(self.negotiate("gzip;q=0.5, deflate"), "deflate")
+        self.assertEqual(self.negotiate("gzip;q=0"), None)
+        self.assertEqual(self.negotiate("*, gzip;q=0"), "deflate")
+        self.assertEqual(self.negotiate("gzip;q=bad, deflate;q=0.1"),
+                         "deflate")
+
+        # Other parameters, and empty items, are ignored
+        self.assertEqual(self.negotiate("gzip;level=1;q=0.5, , deflate"),
+                         "deflate")
+
+
+    def test_preference(self):
+        """
+        When the client doesn't mind, the first of C{encodings} is used.
+        """
+        self.assertEqual(
+            self.negotiate("gzip, deflate", encodings=["deflate", "gzip"]),
+            "deflate")
+        self.assertEqual(self.negotiate("gzip", encodings=["deflate"]),
+                         None)
+
+
+    def test_unknownEncoding(self):
+        self.assertRaises(ValueError, Compression, encodings=["br"])
+
+
+    def test_encode(self):
+        """
+        Bodies at least C{minimumSize} bytes long are compressed.
+        """
+        compression = Compression(minimumSize=10, level=9)
+        body = "a" * 100
+
+        self.assertEqual(compression.encode("gzip", "a" * 9), (None, "a" * 9))
+
+        encoding, data = compression.encode("gzip", body)
+        self.assertEqual((encoding, gunzip(data)), ("gzip", body))
+
+        encoding, data = compression.encode("deflate", body)
+        self.assertEqual((encoding, zlib.decompress(data)), ("deflate", body))
+
+
+    def test_encodeChunks(self):
+        """
+        Chunks are compressed as they come, and closing the result closes
+        the chunks.
+        """
+        closed = []
+
+        def chunks():
+            try:
+                for i in range(100):
+                    yield str(i)
+            finally:
+                closed.append(True)
+
+        compression = Compression()
+        data = "".join(compression.encodeChunks("gzip", chunks()))
+        self.assertEqual(gunzip(data), "".join(str(i) for i in range(100)))
+
+        encoded = compression.encodeChunks("gzip", chunks())
+        next(encoded, None)
+        encoded.close()
+        self.assertEqual(closed, [True, True])
+
+        # Chunks that can't be closed don't need to be
+        data = "".join(compression.encodeChunks("gzip", ["a", "b"]))
+        self.assertEqual(gunzip(data), "ab")
+
+
+
+class APICompressionTests(TestCase):
+
+    def setUp(self):
+        self.serviceClass = CompressedServiceClass()
+        self.api = SaratogaAPI(CompressedAPIImpl, CompressedAPIDef,
+                               serviceClass=self.serviceClass,
+                               compression=Compression(minimumSize=100))
+
+
+    def get(self, path, encoding="gzip"):
+        headers = {"Accept-Encoding": [encoding]} if encoding else None
+        return self.api.test(path, headers=headers, useBody=False)
+
+
+    def test_compressed(self):
+        d = self.get("/v1/large")
+
+        def rendered(request):
+            request.setHeader.assert_any_call("Content-Encoding", "gzip")
+            request.setHeader.assert_any_call("Vary", "Accept-Encoding")
+            data = json.loads(gunzip(request.getWrittenData()))
+            self.assertEqual(len(data["data"]), 200)
+
+        return d.addCallback(rendered)
+
+
+    def test_timed(self):
+        """
+        Compressing is timed.
+        """
+        sink = RecordingSink()
+        self.api.addTimingHook(sink)
+
+        def rendered(request):
+            phases = [phase for phase, t in sink.timed[0][3]]
+            self.assertEqual(phases[-3:], ["serialise", "compress", "write"])
+
+        return self.get("/v1/large").addCallback(rendered)
+
+
+    def test_notAccepted(self):
+        """
+        Responses aren't compressed for clients that don't ask for it, but
+        say that they could have been.
+        """
+        d = self.get("/v1/large", encoding=None)
+
+        def rendered(request):
+            self.assertNotIn("Content-Encoding", [
+                call[0][0] for call in request.setHeader.call_args_list])
+            request.setHeader.assert_any_call("Vary", "Accept-Encoding")
+            json.loads(request.getWrittenData())
+
+        return d.addCallback(rendered)
+
+
+    def test_small(self):
+        """
+        Responses smaller than C{minimumSize} aren't compressed.
+        """
+        d = self.get("/v1/small")
+
+        def rendered(request):
+            self.assertEqual(json.loads(request.getWrittenData()),
+                             {"status": "success", "data": {"id": 1}})
+
+        return d.addCallback(rendered)
+
+
+    def test_stream(self):
+        """
+        Streamed responses are compressed as they are written.
+        """
+        d = self.get("/v1/stream", encoding="deflate")
+
+        def rendered(request):
+            request.setHeader.assert_any_call("Content-Encoding", "deflate")
+            data = json.loads(zlib.decompress(request.getWrittenData()))
+            self.assertEqual(data["data"], [{"id": i} for i in range(200)])
+
+        return d.addCallback(rendered)
+
+
+    def test_streamFailedEarly(self):
+        """
+        Streams that fail before writing anything get an error response
+        which doesn't say that it's compressed when it isn't.
+        """
+        d = self.get("/v1/brokenStream")
+
+        def rendered(request):
+            self.assertEqual(request.code, 500)
+            self.assertIs(request.responseHeaders.getRawHeaders(
+                "Content-Encoding"), None)
+            json.loads(request.getWrittenData())
+            self.assertEqual(len(self.flushLoggedErrors(ValueError)), 1)
+
+        return d.addCallback(rendered)
+
+
+    def test_cached(self):
+        """
+        The response cache keeps compressed responses, for each encoding.
+        """
+        cache = self.api.responseCaches[("large", 1)]
+
+        d = self.get("/v1/large")
+        d.addCallback(lambda _: self.get("/v1/large"))
+
+        def cachedGzip(request):
+            request.setHeader.assert_any_call("Content-Encoding", "gzip")
+            gunzip(request.getWrittenData())
+            self.assertEqual((self.serviceClass.calls, cache.hits), (1, 1))
+            return self.get("/v1/large", encoding="deflate")
+
+        def deflate(request):
+            zlib.decompress(request.getWrittenData())
+            return self.get("/v1/large", encoding=None)
+
+        def identity(request):
+            json.loads(request.getWrittenData())
+            self.assertEqual(self.serviceClass.calls, 3)
+
+        d.addCallback(cachedGzip)
+        d.addCallback(deflate)
+        d.addCallback(identity)
+        return d
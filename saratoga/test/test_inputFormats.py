@@ -0,0 +1,236 @@
+import json
+
+from twisted.trial.unittest import TestCase, SkipTest
+
+from saratoga import BadRequestParams, inputFormats
+from saratoga.api import SaratogaAPI
+from saratoga.test.requestMock import requestMock, _render
+
+
+class EchoAPIImpl(object):
+    class v1(object):
+        def echo_POST(self, request, params):
+            return params["params"]
+
+        def echo_GET(self, request, params):
+            return params["params"]
+
+
+
+EchoAPIDef = {
+    "metadata": {"versions": [1]},
+    "endpoints": [{
+        "endpoint": "echo",
+        "getProcessors": [{"versions": [1]}],
+        "postProcessors": [{"versions": [1]}]
+    }]
+}
+
+
+
+class InputRegistryTests(TestCase):
+
+    def setUp(self):
+        self.parsed = []
+
+        def loads(body):
+            self.parsed.append(body)
+            return json.loads(body)
+
+        self.registry = inputFormats.InputRegistry("application/json")
+        self.registry.register("application/json", loads)
+        self.registry.register("application/x-www-form-urlencoded",
+                               inputFormats.loadFormURLEncoded)
+
+
+    def parse(self, body, contentType=None):
+        headers = {"Content-Type": [contentType]} if contentType else None
+        return self.registry.parse(
+            requestMock("/", method="POST", body=body, headers=headers), body)
+
+
+    def test_emptyBody(self):
+        """
+        Empty bodies aren't parsed at all.
+        """
+        self.assertEqual(self.parse("", "application/json"), None)
+        self.assertEqual(self.parse(""), None)
+        self.assertEqual(self.parsed, [])
+
+
+    def test_contentType(self):
+        """
+        The parser is picked from the media type, whatever its case and
+        parameters.
+        """
+        self.assertEqual(self.parse("a=1&b=2&b=3",
+                                    "Application/X-WWW-Form-URLEncoded"),
+                         {"a": "1", "b": ["2", "3"]})
+        self.assertEqual(self.parse('{"a": 1}',
+                                    "application/json; charset=utf-8"),
+                         {"a": 1})
+        self.assertEqual(self.parsed, ['{"a": 1}'])
+
+
+    def test_default(self):
+        """
+        Bodies that don't say what they are, or are something unknown, are
+        parsed with the default format, and ignored if they aren't valid.
+        """
+        self.assertEqual(self.parse('{"a": 1}'), {"a": 1})
+        self.assertEqual(self.parse('{"a": 1}', "text/plain"), {"a": 1})
+        self.assertEqual(self.parse("not json"), None)
+        self.assertEqual(self.parse("not json", "text/plain"), None)
+
+
+    def test_invalid(self):
+        """
+        Bodies that say what they are, but aren't, are bad requests.
+        """
+        e = self.assertRaises(BadRequestParams, self.parse, "not json",
+                              "application/json; charset=utf-8")
+        self.assertEqual(e.message,
+                         "Request body is not valid application/json.")
+
+
+    def test_formURLEncoded(self):
+        self.assertEqual(
+            inputFormats.loadFormURLEncoded("a=1&b=&c=x%20y&c=z"),
+            {"a": "1", "b": "", "c": ["x y", "z"]})
+
+
+    def test_formNotJSON(self):
+        """
+        Form bodies that only look like JSON are parsed as forms.
+        """
+        self.assertEqual(
+            inputFormats.loadFormURLEncoded("{a=1", jsonLoads=json.loads),
+            {"{a": "1"})
+
+
+    def test_cborExtraData(self):
+        """
+        CBOR bodies with more than one value are invalid.
+        """
+        if inputFormats.cbor2 is None:
+            raise SkipTest("cbor2 is not installed.")
+
+        self.assertRaises(ValueError, inputFormats.loadCBOR, "\x01\x02")
+
+
+
+class APIInputTests(TestCase):
+
+    def setUp(self):
+        self.api = SaratogaAPI(EchoAPIImpl, EchoAPIDef)
+
+
+    def request(self, method="POST", body=None, contentType=None, args=None):
+        headers = {"Content-Type": [contentType]} if contentType else None
+        request = requestMock("/v1/echo", method=method, body=body,
+                              headers=headers, args=args)
+        return _render(self.api.resource, request).addCallback(
+            lambda _: (request.code, json.loads(request.getWrittenData())))
+
+
+    def test_onlyInstalled(self):
+        """
+        MessagePack and CBOR bodies are only parsed if their libraries are
+        installed.
+        """
+        for module, parsed in [(None, False), (object(), True)]:
+            self.patch(inputFormats, "msgpack", module)
+            self.patch(inputFormats, "cbor2", module)
+            registry = SaratogaAPI(EchoAPIImpl, EchoAPIDef).inputRegistry
+
+            for mediaType in ["application/msgpack", "application/cbor"]:
+                self.assertEqual(
+                    registry.getParser(mediaType) is not None, parsed)
+
+
+    def test_customRegistry(self):
+        """
+        An API can be given its own L{inputFormats.InputRegistry}.
+        """
+        registry = inputFormats.InputRegistry("text/plain")
+        registry.register("text/plain", lambda body: {"text": body})
+        self.api = SaratogaAPI(EchoAPIImpl, EchoAPIDef,
+                               inputRegistry=registry)
+
+        d = self.request(body="hello")
+        d.addCallback(self.assertEqual, (200, {
+            "status": "success", "data": {"text": "hello"}}))
+        return d
+
+
+    def test_form(self):
+        d = self.request(body="name=saratoga&tag=a&tag=b",
+                         contentType="application/x-www-form-urlencoded")
+        d.addCallback(self.assertEqual, (200, {
+            "status": "success",
+            "data": {"name": "saratoga", "tag": ["a", "b"]}}))
+        return d
+
+
+    def test_formQueryArgs(self):
+        """
+        Form bodies are given the query arguments they don't have, which
+        Twisted puts in C{request.args} along with the body's fields.
+        """
+        d = self.request(body="name=saratoga",
+                         contentType="application/x-www-form-urlencoded",
+                         args={"name": ["saratoga"], "page": ["2"]})
+        d.addCallback(self.assertEqual, (200, {
+            "status": "success",
+            "data": {"name": "saratoga", "page": "2"}}))
+        return d
+
+
+    def test_jsonAsForm(self):
+        """
+        JSON objects sent as form data, like C{curl -d} does, are parsed as
+        JSON, without the field Twisted made of them.
+        """
+        body = json.dumps({"name": "earth"})
+        d = self.request(body=body,
+                         contentType="application/x-www-form-urlencoded",
+                         args={body: [""], "page": ["2"]})
+        d.addCallback(self.assertEqual, (200, {
+            "status": "success", "data": {"name": "earth", "page": "2"}}))
+        return d
+
+
+    def test_jsonQueryArgs(self):
+        """
+        JSON bodies are given the query arguments they don't have.
+        """
+        d = self.request(body=json.dumps({"a": 1}),
+                         contentType="application/json",
+                         args={"a": ["2"], "b": ["3"]})
+        d.addCallback(self.assertEqual, (200, {
+            "status": "success", "data": {"a": 1, "b": "3"}}))
+        return d
+
+
+    def test_invalid(self):
+        """
+        Invalid JSON bodies that say they are JSON get a 400.
+        """
+        d = self.request(body="{not json", contentType="application/json")
+        d.addCallback(self.assertEqual, (400, {
+            "status": "fail",
+            "data": "Request body is not valid application/json."}))
+        return d
+
+
+    def test_queryArgs(self):
+        """
+        Requests with empty bodies use their query arguments, without trying
+        to parse the body.
+        """
+        self.patch(self.api.inputRegistry, "_parsers", {})
+
+        d = self.request(method="GET", args={"a": ["1"]})
+        d.addCallback(self.assertEqual, (200, {
+            "status": "success", "data": {"a": "1"}}))
+        return d
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+from twisted.trial.unittest import TestCase
+
+from saratoga import jsoncodec
+from saratoga.api import SaratogaAPI
+
+from collections import namedtuple
+
+import json
+import sys
+
+class EchoAPI(object):
+    class v1(object):
+        def example_POST(self, request, params):
+            return params
+
+
+EchoDef = {
+    "metadata": {"name": "echo", "versions": [1]},
+    "endpoints": [{
+        "endpoint": "example",
+        "postProcessors": [{"versions": [1]}]
+    }]
+}
+
+Point = namedtuple("Point", ["x", "y"])
+
+
+class FakeModule(object):
+
+    def __init__(self, **attrs):
+        self.__dict__.update(attrs)
+
+
+payloads = [
+    {"status": "success", "data": {}},
+    {"status": "success", "data": [{"id": 1, "name": u"Zo\xeb", "tags": [],
+                                    "score": 1.1, "ok": True, "none": None},
+                                   "a\nb", 10 ** 30, -0.5e-10]},
+    {"status": "fail", "data": u"Ünïcödé ☃"},
+    {"status": "success", "data": Point(1, 2)},
+]
+
+
+class CodecTests(TestCase):
+
+    def test_defaultCodecMatchesStdlib(self):
+        """
+        Whatever codec is picked, it serialises exactly like the stdlib.
+        """
+        codec = jsoncodec.findCodec()
+
+        for payload in payloads:
+            self.assertEqual(codec.dumps(payload), json.dumps(payload))
+            self.assertEqual(
+                codec.dumps(payload, sort_keys=True, indent=4,
+                            separators=(',', ': ')),
+                json.dumps(payload, sort_keys=True, indent=4,
+                           separators=(',', ': ')))
+
+
+    def test_defaultCodecParses(self):
+        """
+        Whatever codec is picked, it parses like the stdlib.
+        """
+        codec = jsoncodec.findCodec()
+
+        for payload in payloads[:3]:
+            self.assertEqual(codec.loads(json.dumps(payload)), payload)
+
+        self.assertRaises(ValueError, codec.loads, "{not json")
+
+
+    def installModule(self, name, module):
+        """
+        Make importing C{name} give C{module} (or fail, if it's C{None}) for
+        the rest of the test.
+        """
+        missing = object()
+        old = sys.modules.get(name, missing)
+        sys.modules[name] = module
+
+        def restore():
+            if old is missing:
+                del sys.modules[name]
+            else:
+                sys.modules[name] = old
+
+        self.addCleanup(restore)
+
+
+    def test_ujson(self):
+        """
+        ujson is used with precise floats when it's installed, with integers
+        too big for it parsed by json instead.
+        """
+        calls = []
+
+        def loads(s, precise_float=False):
+            calls.append(precise_float)
+            if "0" * 20 in s:
+                raise OverflowError()
+            return json.loads(s)
+
+        self.installModule("ujson", FakeModule(loads=loads))
+        codec = jsoncodec.findCodec()
+
+        self.assertEqual(repr(codec), "<JSONCodec ujson>")
+        self.assertEqual(codec.loads('{"a": 1.5}'), {"a": 1.5})
+        self.assertEqual(codec.loads("[%d]" % (10 ** 30,)), [10 ** 30])
+        self.assertRaises(ValueError, codec.loads, "{not json")
+        self.assertEqual(set(calls), set([True]))
+
+
+    def test_ujsonWithoutPreciseFloat(self):
+        """
+        ujson 2, which doesn't take C{precise_float}, is used without it.
+        """
+        self.installModule("ujson", FakeModule(loads=json.loads))
+        codec = jsoncodec.findCodec()
+
+        self.assertEqual(repr(codec), "<JSONCodec ujson>")
+        self.assertEqual(codec.loads('{"a": 1.5}'), {"a": 1.5})
+
+
+    def test_ujsonImpreciseFloats(self):
+        """
+        ujson isn't used if it parses floats differently to json.
+        """
+        self.installModule("ujson", FakeModule(
+            loads=lambda s: json.loads(s, parse_float=lambda f: 0.0)))
+
+        self.assertIs(jsoncodec.findCodec(), jsoncodec.stdlibCodec)
+
+
+    def test_fallback(self):
+        """
+        With ujson not installed, the stdlib's codec is used.
+        """
+        self.installModule("ujson", None)
+
+        self.assertIs(jsoncodec.findCodec(), jsoncodec.stdlibCodec)
+
+
+    def test_repr(self):
+        self.assertEqual(repr(jsoncodec.stdlibCodec), "<JSONCodec json>")
+
+
+
+class APICodecTests(TestCase):
+
+    def setUp(self):
+        self.calls = []
+
+        def loads(s):
+            self.calls.append("loads")
+            return json.loads(s)
+
+        def dumps(obj, **kwargs):
+            self.calls.append("dumps")
+            return json.dumps(obj, **kwargs)
+
+        self.api = SaratogaAPI(EchoAPI, EchoDef,
+                               jsonCodec=jsoncodec.JSONCodec(
+                                   "counting", loads, dumps))
+
+
+    def test_codecUsed(self):
+        """
+        The API's codec parses request bodies and serialises responses.
+        """
+        def rendered(request):
+            self.assertEqual(json.loads(request.getWrittenData()),
+                             {"status": "success",
+                              "data": {"params": {"a": "b"}, "auth": None}})
+            self.assertEqual(self.calls, ["loads", "dumps"])
+
+        return self.api.test("/v1/example", method="POST",
+                             params={"a": "b"}).addCallback(rendered)
+
+
+    def test_defaultCodec(self):
+        """
+        APIs use the default codec unless given another.
+        """
+        api = SaratogaAPI(EchoAPI, EchoDef)
+        self.assertIs(api.jsonCodec, jsoncodec.defaultCodec)
@@ -0,0 +1,519 @@
+import gc
+import json
+
+from base64 import b64encode
+
+from twisted.internet.address import IPv4Address, UNIXAddress
+from twisted.internet.defer import Deferred, CancelledError, fail
+from twisted.internet.error import ConnectionDone
+from twisted.internet.task import Clock
+from twisted.python.failure import Failure
+from twisted.trial.unittest import TestCase
+
+from saratoga import ServiceUnavailable, TooManyRequests
+from saratoga.api import SaratogaAPI
+from saratoga.auth import (
+    DefaultAuthenticator, InMemoryStringSharedSecretSource)
+from saratoga.limits import ConcurrencyLimiter, RateLimiter
+from saratoga.metrics import Metrics
+from saratoga.test.requestMock import requestMock, _render
+
+
+class LimitedAPIImpl(object):
+    class v1(object):
+        def slow_GET(self, request, params):
+            d = Deferred()
+            self.waiting.append(d)
+            return d
+
+        def unlimited_GET(self, request, params):
+            return {}
+
+        def cancelled_GET(self, request, params):
+            return fail(CancelledError())
+
+
+
+class LimitedServiceClass(object):
+
+    auth = DefaultAuthenticator(InMemoryStringSharedSecretSource([
+        {"username": "alice", "password": "pass"}]))
+
+    def __init__(self):
+        self.waiting = []
+
+
+
+LimitedAPIDef = {
+    "metadata": {"versions": [1]},
+    "endpoints": [
+        {"endpoint": "slow", "getProcessors": [
+            {"versions": [1], "maxConcurrent": 1, "maxQueued": 1,
+             "retryAfter": 2.5, "requestSchema": {
+                 "type": "object",
+                 "properties": {"n": {"type": "integer"}}}}]},
+        {"endpoint": "private", "func": "slow",
+         "requiresAuthentication": True, "getProcessors": [
+             {"versions": [1], "maxConcurrent": 1, "maxQueued": 1}]},
+        {"endpoint": "unlimited", "getProcessors": [{"versions": [1]}]},
+        {"endpoint": "cancelled", "getProcessors": [{"versions": [1]}]}
+    ]
+}
+
+
+
+class ConcurrencyLimiterTests(TestCase):
+
+    def test_acquire(self):
+        """
+        Up to C{maxConcurrent} turns are given straight away, then up to
+        C{maxQueued} wait, and the rest are turned away.
+        """
+        limiter = ConcurrencyLimiter(2, maxQueued=1, retryAfter=3)
+
+        self.assertIs(self.successResultOf(limiter.acquire()), None)
+        self.assertIs(self.successResultOf(limiter.acquire()), None)
+
+        queued = limiter.acquire()
+        self.assertNoResult(queued)
+
+        e = self.assertRaises(ServiceUnavailable, limiter.acquire)
+        self.assertEqual((e.code, e.retryAfter), (503, 3))
+        self.assertEqual((limiter.active, limiter.queued, limiter.shed),
+                         (2, 1, 1))
+
+
+    def test_release(self):
+        """
+        Releasing a turn gives it to the first request in the queue.
+        """
+        limiter = ConcurrencyLimiter(1, maxQueued=2)
+        limiter.acquire()
+        first, second = limiter.acquire(), limiter.acquire()
+
+        limiter.release()
+        self.successResultOf(first)
+        self.assertNoResult(second)
+        self.assertEqual((limiter.active, limiter.queued), (1, 1))
+
+        limiter.release()
+        limiter.release()
+        self.successResultOf(second)
+        self.assertEqual((limiter.active, limiter.queued), (0, 0))
+
+
+    def test_cancel(self):
+        """
+        Cancelling a queued request gives up its place in the queue.
+        """
+        limiter = ConcurrencyLimiter(1, maxQueued=1)
+        limiter.acquire()
+        queued = limiter.acquire()
+
+        queued.cancel()
+        self.failureResultOf(queued, CancelledError)
+        self.assertEqual(limiter.queued, 0)
+        self.assertNoResult(limiter.acquire())
+
+
+    def test_holdUntilFinished(self):
+        """
+        A request holds its turn until it finishes.
+        """
+        limiter = ConcurrencyLimiter(1)
+        request = requestMock("/")
+
+        self.successResultOf(limiter.hold(request))
+        self.assertEqual(limiter.active, 1)
+
+        request.finish()
+        self.assertEqual(limiter.active, 0)
+
+
+    def test_holdLost(self):
+        """
+        A queued request that is lost gives up its place, without affecting
+        the request that's running.
+        """
+        limiter = ConcurrencyLimiter(1, maxQueued=1)
+        running = requestMock("/")
+        queued = requestMock("/")
+
+        limiter.hold(running)
+        d = limiter.hold(queued)
+
+        queued.connectionLost(Failure(ConnectionDone()))
+        self.failureResultOf(d, CancelledError)
+        self.assertEqual((limiter.active, limiter.queued), (1, 0))
+
+
+
+class APILimitTests(TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+        self.serviceClass = LimitedServiceClass()
+        self.api = SaratogaAPI(LimitedAPIImpl, LimitedAPIDef,
+                               serviceClass=self.serviceClass,
+                               metrics=self.metrics)
+        self.limiter = self.api.limiters[("GET", 1, "slow")]
+
+
+    def test_shed(self):
+        """
+        Once the endpoint is running and queueing as many requests as it
+        can, more requests get a 503 with a C{Retry-After}.
+        """
+        first = self.api.test("/v1/slow")
+        second = self.api.test("/v1/slow")
+
+        self.assertEqual(len(self.serviceClass.waiting), 1)
+        self.assertEqual((self.limiter.active, self.limiter.queued), (1, 1))
+
+        def rendered(request):
+            self.assertEqual(request.code, 503)
+            self.assertEqual(json.loads(request.getWrittenData()), {
+                "status": "error",
+                "data": "Service unavailable, try again later."})
+            request.setHeader.assert_any_call("Retry-After", "3")
+            self.assertEqual(self.limiter.shed, 1)
+
+        d = self.api.test("/v1/slow").addCallback(rendered)
+
+        # Other endpoints aren't limited
+        d.addCallback(lambda _: self.api.test("/v1/unlimited"))
+        d.addCallback(lambda request: self.assertEqual(request.code, 200))
+
+        def finish(_):
+            self.serviceClass.waiting.pop().callback({})
+            return first
+
+        d.addCallback(finish)
+
+        def firstFinished(request):
+            self.assertEqual(request.code, 200)
+            # The queued request gets to run
+            self.assertEqual(len(self.serviceClass.waiting), 1)
+            self.serviceClass.waiting.pop().callback({})
+            return second
+
+        d.addCallback(firstFinished)
+
+        def secondFinished(request):
+            self.assertEqual(request.code, 200)
+            self.assertEqual((self.limiter.active, self.limiter.queued),
+                             (0, 0))
+
+        return d.addCallback(secondFinished)
+
+
+    def test_queuedLost(self):
+        """
+        A queued request that is lost never runs.
+        """
+        self.api.test("/v1/slow")
+        request = requestMock("/v1/slow", body="{}")
+        self.api.getResource().render(request)
+
+        request.connectionLost(Failure(ConnectionDone()))
+        self.serviceClass.waiting.pop().callback({})
+
+        self.assertEqual(self.serviceClass.waiting, [])
+        self.assertEqual((self.limiter.active, self.limiter.queued), (0, 0))
+
+
+    def test_invalidNotQueued(self):
+        """
+        Invalid requests fail without taking a place in the queue.
+        """
+        self.api.test("/v1/slow")
+        results = []
+        self.api.test("/v1/slow", params={"n": "x"}).addCallback(
+            results.append)
+
+        self.assertEqual(results[0].code, 400)
+        self.assertEqual((self.limiter.active, self.limiter.queued), (1, 0))
+
+        gc.collect()
+        self.assertEqual(self.flushLoggedErrors(CancelledError), [])
+
+
+    def test_unauthenticatedNotQueued(self):
+        """
+        Requests that fail before being authenticated don't take a place in
+        the queue, and nothing is left waiting for them.
+        """
+        self.api.test("/v1/private", headers={
+            "Authorization": ["Basic " + b64encode("alice:pass")]})
+        limiter = self.api.limiters[("GET", 1, "private")]
+        results = []
+
+        for header in [None, "Basic !!!"]:
+            headers = {"Authorization": [header]} if header else None
+            self.api.test("/v1/private", headers=headers).addCallback(
+                results.append)
+
+        self.assertEqual([request.code for request in results], [401, 403])
+        self.assertEqual((limiter.active, limiter.queued), (1, 0))
+
+        gc.collect()
+        self.assertEqual(self.flushLoggedErrors(CancelledError), [])
+
+
+    def test_handlerCancelled(self):
+        """
+        Handlers that fail with L{CancelledError}, such as when a call they
+        made timed out, give an internal server error.
+        """
+        request = self.successResultOf(self.api.test("/v1/cancelled"))
+        self.assertEqual(request.code, 500)
+        self.assertEqual(len(self.flushLoggedErrors(CancelledError)), 1)
+
+
+    def test_metrics(self):
+        """
+        The limiters are reported in the metrics.
+        """
+        self.api.test("/v1/slow")
+        self.api.test("/v1/slow")
+        self.api.test("/v1/slow")
+
+        output = self.metrics.prometheus()
+        labels = 'method="GET",version="1",endpoint="slow"'
+        self.assertIn("saratoga_requests_active{%s} 1" % (labels,), output)
+        self.assertIn("saratoga_requests_queued{%s} 1" % (labels,), output)
+        self.assertIn("saratoga_requests_shed_total{%s} 1" % (labels,),
+                      output)
+
+
+
+    def test_withoutMetrics(self):
+        """
+        Endpoints are limited when the API has no metrics.
+        """
+        api = SaratogaAPI(LimitedAPIImpl, LimitedAPIDef,
+                          serviceClass=LimitedServiceClass())
+        limiter = api.limiters[("GET", 1, "slow")]
+
+        api.test("/v1/slow")
+        self.assertEqual((limiter.active, limiter.queued), (1, 0))
+
+
+
+class RateLimiterTests(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        # A token every 0.5s, and up to 4 at once
+        self.limiter = RateLimiter(2, 1, burst=4, clock=self.clock)
+
+
+    def test_defaultClock(self):
+        """
+        Without a clock, the time is told by the global reactor.
+        """
+        from twisted.internet import reactor
+        self.assertIs(RateLimiter(1)._clock, reactor)
+
+
+    def test_burst(self):
+        """
+        Each key can make C{burst} requests at once, and then has to wait
+        for the bucket to refill.
+        """
+        for i in range(4):
+            self.limiter.take("alice")
+
+        e = self.assertRaises(TooManyRequests, self.limiter.take, "alice")
+        self.assertEqual((e.code, e.retryAfter), (429, 0.5))
+        self.assertEqual(self.limiter.limited, 1)
+
+        # Other keys have their own buckets
+        self.limiter.take("bob")
+
+        self.clock.advance(0.5)
+        self.limiter.take("alice")
+        self.assertRaises(TooManyRequests, self.limiter.take, "alice")
+
+
+    def test_rate(self):
+        """
+        Once the bucket is empty, requests can be made at C{requests} every
+        C{seconds}.
+        """
+        for i in range(4):
+            self.limiter.take("alice")
+
+        allowed = 0
+
+        for i in range(20):
+            self.clock.advance(0.25)
+            try:
+                self.limiter.take("alice")
+                allowed += 1
+            except TooManyRequests:
+                pass
+
+        self.assertEqual(allowed, 10)
+
+
+    def test_refill(self):
+        """
+        Buckets don't fill past C{burst}.
+        """
+        self.limiter.take("alice")
+        self.clock.advance(100)
+
+        for i in range(4):
+            self.limiter.take("alice")
+
+        self.assertRaises(TooManyRequests, self.limiter.take, "alice")
+
+
+    def test_expiry(self):
+        """
+        Buckets that have been idle long enough to be full are forgotten,
+        and ones that are still filling up are kept.
+        """
+        # Buckets take two seconds to fill
+        self.limiter.take("bob")
+        self.clock.advance(1.5)
+
+        for i in range(4):
+            self.limiter.take("alice")
+
+        self.assertEqual(self.limiter.buckets, 2)
+
+        # alice's bucket only has one token, rather than being new
+        self.clock.advance(0.5)
+        self.limiter.take("alice")
+        self.assertRaises(TooManyRequests, self.limiter.take, "alice")
+        self.assertEqual(self.limiter.buckets, 2)
+
+        # bob's bucket has been full for a while
+        self.clock.advance(2.5)
+        self.limiter.take("carol")
+        self.assertEqual(self.limiter.buckets, 2)
+
+        self.clock.advance(100)
+        self.limiter.take("dave")
+        self.assertEqual(self.limiter.buckets, 1)
+
+
+
+class RateLimitedAuthenticator(object):
+
+    def auth_usernameAndPassword(self, username, password):
+        return username.upper()
+
+
+
+class RateLimitedServiceClass(object):
+    auth = RateLimitedAuthenticator()
+
+
+
+class RateLimitedAPIImpl(object):
+    class v1(object):
+        def limited_GET(self, request, params):
+            return {}
+
+        def anonymous_GET(self, request, params):
+            return {}
+
+
+
+RateLimitedAPIDef = {
+    "metadata": {"versions": [1]},
+    "endpoints": [
+        {"endpoint": "limited", "requiresAuthentication": True,
+         "getProcessors": [{"versions": [1], "rateLimit": {
+             "requests": 1, "seconds": 10, "burst": 2}}]},
+        {"endpoint": "anonymous", "getProcessors": [
+            {"versions": [1], "rateLimit": {"requests": 1}}]}
+    ]
+}
+
+
+
+class APIRateLimitTests(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.api = SaratogaAPI(RateLimitedAPIImpl, RateLimitedAPIDef,
+                               serviceClass=RateLimitedServiceClass(),
+                               reactor=self.clock)
+
+
+    def get(self, path, username=None):
+        headers = None
+
+        if username:
+            headers = {"Authorization": [
+                "Basic " + b64encode(username + ":pass")]}
+
+        return self.api.test(path, headers=headers)
+
+
+    def test_limited(self):
+        """
+        Calls past the limit get a 429, with a C{Retry-After}.
+        """
+        results = []
+
+        for i in range(3):
+            self.get("/v1/limited", "alice").addCallback(results.append)
+
+        self.assertEqual([r.code for r in results], [200, 200, 429])
+        self.assertEqual(json.loads(results[2].getWrittenData()), {
+            "status": "fail", "data": "Too many requests, try again later."})
+        results[2].setHeader.assert_any_call("Retry-After", "10")
+        self.assertEqual(
+            self.api.rateLimiters[("GET", 1, "limited")].limited, 1)
+
+
+    def test_canonicalUsername(self):
+        """
+        Calls are limited by the username the authenticator gives, and
+        each user has their own limit.
+        """
+        results = []
+
+        for username in ["alice", "ALICE", "Alice", "bob"]:
+            self.get("/v1/limited", username).addCallback(results.append)
+
+        self.assertEqual([r.code for r in results], [200, 200, 429, 200])
+
+
+    def test_unauthenticated(self):
+        """
+        Calls without authentication are limited by their client address.
+        """
+        results = []
+
+        for i in range(2):
+            self.get("/v1/anonymous").addCallback(results.append)
+
+        self.assertEqual([r.code for r in results], [200, 429])
+
+
+    def test_clientAddress(self):
+        """
+        Each client address has its own limit. Clients without an IP
+        address, like those on UNIX sockets, are limited by their whole
+        address.
+        """
+        results = []
+        addresses = [IPv4Address("TCP", "10.0.0.1", 1234),
+                     IPv4Address("TCP", "10.0.0.1", 5678),
+                     IPv4Address("TCP", "10.0.0.2", 1234),
+                     UNIXAddress("a.sock"), UNIXAddress("a.sock"),
+                     UNIXAddress("b.sock")]
+
+        for address in addresses:
+            request = requestMock("/v1/anonymous")
+            request.client = address
+            _render(self.api.getResource(), request)
+            results.append(request.code)
+
+        self.assertEqual(results, [200, 429, 200, 200, 429, 200])
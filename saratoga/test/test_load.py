@@ -0,0 +1,62 @@
+from twisted.internet import reactor
+from twisted.trial.unittest import TestCase
+from twisted.web.server import Site
+
+from saratoga import NoSuchEndpoint
+from saratoga.api import SaratogaAPI
+from saratoga.benchmark.load import LoadGenerator, percentile
+
+
+class LoadAPIImpl(object):
+    class v1(object):
+        def example_GET(self, request, params):
+            return {}
+
+
+
+LoadAPIDef = {
+    "metadata": {"versions": [1]},
+    "endpoints": [{"endpoint": "example",
+                   "getProcessors": [{"versions": [1]}]}]
+}
+
+
+
+class PercentileTests(TestCase):
+
+    def test_percentile(self):
+        values = range(1, 101)
+
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 99.9), 100)
+        self.assertEqual(percentile(values, 0), 1)
+        self.assertEqual(percentile([], 50), None)
+
+
+
+class LoadGeneratorTests(TestCase):
+
+    def test_run(self):
+        """
+        Requests are made round robin over the paths, and their latencies
+        and status codes are recorded.
+        """
+        api = SaratogaAPI(LoadAPIImpl, LoadAPIDef)
+        port = reactor.listenTCP(0, Site(api.getResource()),
+                                 interface="127.0.0.1")
+        self.addCleanup(port.stopListening)
+
+        generator = LoadGenerator(
+            reactor, "http://127.0.0.1:{}".format(port.getHost().port),
+            ["/v1/example", "/v1/nothing"], connections=3)
+        self.addCleanup(generator.close)
+
+        def ran((rate, stats)):
+            self.assertTrue(rate > 0)
+            self.assertEqual(stats["/v1/example"].codes, {200: 5})
+            self.assertEqual(stats["/v1/nothing"].codes, {404: 5})
+            self.assertEqual(stats["/v1/nothing"].summary()["requests"], 5)
+            self.flushLoggedErrors(NoSuchEndpoint)
+
+        return generator.run(10).addCallback(ran)
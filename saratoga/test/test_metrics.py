@@ -0,0 +1,151 @@
+from twisted.internet.defer import Deferred
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from saratoga import NoSuchEndpoint
+from saratoga.api import SaratogaAPI
+from saratoga.metrics import Histogram, Metrics, MetricsResource
+from saratoga.test.requestMock import requestMock, _render
+
+
+class MetricsAPIImpl(object):
+    class v1(object):
+        def fast_GET(self, request, params):
+            return {}
+
+        def slow_GET(self, request, params):
+            self.waiting = Deferred()
+            return self.waiting
+
+
+
+MetricsAPIDef = {
+    "metadata": {"versions": [1]},
+    "endpoints": [
+        {"endpoint": "fast", "getProcessors": [{"versions": [1]}]},
+        {"endpoint": "slow", "getProcessors": [{"versions": [1]}]}
+    ]
+}
+
+
+
+class HistogramTests(TestCase):
+
+    def test_observe(self):
+        histogram = Histogram((0.1, 1.0))
+
+        for value in [0.05, 0.1, 0.5, 2]:
+            histogram.observe(value)
+
+        self.assertEqual(histogram.counts, [2, 1, 1])
+        self.assertEqual(histogram.cumulativeCounts(),
+                         [(0.1, 2), (1.0, 3), (float("inf"), 4)])
+        self.assertEqual((histogram.count, histogram.sum), (4, 2.65))
+
+
+
+class MetricsTests(TestCase):
+
+    def test_prometheus(self):
+        metrics = Metrics(buckets=[0.1])
+        metrics.record("GET", 1, "example", 200, 0.05)
+        metrics.record("GET", 1, "example", 200, 0.5)
+        metrics.record("GET", 1, "example", 404, 0.5)
+        metrics.record("GET", None, None, 404, 0.01)
+
+        self.assertEqual(metrics.prometheus(), """\
+# HELP saratoga_requests_total Requests handled, by route and status code.
+# TYPE saratoga_requests_total counter
+saratoga_requests_total{method="GET",version="",endpoint="",code="404"} 1
+saratoga_requests_total{method="GET",version="1",endpoint="example",code="200"} 2
+saratoga_requests_total{method="GET",version="1",endpoint="example",code="404"} 1
+# HELP saratoga_request_duration_seconds How long requests took to handle, by route.
+# TYPE saratoga_request_duration_seconds histogram
+saratoga_request_duration_seconds_bucket{method="GET",version="",endpoint="",le="0.1"} 1
+saratoga_request_duration_seconds_bucket{method="GET",version="",endpoint="",le="+Inf"} 1
+saratoga_request_duration_seconds_sum{method="GET",version="",endpoint=""} 0.01
+saratoga_request_duration_seconds_count{method="GET",version="",endpoint=""} 1
+saratoga_request_duration_seconds_bucket{method="GET",version="1",endpoint="example",le="0.1"} 1
+saratoga_request_duration_seconds_bucket{method="GET",version="1",endpoint="example",le="+Inf"} 3
+saratoga_request_duration_seconds_sum{method="GET",version="1",endpoint="example"} 1.05
+saratoga_request_duration_seconds_count{method="GET",version="1",endpoint="example"} 3
+""")
+
+
+    def test_escaping(self):
+        metrics = Metrics(buckets=[])
+        metrics.record("GET", 1, 'a\\b"c\n', 200, 0)
+
+        self.assertIn('endpoint="a\\\\b\\"c\\n"', metrics.prometheus())
+
+
+    def test_resource(self):
+        metrics = Metrics()
+        metrics.record("GET", 1, "example", 200, 0.05)
+        request = requestMock("/metrics")
+
+        def rendered(_):
+            self.assertEqual(request.getWrittenData(), metrics.prometheus())
+            request.setHeader.assert_called_with(
+                "Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+
+        return _render(MetricsResource(metrics), request).addCallback(
+            rendered)
+
+
+
+class APIMetricsTests(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.metrics = Metrics()
+        self.api = SaratogaAPI(MetricsAPIImpl, MetricsAPIDef,
+                               reactor=self.clock, metrics=self.metrics)
+
+
+    def test_recorded(self):
+        """
+        Requests are recorded under their route, or under no route if they
+        didn't resolve to one. Methods the API doesn't serve are recorded as
+        C{other}.
+        """
+        d = self.api.test("/v1/fast")
+        d.addCallback(lambda _: self.api.test("/v1/nothing"))
+        d.addCallback(lambda _: self.api.test("/v1/fast", method="POST"))
+        d.addCallback(lambda _: self.api.test("/v1/fast", method="JUNK0"))
+        d.addCallback(lambda _: self.api.test("/v1/fast", method="JUNK1"))
+
+        def rendered(_):
+            routes = self.metrics.routes
+            self.assertEqual(sorted(routes), [
+                ("GET", None, None), ("GET", 1, "fast"),
+                ("POST", None, None), ("other", None, None)])
+            self.assertEqual(routes[("other", None, None)].codes, {405: 2})
+            self.assertEqual(routes[("GET", 1, "fast")].codes, {200: 1})
+            self.assertEqual(routes[("GET", None, None)].codes, {404: 1})
+            self.assertEqual(routes[("POST", None, None)].codes, {405: 1})
+            self.flushLoggedErrors(NoSuchEndpoint)
+
+        return d.addCallback(rendered)
+
+
+    def test_latency(self):
+        """
+        Latency is measured until the response is finished.
+        """
+        d = self.api.test("/v1/slow")
+
+        self.clock.advance(0.3)
+        self.api.serviceClass.waiting.callback({})
+
+        def rendered(_):
+            latency = self.metrics.routes[("GET", 1, "slow")].latency
+            self.assertEqual((latency.count, latency.sum), (1, 0.3))
+
+        return d.addCallback(rendered)
+
+
+    def test_getMetricsResource(self):
+        self.assertIs(self.api.getMetricsResource().metrics, self.metrics)
+        self.assertRaises(Exception, SaratogaAPI(
+            MetricsAPIImpl, MetricsAPIDef).getMetricsResource)
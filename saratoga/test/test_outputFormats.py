@@ -1,8 +1,13 @@
 from twisted.trial.unittest import TestCase
 
 from saratoga import api, outputFormats
+from saratoga.test.requestMock import requestMock, _render
 from saratoga.test.test_api import APIImpl, APIDef
 
+from collections import namedtuple
+
+import json
+
 class SaratogaAcceptHeaderTests(TestCase):
 
     def setUp(self):
@@ -101,3 +106,264 @@ class SaratogaAcceptHeaderTests(TestCase):
                                                  "l,application/json;q=0.7,"
                                                  "application/yaml;q=0.8"]}
                          ).addCallback(rendered)
+
+
+
+class OutputRegistryNegotiationTests(TestCase):
+
+    def setUp(self):
+        self.registry = outputFormats.OutputRegistry("application/json")
+        self.registry.register("application/json",
+                               outputFormats.JSendJSONOutputFormat)
+        self.api = api.SaratogaAPI(APIImpl, APIDef,
+                                   outputRegistry=self.registry)
+
+        self.negotiations = []
+        negotiate = self.registry._negotiator.negotiate
+
+        def countingNegotiate(**kwargs):
+            self.negotiations.append(kwargs)
+            return negotiate(**kwargs)
+
+        self.registry._negotiator.negotiate = countingNegotiate
+
+
+    def test_negotiatedOncePerRequest(self):
+        """
+        The output format is negotiated once, and reused when rendering.
+        """
+        def rendered(request):
+            self.assertEqual(request.code, 200)
+            self.assertEqual(self.negotiations,
+                             [{"accept": "application/json"}])
+
+        return self.api.test("/v1/example",
+                             headers={"Accept": ["application/json"]}
+                         ).addCallback(rendered)
+
+
+    def test_memoizedByAcceptHeader(self):
+        """
+        Requests with an Accept header that has been seen before don't get
+        negotiated again.
+        """
+        d = self.api.test("/v1/example")
+        d.addCallback(lambda _: self.api.test("/v1/example"))
+        d.addCallback(lambda _: self.api.test(
+            "/v1/example", headers={"Accept": ["text/html"]}))
+        d.addCallback(lambda _: self.api.test(
+            "/v1/example", headers={"Accept": ["text/html"]}))
+        d.addCallback(lambda _: self.assertEqual(
+            self.negotiations, [{}, {"accept": "text/html"}]))
+        return d
+
+
+    def test_registerForgetsNegotiations(self):
+        """
+        Registering a new format throws away what was negotiated before.
+        """
+        def rendered(request):
+            self.assertEqual(request.code, 200)
+            self.assertEqual(request.getWrittenData(), "YAML")
+
+        d = self.api.test("/v1/example",
+                          headers={"Accept": ["application/yaml"]})
+        d.addCallback(lambda request: self.assertEqual(request.code, 406))
+        d.addCallback(lambda _: self.registry.register(
+            "application/yaml", lambda status, data: "YAML"))
+        d.addCallback(lambda _: self.api.test(
+            "/v1/example", headers={"Accept": ["application/yaml"]}))
+        d.addCallback(rendered)
+        return d
+
+
+    def test_changeDefaultOutputFormat(self):
+        """
+        Changing the default output format renegotiates.
+        """
+        self.registry.register("application/yaml",
+                               lambda status, data: "YAML")
+        self.registry.defaultOutputFormat = "application/yaml"
+
+        def rendered(request):
+            self.assertEqual(request.getWrittenData(), "YAML")
+
+        return self.api.test("/v1/example").addCallback(rendered)
+
+
+
+Point = namedtuple("Point", ["x", "y"])
+
+
+
+class BinaryAPIImpl(object):
+    class v1(object):
+        def echo_POST(self, request, params):
+            return params["params"]
+
+        def text_GET(self, request, params):
+            return {"name": "plain", "unicode": u"\u2603",
+                    "point": Point(1, 2)}
+
+        def stream_GET(self, request, params):
+            return ({"id": i} for i in range(3))
+
+
+
+BinaryAPIDef = {
+    "metadata": {"versions": [1]},
+    "endpoints": [
+        {"endpoint": "echo", "postProcessors": [{"versions": [1]}]},
+        {"endpoint": "text", "getProcessors": [{"versions": [1]}]},
+        {"endpoint": "stream", "getProcessors": [{"versions": [1]}]}
+    ]
+}
+
+
+
+class BinaryFormatTestsMixin(object):
+    """
+    Tests for a binary output format and request body parser, in
+    C{mediaType}, whose C{loads} and C{dumps} are from its library.
+    """
+
+    def setUp(self):
+        self.api = api.SaratogaAPI(BinaryAPIImpl, BinaryAPIDef)
+
+
+    def request(self, path, method="GET", body=None, contentType=None):
+        headers = {"Accept": [self.mediaType]}
+
+        if contentType:
+            headers["Content-Type"] = [contentType]
+
+        request = requestMock(path, method=method, body=body, headers=headers)
+        return _render(self.api.resource, request).addCallback(
+            lambda _: request)
+
+
+    def test_response(self):
+        """
+        Responses are serialised in the format, with text as text like in
+        JSON, and without a charset.
+        """
+        def rendered(request):
+            request.setHeader.assert_any_call("Content-Type", self.mediaType)
+            self.assertEqual(self.loads(request.getWrittenData()), {
+                u"status": u"success",
+                u"data": {u"name": u"plain", u"unicode": u"\u2603",
+                          u"point": [1, 2]}})
+
+        return self.request("/v1/text").addCallback(rendered)
+
+
+    def test_requestBody(self):
+        """
+        Request bodies with the format's Content-Type are parsed from it.
+        """
+        body = self.dumps({u"a": [1, u"b"], u"c": None})
+
+        def rendered(request):
+            self.assertEqual(self.loads(request.getWrittenData())[u"data"],
+                             {u"a": [1, u"b"], u"c": None})
+
+        return self.request("/v1/echo", method="POST", body=body,
+                            contentType=self.mediaType + "; x=y"
+                        ).addCallback(rendered)
+
+
+    def test_invalidRequestBody(self):
+        """
+        Request bodies that say they are in the format, but aren't, are
+        rejected.
+        """
+        def rendered(request):
+            self.assertEqual(request.code, 400)
+            self.assertEqual(self.loads(request.getWrittenData())[u"data"],
+                             u"Request body is not valid {}.".format(
+                                 self.mediaType))
+
+        return self.request("/v1/echo", method="POST", body="\xc1\xff",
+                            contentType=self.mediaType).addCallback(rendered)
+
+
+    def test_jsonRequestBody(self):
+        """
+        Request bodies without a Content-Type are still parsed as JSON.
+        """
+        def rendered(request):
+            self.assertEqual(self.loads(request.getWrittenData())[u"data"],
+                             {u"a": u"b"})
+
+        return self.request("/v1/echo", method="POST",
+                            body=json.dumps({"a": "b"})).addCallback(rendered)
+
+
+    def test_stream(self):
+        def rendered(request):
+            self.assertEqual(self.loads(request.getWrittenData())[u"data"],
+                             [{u"id": 0}, {u"id": 1}, {u"id": 2}])
+
+        return self.request("/v1/stream").addCallback(rendered)
+
+
+
+class MessagePackTests(BinaryFormatTestsMixin, TestCase):
+    mediaType = "application/msgpack"
+
+    if outputFormats.msgpack is None:
+        skip = "msgpack is not installed."
+    else:
+        loads = staticmethod(
+            lambda data: outputFormats.msgpack.unpackb(data, raw=False))
+        dumps = staticmethod(outputFormats.msgpack.packb)
+
+
+
+class CBORTests(BinaryFormatTestsMixin, TestCase):
+    mediaType = "application/cbor"
+
+    if outputFormats.cbor2 is None:
+        skip = "cbor2 is not installed."
+    else:
+        loads = staticmethod(outputFormats.cbor2.loads)
+        dumps = staticmethod(outputFormats.cbor2.dumps)
+
+
+
+class OptionalFormatTests(TestCase):
+
+    def test_onlyInstalled(self):
+        """
+        MessagePack and CBOR responses are only offered if their libraries
+        are installed.
+        """
+        for module, offered in [(None, False), (object(), True)]:
+            self.patch(outputFormats, "msgpack", module)
+            self.patch(outputFormats, "cbor2", module)
+            registry = api.SaratogaAPI(BinaryAPIImpl,
+                                       BinaryAPIDef).outputRegistry
+
+            for mediaType in ["application/msgpack", "application/cbor"]:
+                self.assertEqual(
+                    mediaType in registry._outputFormatsPreference, offered)
+
+
+
+class ContentTypeTests(TestCase):
+
+    def test_charset(self):
+        """
+        Text formats have a charset in their C{Content-Type}, and binary ones
+        don't.
+        """
+        registry = outputFormats.OutputRegistry("application/json")
+        registry.register("application/json",
+                          outputFormats.JSendJSONOutputFormat)
+        registry.register("application/x-binary", lambda status, data: "",
+                          binary=True)
+
+        self.assertEqual(registry.getContentType("application/json"),
+                         "application/json; charset=utf-8")
+        self.assertEqual(registry.getContentType("application/x-binary"),
+                         "application/x-binary")
@@ -0,0 +1,503 @@
+import json
+import os
+import sys
+
+from twisted.internet.error import ProcessTerminated
+from twisted.python.failure import Failure
+from twisted.trial.unittest import TestCase
+
+from saratoga import ServiceUnavailable, BadRequestParams
+from saratoga.api import SaratogaAPI
+from saratoga.processes import (
+    ProcessPool, TaskTimedOut, WorkerDied, RemoteError, isProcessWorker,
+    serveCalls, PROCESS_WORKER_FDS, _frame, _header)
+from saratoga.test.test_workers import FakeProcess, FakeReactor
+from saratoga.workers import WORKER_FD
+
+import cPickle as pickle
+
+
+class ProcessAPIImpl(object):
+    class v1(object):
+        def square_GET(self, request, params):
+            return {"square": int(params["params"]["n"]) ** 2,
+                    "pid": os.getpid(), "request": repr(request),
+                    "service": self.name}
+
+        def bad_GET(self, request, params):
+            raise BadRequestParams("Bad n.")
+
+        def unpicklable_GET(self, request, params):
+            raise UnpicklableError()
+
+        def cube_GET(self, request, params, n):
+            return int(n) ** 3
+
+
+
+class UnpicklableError(Exception):
+
+    def __reduce__(self):
+        raise TypeError("Can't pickle this.")
+
+
+
+class UnreadableError(Exception):
+
+    def __reduce__(self):
+        return (_unreadable, ())
+
+
+
+def _unreadable():
+    raise TypeError("Can't unpickle this.")
+
+
+
+class ProcessServiceClass(object):
+    name = "processes"
+
+
+
+ProcessAPIDef = {
+    "metadata": {"versions": [1]},
+    "endpoints": [
+        {"endpoint": "square", "getProcessors": [
+            {"versions": [1], "process": True}]},
+        {"endpoint": "bad", "getProcessors": [
+            {"versions": [1], "process": True}]},
+        {"endpoint": "unpicklable", "getProcessors": [
+            {"versions": [1], "process": True}]},
+        {"endpoint": "cube/(\\d+)", "func": "cube", "getProcessors": [
+            {"versions": [1], "process": "maths"}]}
+    ]
+}
+
+
+def runWorker():
+    """
+    Run as a worker of the pool in L{EndToEndTests}.
+    """
+    SaratogaAPI(ProcessAPIImpl, ProcessAPIDef,
+                serviceClass=ProcessServiceClass()).run()
+
+
+
+class FakePipeProcess(FakeProcess):
+
+    def __init__(self, pid):
+        FakeProcess.__init__(self, pid)
+        self.written = []
+        self.closed = []
+
+    def writeToChild(self, fd, data):
+        self.written.append((fd, data))
+
+    def closeChildFD(self, fd):
+        self.closed.append(fd)
+
+
+
+class FakePipeReactor(FakeReactor):
+
+    def spawnProcess(self, protocol, executable, args, env, childFDs):
+        process = FakePipeProcess(next(self._pids))
+        protocol.makeConnection(process)
+        self.spawned.append((protocol, process, args, env, childFDs))
+        return process
+
+
+
+def sentCalls(process):
+    """
+    The calls written to a fake worker process.
+    """
+    calls = []
+
+    for fd, data in process.written:
+        calls.append(pickle.loads(data[_header.size:]))
+
+    return calls
+
+
+
+class ProcessPoolTests(TestCase):
+
+    def setUp(self):
+        self.reactor = FakePipeReactor()
+        self.pool = ProcessPool("test", size=2, maxTasks=2, timeout=10,
+                                maxQueued=1, retryAfter=5, restartDelay=1,
+                                shutdownTimeout=5, reactor=self.reactor,
+                                argv=["service.py"], executable="python")
+
+
+    def respond(self, index, ok, result):
+        worker = self.reactor.spawned[index][0]
+        data = _frame((ok, result))
+        # Split up, like a pipe might
+        worker.childDataReceived(4, data[:3])
+        worker.childDataReceived(4, data[3:])
+
+
+    def test_spawn(self):
+        """
+        Workers are started on the first call, with the pipes to talk over.
+        """
+        self.assertEqual(self.reactor.spawned, [])
+        self.pool.run(1, "square_GET", {"params": {}})
+
+        self.assertEqual(len(self.reactor.spawned), 2)
+        protocol, process, args, env, childFDs = self.reactor.spawned[0]
+        self.assertEqual(args, ["python", "service.py"])
+        self.assertEqual(env[PROCESS_WORKER_FDS], "3,4")
+        self.assertEqual(childFDs, {0: 0, 1: 1, 2: 2, 3: "w", 4: "r"})
+        self.assertEqual(self.reactor.triggers,
+                         [("before", "shutdown", self.pool.stop)])
+
+
+    def test_httpWorkerEnvironment(self):
+        """
+        Workers of an HTTP worker aren't told to serve HTTP.
+        """
+        self.patch(os, "environ", {WORKER_FD: "5"})
+        self.pool.start()
+        self.assertNotIn(WORKER_FD, self.reactor.spawned[0][3])
+
+
+    def test_run(self):
+        """
+        Calls are sent to an idle worker, and its result fires the
+        L{Deferred}.
+        """
+        d = self.pool.run(1, "square_GET", {"params": {"n": 3}}, ["x"])
+
+        self.assertEqual(sentCalls(self.reactor.spawned[0][1]),
+                         [("square_GET", 1, {"params": {"n": 3}}, ("x",))])
+        self.assertEqual(self.pool.busy, 1)
+
+        self.respond(0, True, {"square": 9})
+        self.assertEqual(self.successResultOf(d), {"square": 9})
+        self.assertEqual((self.pool.busy, self.pool.completed), (0, 1))
+
+
+    def test_error(self):
+        """
+        Exceptions from the worker fail the L{Deferred}.
+        """
+        d = self.pool.run(1, "bad_GET", {})
+        self.respond(0, False, BadRequestParams("Bad n."))
+        self.failureResultOf(d, BadRequestParams)
+
+
+    def test_unreadable(self):
+        """
+        Results that can't be unpickled fail the L{Deferred} with
+        L{RemoteError}, and are logged.
+        """
+        d = self.pool.run(1, "a", {})
+        self.respond(0, False, UnreadableError())
+
+        self.failureResultOf(d, RemoteError)
+        self.assertEqual(len(self.flushLoggedErrors(TypeError)), 1)
+        self.assertEqual(self.pool.busy, 0)
+
+
+    def test_framing(self):
+        """
+        Results are only read once all of their frame has come in, and
+        anything written on other pipes is ignored.
+        """
+        d = self.pool.run(1, "a", {})
+        worker = self.reactor.spawned[0][0]
+        data = _frame((True, "a"))
+
+        worker.childDataReceived(2, "Some logging.\n")
+        worker.childDataReceived(4, data[:_header.size + 1])
+        self.assertNoResult(d)
+
+        worker.childDataReceived(4, data[_header.size + 1:])
+        self.assertEqual(self.successResultOf(d), "a")
+
+
+    def test_defaults(self):
+        """
+        Without a reactor or size, the global reactor and a worker for each
+        CPU are used.
+        """
+        from multiprocessing import cpu_count
+        from twisted.internet import reactor
+
+        pool = ProcessPool("default")
+        self.assertIs(pool.reactor, reactor)
+        self.assertEqual(pool.size, cpu_count())
+
+
+    def test_backPressure(self):
+        """
+        When every worker is busy, calls wait for one up to C{maxQueued},
+        and the rest are turned away.
+        """
+        first = self.pool.run(1, "a", {})
+        self.pool.run(1, "b", {})
+        queued = self.pool.run(1, "c", {})
+
+        e = self.assertRaises(ServiceUnavailable, self.pool.run, 1, "d", {})
+        self.assertEqual((e.code, e.retryAfter), (503, 5))
+        self.assertEqual((self.pool.queued, self.pool.shed), (1, 1))
+
+        self.respond(0, True, "a")
+        self.successResultOf(first)
+        self.assertNoResult(queued)
+        self.assertEqual(sentCalls(self.reactor.spawned[0][1])[-1][0], "c")
+        self.assertEqual(self.pool.queued, 0)
+
+
+    def test_recycle(self):
+        """
+        Workers are replaced after C{maxTasks} calls.
+        """
+        # Calls go to each worker in turn
+        for index in [0, 1, 0]:
+            self.pool.run(1, "a", {})
+            self.respond(index, True, None)
+
+        process = self.reactor.spawned[0][1]
+        self.assertEqual(process.closed, [3])
+        self.assertEqual(len(self.reactor.spawned), 3)
+        self.assertEqual((self.pool.recycled, len(self.pool.processes)),
+                         (1, 2))
+        self.assertNotIn(self.reactor.spawned[0][0], self.pool.processes)
+
+        # Ending after being recycled doesn't start another one
+        self.reactor.end(0)
+        self.reactor.advance(1)
+        self.assertEqual(len(self.reactor.spawned), 3)
+
+
+    def test_timeout(self):
+        """
+        Calls that take too long fail, and their worker is killed and
+        replaced.
+        """
+        d = self.pool.run(1, "a", {})
+        self.reactor.advance(10)
+
+        self.failureResultOf(d, TaskTimedOut)
+        self.assertEqual(self.reactor.spawned[0][1].signals, ["KILL"])
+        self.assertEqual(len(self.reactor.spawned), 3)
+        self.assertEqual(self.pool.timedOut, 1)
+
+        # Its result coming in while it's being killed is ignored
+        self.respond(0, True, "a")
+        self.assertEqual((self.pool.busy, self.pool.completed), (0, 1))
+
+        self.reactor.end(0)
+        self.assertEqual(len(self.pool.processes), 2)
+
+
+    def test_finishedInTime(self):
+        d = self.pool.run(1, "a", {})
+        self.reactor.advance(5)
+        self.respond(0, True, "a")
+        self.reactor.advance(10)
+
+        self.successResultOf(d)
+        self.assertEqual(self.reactor.spawned[0][1].signals, [])
+
+
+    def test_workerDied(self):
+        """
+        If a worker dies, its call fails, and it is replaced after
+        C{restartDelay}.
+        """
+        d = self.pool.run(1, "a", {})
+        protocol, process = self.reactor.spawned[0][:2]
+        process.exited = True
+        protocol.processEnded(Failure(ProcessTerminated(signal=9)))
+
+        self.failureResultOf(d, WorkerDied)
+        self.assertEqual(len(self.reactor.spawned), 2)
+        self.reactor.advance(1)
+        self.assertEqual(len(self.reactor.spawned), 3)
+        self.assertEqual(self.pool.busy, 0)
+
+
+    def test_stop(self):
+        """
+        Stopping closes the workers' pipes, fails the calls waiting for a
+        worker, and kills workers that haven't ended after
+        C{shutdownTimeout}.
+        """
+        first = self.pool.run(1, "a", {})
+        second = self.pool.run(1, "b", {})
+        queued = self.pool.run(1, "c", {})
+
+        d = self.pool.stop()
+        self.failureResultOf(queued, WorkerDied)
+
+        for protocol, process, args, env, childFDs in self.reactor.spawned:
+            self.assertEqual(process.closed, [3])
+
+        # The first finishes its call
+        self.respond(0, True, "a")
+        self.reactor.end(0)
+        self.successResultOf(first)
+
+        self.reactor.advance(5)
+        self.assertEqual(self.reactor.spawned[1][1].signals, ["KILL"])
+        self.reactor.end(1)
+
+        self.failureResultOf(second, WorkerDied)
+        self.successResultOf(d)
+        self.assertEqual(len(self.reactor.spawned), 2)
+
+
+    def test_stopReplacing(self):
+        """
+        Workers that time out, or die, while stopping aren't replaced.
+        """
+        timedOut = self.pool.run(1, "a", {})
+        died = self.pool.run(1, "b", {})
+        protocol, process = self.reactor.spawned[1][:2]
+        process.exited = True
+        protocol.processEnded(Failure(ProcessTerminated(signal=9)))
+        self.failureResultOf(died, WorkerDied)
+
+        self.pool.stop()
+        self.reactor.advance(10)
+        self.failureResultOf(timedOut, TaskTimedOut)
+        self.assertEqual(len(self.reactor.spawned), 2)
+
+
+    def test_startAgain(self):
+        """
+        A stopped pool can be started again, without being stopped twice
+        when the reactor shuts down.
+        """
+        self.pool.start()
+        self.pool.stop()
+        self.reactor.end(0)
+        self.reactor.end(1)
+
+        self.pool.start()
+        self.assertEqual(len(self.reactor.spawned), 4)
+        self.assertEqual(len(self.pool.processes), 2)
+        self.assertEqual(len(self.reactor.triggers), 1)
+
+
+
+class ServeCallsTests(TestCase):
+
+    def serve(self, calls):
+        """
+        Run C{calls} through L{serveCalls} over real pipes, and get the
+        results.
+        """
+        callsRead, callsWrite = os.pipe()
+        resultsRead, resultsWrite = os.pipe()
+
+        with os.fdopen(callsWrite, "wb") as f:
+            for call in calls:
+                f.write(_frame(call))
+
+        api = SaratogaAPI(ProcessAPIImpl, ProcessAPIDef,
+                          serviceClass=ProcessServiceClass())
+        serveCalls(api, {PROCESS_WORKER_FDS: "{},{}".format(
+            callsRead, resultsWrite)})
+
+        results = []
+
+        with os.fdopen(resultsRead, "rb") as f:
+            data = f.read()
+
+        while data:
+            length = _header.unpack(data[:_header.size])[0]
+            end = _header.size + length
+            results.append(pickle.loads(data[_header.size:end]))
+            data = data[end:]
+
+        return results
+
+
+    def test_isProcessWorker(self):
+        self.assertFalse(isProcessWorker({}))
+        self.assertTrue(isProcessWorker({PROCESS_WORKER_FDS: "3,4"}))
+
+
+    def test_serve(self):
+        """
+        Calls are run with the service class, and no request.
+        """
+        [(ok, result)] = self.serve(
+            [("square_GET", 1, {"params": {"n": 4}}, ())])
+
+        self.assertTrue(ok)
+        self.assertEqual(result["square"], 16)
+        self.assertEqual(result["request"], "None")
+        self.assertEqual(result["service"], "processes")
+
+
+    def test_args(self):
+        """
+        The groups captured from the path are passed along too.
+        """
+        self.assertEqual(self.serve([("cube_GET", 1, {}, ("3",))]),
+                         [(True, 27)])
+
+
+    def test_errors(self):
+        """
+        Exceptions are sent back, or their traceback if they can't be.
+        """
+        [bad, unpicklable] = self.serve([("bad_GET", 1, {}, ()),
+                                         ("unpicklable_GET", 1, {}, ())])
+
+        self.assertEqual(bad[0], False)
+        self.assertIsInstance(bad[1], BadRequestParams)
+        self.assertEqual(unpicklable[0], False)
+        self.assertIsInstance(unpicklable[1], RemoteError)
+        self.assertIn("UnpicklableError", unpicklable[1].message)
+
+
+
+class EndToEndTests(TestCase):
+
+    def setUp(self):
+        argv = ["-c", "from saratoga.test.test_processes import runWorker; "
+                      "runWorker()"]
+        self.api = SaratogaAPI(
+            ProcessAPIImpl, ProcessAPIDef, serviceClass=ProcessServiceClass(),
+            processPools={"default": {"size": 1, "argv": argv,
+                                      "executable": sys.executable}})
+        self.pool = self.api.processPools["default"]
+        self.addCleanup(self.pool.stop)
+
+
+    def test_pools(self):
+        self.assertEqual(sorted(self.api.processPools), ["default", "maths"])
+        self.assertEqual(self.pool.size, 1)
+
+
+    def test_call(self):
+        """
+        Processors marked with C{process} are run in a worker process.
+        """
+        d = self.api.test("/v1/square", params={"n": ["7"]}, useBody=False)
+
+        def rendered(request):
+            self.assertEqual(request.code, 200)
+            data = json.loads(request.getWrittenData())["data"]
+            self.assertEqual(data["square"], 49)
+            self.assertNotEqual(data["pid"], os.getpid())
+            return self.api.test("/v1/bad", useBody=False)
+
+        def failed(request):
+            self.assertEqual(request.code, 400)
+            self.assertEqual(json.loads(request.getWrittenData()),
+                             {"status": "fail", "data": "Bad n."})
+
+        d.addCallback(rendered)
+        d.addCallback(failed)
+        return d
+
+    test_call.timeout = 30
@@ -0,0 +1,105 @@
+from twisted.trial.unittest import TestCase
+
+from saratoga.routing import Router
+
+
+class RouterTests(TestCase):
+
+    def setUp(self):
+        self.router = Router()
+        self.router.add(("v1", "example"), "example")
+        self.router.add(("v1", "example/info"), "info")
+        self.router.add(("v1", r"example/(\d+)"), "exampleID")
+        self.router.add(("v1", r"example/(\d+)/(\w+)"), "exampleField")
+        self.router.add(("v1", r"(\w+)-thing"), "thing")
+        self.router.add(("v1", r"this|that"), "alternation")
+
+
+    def test_static(self):
+        """
+        Literal endpoints resolve with no captured arguments.
+        """
+        self.assertEqual(self.router.lookup(["v1", "example"]),
+                         ("example", ()))
+        self.assertEqual(self.router.lookup(["v1", "example", "info"]),
+                         ("info", ()))
+
+
+    def test_dynamic(self):
+        """
+        Regex endpoints resolve with the groups they captured.
+        """
+        self.assertEqual(self.router.lookup(["v1", "example", "4"]),
+                         ("exampleID", ("4",)))
+        self.assertEqual(self.router.lookup(["v1", "example", "4", "name"]),
+                         ("exampleField", ("4", "name")))
+        self.assertEqual(self.router.lookup(["v1", "big-thing"]),
+                         ("thing", ("big",)))
+
+
+    def test_alternation(self):
+        """
+        Endpoints with a top-level alternation match like the old full-path
+        regexes did.
+        """
+        self.assertEqual(self.router.lookup(["v1", "this"]),
+                         ("alternation", ()))
+        self.assertEqual(self.router.lookup(["that"]),
+                         ("alternation", ()))
+        self.assertIs(self.router.lookup(["v1", "that"]), None)
+
+
+    def test_optionalTrailingSlash(self):
+        """
+        Endpoints that end in an optional slash match with or without it.
+        """
+        self.router.add(("v1", "planets/?"), "planets")
+        self.router.add(("v1", "moons/*"), "moons")
+
+        self.assertEqual(self.router.lookup(["v1", "planets"]),
+                         ("planets", ()))
+        self.assertEqual(self.router.lookup(["v1", "planets", ""]),
+                         ("planets", ()))
+        self.assertEqual(self.router.lookup(["v1", "moons", "", ""]),
+                         ("moons", ()))
+        self.assertIs(self.router.lookup(["v1", "planets", "", ""]), None)
+
+
+    def test_dynamicAtEnd(self):
+        """
+        Patterns that can match nothing are tried when the whole path is
+        literal.
+        """
+        self.router.add(("v1", "other/(x)?"), "optional")
+
+        self.assertEqual(self.router.lookup(["v1", "other", "x"]),
+                         ("optional", ("x",)))
+        self.assertEqual(self.router.lookup(["v1", "other"]),
+                         ("optional", (None,)))
+
+
+    def test_missing(self):
+        """
+        Paths that match nothing return C{None}.
+        """
+        self.assertIs(self.router.lookup(["v1", "nowhere"]), None)
+        self.assertIs(self.router.lookup(["v1", "example", "abc"]), None)
+        self.assertIs(self.router.lookup(["v2", "example"]), None)
+        self.assertIs(self.router.lookup([]), None)
+
+        # Only part of a literal endpoint
+        self.router.add(("v1", "deep/down"), "deep")
+        self.assertIs(self.router.lookup(["v1", "deep"]), None)
+
+
+    def test_cached(self):
+        """
+        Resolved paths are cached, and adding a route clears the cache.
+        """
+        self.router.lookup(["v1", "example", "4"])
+        self.assertIn("v1/example/4", self.router._cache)
+
+        self.router.add(("v1", "example/4"), "four")
+        self.assertNotIn("v1/example/4", self.router._cache)
+        self.assertEqual(self.router.lookup(["v1", "example", "4"]),
+                         ("four", ()))
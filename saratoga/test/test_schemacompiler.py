@@ -0,0 +1,116 @@
+from twisted.trial.unittest import TestCase
+
+from saratoga.schemacompiler import (
+    compileSchema, formatErrors, UnsupportedSchema)
+from saratoga.validation import JSONSchemaValidator
+
+
+# Pairs of a schema, and instances to check against it.
+cases = [
+    ({"type": "object"}, [{}, [], "a", None]),
+    ({"type": ["string", "null"]}, ["a", u"b", None, 1]),
+    ({"type": "integer"}, [1, 1L, 1.5, True]),
+    ({"type": "number"}, [1, 1.5, False, "1"]),
+    ({"type": "boolean"}, [True, 0]),
+    ({"type": "array"}, [[], {}]),
+    ({"enum": [1, "a", None]}, [1, "a", None, 2, [1]]),
+    ({"minimum": 2, "maximum": 5}, [1, 2, 5, 6, "x", True]),
+    ({"minimum": 2, "exclusiveMinimum": True,
+      "maximum": 5, "exclusiveMaximum": True}, [2, 3, 5]),
+    ({"multipleOf": 3}, [9, 10, "a"]),
+    ({"multipleOf": 0.5}, [1.5, 1.25]),
+    ({"minLength": 2, "maxLength": 3}, ["a", "ab", "abcd", 1]),
+    ({"minItems": 1, "maxItems": 2}, [[], [1], [1, 2, 3]]),
+    ({"minProperties": 1, "maxProperties": 1}, [{}, {"a": 1},
+                                                 {"a": 1, "b": 2}]),
+    ({"uniqueItems": True}, [[1, 2], [1, 1], [1, True], [{}, {}]]),
+    ({"uniqueItems": False}, [[1, 1]]),
+    ({"pattern": "^a+$"}, ["aaa", "ab", 1]),
+    ({"properties": {"hello": {}, "goodbye": {}, "the": {}},
+      "additionalProperties": False,
+      "required": ["hello", "goodbye"]},
+     [{}, {"hello": 1, "goodbye": 2}, {"hello": 1, "goodbye": 2, "x": 3},
+      {"x": 1, "y": 2, "z": 3}, []]),
+    ({"properties": {"a": {"type": "string"},
+                     "b": {"properties": {"c": {"type": "integer"}},
+                           "required": ["d"]}}},
+     [{"a": 1, "b": {"c": "x"}}, {"a": "x", "b": {"c": 1, "d": 1}},
+      {"b": 1}]),
+    ({"additionalProperties": {"type": "integer"}},
+     [{"a": 1, "b": "x", "c": "y"}]),
+    ({"additionalProperties": True}, [{"a": 1}]),
+    ({"additionalProperties": {}}, [{"a": 1}]),
+    ({"items": {"type": "string", "minLength": 2}},
+     [["ab", "c", 1], ["ab"], "ab"]),
+    ({"items": [{"type": "string"}, {"type": "integer"}]},
+     [["a", 1], [1, "a"], [1], ["a", 1, None]]),
+    ({"items": {}}, [[1]]),
+    ({"allOf": [{"type": "integer"}, {"minimum": 3}]}, [1, 3, "x"]),
+    ({"anyOf": [{"type": "integer"}, {"type": "null"}]}, [1, None, "x"]),
+    ({"not": {"type": "string"}}, [1, "x"]),
+    ({"required": []}, [{}]),
+    ({"properties": {}}, [{}]),
+    ({"format": "email", "title": "Ignored", "unknownKeyword": 1}, ["a"]),
+]
+
+
+
+class CompiledSchemaTests(TestCase):
+
+    def test_matchesJSONSchema(self):
+        """
+        Compiled schemas give exactly the same messages as jsonschema.
+        """
+        for schema, instances in cases:
+            validate = compileSchema(schema)
+            reference = JSONSchemaValidator(schema)
+
+            for instance in instances:
+                errors = validate(instance, [])
+                message = formatErrors(errors) if errors else None
+                self.assertEqual(
+                    message, reference.check(instance),
+                    "{!r} against {!r}".format(instance, schema))
+
+
+    def test_enumBooleans(self):
+        """
+        Like jsonschema 3, C{enum} doesn't treat C{True} and C{False} as
+        equal to 1 and 0.
+        """
+        for enum, valid, invalid in [
+                ([1], [1, 1.0], [True]),
+                ([0], [0, 0.0], [False]),
+                ([False], [False], [0, 0.0]),
+                ([True, 0], [True, 0], [1, False]),
+                ([[1], "a"], [[1], "a"], [2, "b"])]:
+            validate = compileSchema({"enum": enum})
+
+            for instance in valid:
+                self.assertEqual(validate(instance, []), [],
+                                 "{!r} in {!r}".format(instance, enum))
+
+            for instance in invalid:
+                self.assertEqual(validate(instance, []), [
+                    ((), "{!r} is not one of {!r}".format(instance, enum))])
+
+
+    def test_paths(self):
+        """
+        Errors record the path to where they happened.
+        """
+        validate = compileSchema({
+            "properties": {"a": {"items": {"type": "string"}}}})
+
+        self.assertEqual(validate({"a": ["x", 1]}, []),
+                         [(("a", 1), "1 is not of type 'string'")])
+
+
+    def test_unsupported(self):
+        """
+        Schemas the compiler can't handle raise L{UnsupportedSchema}.
+        """
+        for schema in [{"$ref": "#"}, {"oneOf": []}, {"type": "any"},
+                       {"type": {"name": "x"}}, {"items": [1]},
+                       {"properties": {"a": {"patternProperties": {}}}}]:
+            self.assertRaises(UnsupportedSchema, compileSchema, schema)
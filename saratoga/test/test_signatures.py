@@ -0,0 +1,190 @@
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from saratoga import AuthenticationFailed, signatures
+from saratoga.signatures import (
+    Signature, SignatureVerifier, parseSignatureHeader)
+from saratoga.test.requestMock import requestMock
+
+import httpsig_cffi
+
+# The Date that requestMock gives every request
+REQUEST_DATE = 1388538061
+
+
+def signedRequest(secret="secret", headers=None, algorithm="hmac-sha256"):
+    """
+    Make a request to C{/test}, signed by C{httpsig_cffi}.
+    """
+    signer = httpsig_cffi.HeaderSigner("alice", secret, algorithm=algorithm,
+                                       headers=headers)
+    signed = signer.sign({"Date": "Tue, 01 Jan 2014 01:01:01 GMT",
+                          "Host": "localhost:8080"}, method="GET",
+                         path="/test")
+
+    request = requestMock("/test", headers={
+        x: [y] for x, y in signed.iteritems()})
+    return request, parseSignatureHeader(request.getHeader("Authorization"))
+
+
+
+class ParseSignatureHeaderTests(TestCase):
+
+    def test_parse(self):
+        self.assertEqual(
+            parseSignatureHeader(
+                'Signature keyId="alice",algorithm="HMAC-SHA256",'
+                'headers="(request-target) Date",signature="a,b="'),
+            Signature("alice", "hmac-sha256", ["(request-target)", "date"],
+                      "a,b="))
+
+
+    def test_defaults(self):
+        self.assertEqual(
+            parseSignatureHeader('Signature keyId="alice", signature="abc"'),
+            Signature("alice", "", ["date"], "abc"))
+
+
+    def test_lenient(self):
+        """
+        Values don't have to be quoted, and parameters without one are
+        ignored.
+        """
+        self.assertEqual(
+            parseSignatureHeader('Signature keyId=alice, extra, empty=, '
+                                 'signature="abc"'),
+            Signature("alice", "", ["date"], "abc"))
+
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, parseSignatureHeader,
+                          'Basic keyId="alice",signature="abc"')
+        self.assertRaises(ValueError, parseSignatureHeader,
+                          'Signature keyId="alice"')
+        self.assertRaises(ValueError, parseSignatureHeader, "Signature")
+
+
+
+class SignatureVerifierTests(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.clock.advance(REQUEST_DATE)
+
+
+    def test_valid(self):
+        """
+        Requests signed with the secret are verified, for every HMAC
+        algorithm and set of signed headers.
+        """
+        verifier = SignatureVerifier()
+
+        for algorithm in ["hmac-sha1", "hmac-sha256", "hmac-sha512"]:
+            for headers in [None, ["date", "host", "(request-target)"]]:
+                request, signature = signedRequest(
+                    headers=headers, algorithm=algorithm)
+                verifier.verify(signature, "secret", request)
+                verifier.verify(signature, u"secret", request)
+
+
+    def test_wrongSecret(self):
+        request, signature = signedRequest()
+
+        self.assertRaises(AuthenticationFailed, SignatureVerifier().verify,
+                          signature, "wrong", request)
+        self.assertRaises(AuthenticationFailed, SignatureVerifier().verify,
+                          signature, None, request)
+
+
+    def test_badSignature(self):
+        request, signature = signedRequest()
+
+        for bad in [signature._replace(signature="not base64!"),
+                    signature._replace(headers=["date", "x-missing"]),
+                    signature._replace(headers=["host"])]:
+            self.assertRaises(AuthenticationFailed,
+                              SignatureVerifier().verify,
+                              bad, "secret", request)
+
+
+    def test_otherAlgorithms(self):
+        """
+        Algorithms other than HMAC are left to C{httpsig_cffi}.
+        """
+        checked = []
+
+        def verify(secret, request):
+            checked.append((secret, request))
+            return True
+
+        self.patch(signatures, "_verifyWithHTTPSig", verify)
+        request, signature = signedRequest()
+
+        SignatureVerifier().verify(
+            signature._replace(algorithm="rsa-sha256"), "key", request)
+        self.assertEqual(checked, [("key", request)])
+
+
+    def test_keyedStateReused(self):
+        """
+        The HMAC state for a secret is only made once.
+        """
+        verifier = SignatureVerifier()
+        request, signature = signedRequest()
+
+        verifier.verify(signature, "secret", request)
+        keyed = verifier._keys.get(("hmac-sha256", "secret"))
+        verifier.verify(signature, "secret", request)
+
+        self.assertIs(verifier._keys.get(("hmac-sha256", "secret")), keyed)
+
+
+    def test_staleDate(self):
+        """
+        Requests with dates too far from now are rejected without checking
+        their signatures.
+        """
+        verifier = SignatureVerifier(maxClockSkew=300, clock=self.clock)
+        verifier._checkSignature = lambda *args: self.fail("Checked.")
+        request, signature = signedRequest()
+
+        for offset in [301, -301]:
+            self.clock.advance(offset)
+            e = self.assertRaises(AuthenticationFailed, verifier.verify,
+                                  signature, "secret", request)
+            self.assertEqual(e.message, "Request date is out of range.")
+            self.clock.advance(-offset)
+
+        request.requestHeaders.setRawHeaders("Date", ["yesterday"])
+        self.assertRaises(AuthenticationFailed, verifier.verify,
+                          signature, "secret", request)
+
+
+    def test_replay(self):
+        """
+        A signature can only be used once, while its date is in range.
+        """
+        verifier = SignatureVerifier(maxClockSkew=300, replayCacheSize=10,
+                                     clock=self.clock)
+        request, signature = signedRequest()
+
+        verifier.verify(signature, "secret", request)
+        e = self.assertRaises(AuthenticationFailed, verifier.verify,
+                              signature, "secret", request)
+        self.assertEqual(e.message, "Request has already been made.")
+
+        self.clock.advance(600)
+        self.assertEqual(len(verifier._seen), 1)
+        self.assertIs(verifier._seen.get(signature.signature), None)
+
+
+    def test_failedNotRemembered(self):
+        """
+        Signatures that aren't valid don't take up room in the replay cache.
+        """
+        verifier = SignatureVerifier(replayCacheSize=10)
+        request, signature = signedRequest()
+
+        self.assertRaises(AuthenticationFailed, verifier.verify,
+                          signature, "wrong", request)
+        verifier.verify(signature, "secret", request)
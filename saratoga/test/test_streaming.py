@@ -0,0 +1,307 @@
+from twisted.internet.defer import succeed
+from twisted.trial.unittest import TestCase
+
+from saratoga import BadResponseParams
+from saratoga.api import SaratogaAPI
+from saratoga.outputFormats import (
+    JSendJSONOutputFormat, JSendJSONStreamingOutputFormat)
+from saratoga.streaming import ChunkProducer, isStream
+from saratoga.test.requestMock import requestMock
+
+import json
+
+
+class StreamingAPIImpl(object):
+    class v1(object):
+        def numbers_GET(self, request, params):
+            return (x for x in xrange(params["params"].get("count", 3)))
+
+        def deferredNumbers_GET(self, request, params):
+            return succeed(iter([1, 2, 3]))
+
+        def validated_GET(self, request, params):
+            return iter([1, 2, 3])
+
+        wholeValidated_GET = numbers_GET
+
+        def broken_GET(self, request, params):
+            raise ValueError("Broken.")
+            yield
+
+
+StreamingAPIDef = {
+    "metadata": {"versions": [1]},
+    "endpoints": [
+        {
+            "endpoint": "numbers",
+            "getProcessors": [{"versions": [1]}]
+        },
+        {
+            "endpoint": "deferredNumbers",
+            "getProcessors": [{"versions": [1]}]
+        },
+        {
+            "endpoint": "broken",
+            "getProcessors": [{"versions": [1]}]
+        },
+        {
+            "endpoint": "validated",
+            "getProcessors": [{
+                "versions": [1],
+                "responseSchema": {
+                    "type": "array",
+                    "items": {"type": "integer", "maximum": 3}
+                }
+            }]
+        },
+        {
+            "endpoint": "wholeValidated",
+            "getProcessors": [{
+                "versions": [1],
+                "responseSchema": {
+                    "type": "array",
+                    "items": [{"type": "integer"}],
+                    "maxItems": 2
+                }
+            }]
+        }
+    ]
+}
+
+
+
+class StreamingAPITests(TestCase):
+
+    def setUp(self):
+        self.api = SaratogaAPI(StreamingAPIImpl, StreamingAPIDef)
+
+
+    def test_generator(self):
+        """
+        Handlers can return a generator, which is streamed as a JSend list.
+        """
+        def rendered(request):
+            self.assertEqual(request.code, 200)
+            self.assertEqual(request.getWrittenData(),
+                             JSendJSONOutputFormat("success", range(1000)))
+
+        return self.api.test("/v1/numbers", params={"count": 1000}
+                             ).addCallback(rendered)
+
+
+    def test_deferredIterator(self):
+        """
+        Handlers can return a Deferred that fires with an iterator.
+        """
+        def rendered(request):
+            self.assertEqual(json.loads(request.getWrittenData()),
+                             {"status": "success", "data": [1, 2, 3]})
+
+        return self.api.test("/v1/deferredNumbers").addCallback(rendered)
+
+
+    def test_errorBeforeFirstChunk(self):
+        """
+        If the iterator fails before anything has been sent, the client gets
+        the usual error response.
+        """
+        def rendered(request):
+            self.assertEqual(request.code, 500)
+            self.assertEqual(json.loads(request.getWrittenData()),
+                             {"status": "error",
+                              "data": "Internal server error."})
+            self.assertEqual(request.finishCount, 1)
+            self.assertEqual(len(self.flushLoggedErrors(ValueError)), 1)
+
+        return self.api.test("/v1/broken").addCallback(rendered)
+
+
+    def test_formatWithoutStreaming(self):
+        """
+        Output formats that can't stream get the whole list at once.
+        """
+        def rendered(request):
+            self.assertEqual(request.getWrittenData(),
+                             '{\n    "data": [\n        0,\n        1\n    ],'
+                             '\n    "status": "success"\n}')
+
+        return self.api.test(
+            "/v1/numbers", params={"count": 2},
+            headers={"Accept": ["application/debuggablejson"]}
+        ).addCallback(rendered)
+
+
+    def test_itemsValidated(self):
+        """
+        Items of streamed responses are checked against the items schema of
+        the response schema.
+        """
+        def rendered(request):
+            self.assertEqual(json.loads(request.getWrittenData()),
+                             {"status": "success", "data": [1, 2, 3]})
+
+        return self.api.test("/v1/validated").addCallback(rendered)
+
+
+    def test_wholeValidated(self):
+        """
+        Streamed responses whose schema checks more than each item on its
+        own are checked all at once, before any of them are sent.
+        """
+        timings = []
+
+        class Hook(object):
+            def requestTimed(self, method, version, endpoint, phases):
+                timings.append([name for name, duration in phases])
+
+        def valid(request):
+            self.assertEqual(json.loads(request.getWrittenData()),
+                             {"status": "success", "data": [0, 1]})
+            self.api.addTimingHook(Hook())
+            return self.api.test("/v1/wholeValidated", params={"count": 2})
+
+        def timed(request):
+            self.assertEqual(request.code, 200)
+            self.assertIn("validateResponse", timings[0])
+            return self.api.test("/v1/wholeValidated", params={"count": 3})
+
+        def invalid(request):
+            self.assertEqual(request.code, 500)
+            self.assertEqual(json.loads(request.getWrittenData()),
+                             {"status": "error",
+                              "data": "Internal server error."})
+            self.assertEqual(
+                len(self.flushLoggedErrors(BadResponseParams)), 1)
+
+        d = self.api.test("/v1/wholeValidated", params={"count": 2})
+        return d.addCallback(valid).addCallback(timed).addCallback(invalid)
+
+
+
+class JSendJSONStreamingOutputFormatTests(TestCase):
+
+    def test_sameAsJSendJSONOutputFormat(self):
+        """
+        The streamed output is byte for byte the same as the unstreamed one.
+        """
+        for data in [[], [1], [{"a": [1, 2]}, "b", None, 1.5]]:
+            self.assertEqual(
+                "".join(JSendJSONStreamingOutputFormat("success", iter(data))),
+                JSendJSONOutputFormat("success", data))
+
+
+
+class ChunkProducerTests(TestCase):
+
+    def test_isStream(self):
+        self.assertTrue(isStream(iter([])))
+        self.assertTrue(isStream(x for x in []))
+        self.assertFalse(isStream([]))
+        self.assertFalse(isStream({}))
+        self.assertFalse(isStream("abc"))
+
+
+    def test_chunks(self):
+        """
+        Strings are buffered up into chunks of at least C{chunkSize} before
+        being written, and the request is finished at the end.
+        """
+        request = requestMock("/")
+        producer = ChunkProducer(request, ["ab", "cd", "ef", "g"],
+                                 chunkSize=4)
+        d = producer.start()
+
+        producer.resumeProducing()
+        self.assertEqual(request.getWrittenData(), "abcd")
+        self.assertEqual(request.finishCount, 0)
+
+        producer.resumeProducing()
+        self.assertEqual(request.getWrittenData(), "abcdefg")
+        self.assertEqual(request.finishCount, 1)
+        self.assertIs(request.producer, None)
+        self.assertIs(self.successResultOf(d), None)
+
+
+    def test_errorLosesConnection(self):
+        """
+        An error after some of the response has been written is logged, and
+        the connection is dropped without finishing the response.
+        """
+        def broken():
+            yield "abc"
+            raise BadResponseParams("Bad item")
+
+        request = requestMock("/")
+        request.loseConnection = lambda: setattr(request, "lost", True)
+        producer = ChunkProducer(request, broken(), chunkSize=1)
+        d = producer.start()
+
+        producer.resumeProducing()
+        producer.resumeProducing()
+
+        self.assertEqual(request.getWrittenData(), "abc")
+        self.assertTrue(request.lost)
+        self.assertEqual(request.finishCount, 0)
+        self.assertIs(self.successResultOf(d), None)
+        self.assertEqual(len(self.flushLoggedErrors(BadResponseParams)), 1)
+
+
+    def test_errorBeforeWriting(self):
+        """
+        An error before anything has been written fails the L{Deferred}, and
+        leaves the request alone.
+        """
+        def broken():
+            yield "abc"
+            raise BadResponseParams("Bad item")
+
+        request = requestMock("/")
+        producer = ChunkProducer(request, broken())
+        d = producer.start()
+
+        producer.resumeProducing()
+
+        self.failureResultOf(d, BadResponseParams)
+        self.assertEqual(request.getWrittenData(), "")
+        self.assertEqual(request.finishCount, 0)
+        self.assertIs(request.producer, None)
+
+
+    def test_stopProducing(self):
+        """
+        If the connection goes away, the iterator is closed.
+        """
+        closed = []
+
+        def chunks():
+            try:
+                yield "abc"
+                yield "def"
+            finally:
+                closed.append(True)
+
+        request = requestMock("/")
+        producer = ChunkProducer(request, chunks(), chunkSize=1)
+        d = producer.start()
+
+        producer.resumeProducing()
+        producer.stopProducing()
+
+        self.assertEqual(closed, [True])
+        self.assertEqual(request.finishCount, 0)
+        self.assertIs(self.successResultOf(d), None)
+
+
+    def test_stopProducingUnclosable(self):
+        """
+        Iterators without a C{close} are just abandoned.
+        """
+        request = requestMock("/")
+        producer = ChunkProducer(request, ["abc", "def"], chunkSize=1)
+        d = producer.start()
+
+        producer.resumeProducing()
+        producer.stopProducing()
+
+        self.assertEqual(request.finishCount, 0)
+        self.assertIs(self.successResultOf(d), None)
@@ -0,0 +1,271 @@
+import json
+import threading
+
+from twisted.internet import reactor
+from twisted.internet.defer import gatherResults
+from twisted.trial.unittest import TestCase
+
+from saratoga.api import SaratogaAPI
+from saratoga.metrics import Metrics
+from saratoga.threadpools import BlockingPool
+
+
+class BlockingAPIImpl(object):
+    class v1(object):
+        def blocking_GET(self, request, params):
+            self.threads.append(threading.current_thread().name)
+            self.release.wait(10)
+            return {"thread": self.threads[-1]}
+
+        def reports_GET(self, request, params):
+            return {"thread": threading.current_thread().name}
+
+        def fast_GET(self, request, params):
+            return {"thread": threading.current_thread().name}
+
+        def broken_GET(self, request, params):
+            raise ValueError("Oh no")
+
+
+
+class BlockingServiceClass(object):
+
+    def __init__(self):
+        self.threads = []
+        self.release = threading.Event()
+
+
+
+BlockingAPIDef = {
+    "metadata": {"versions": [1]},
+    "endpoints": [
+        {"endpoint": "blocking", "getProcessors": [
+            {"versions": [1], "blocking": True}]},
+        {"endpoint": "reports", "getProcessors": [
+            {"versions": [1], "blocking": "reports"}]},
+        {"endpoint": "broken", "getProcessors": [
+            {"versions": [1], "blocking": True}]},
+        {"endpoint": "fast", "getProcessors": [{"versions": [1]}]}
+    ]
+}
+
+
+
+class ManualTimer(object):
+    """
+    A timer that is only moved on by tests, and can be read from any thread.
+    """
+    def __init__(self):
+        self.now = 0.0
+
+
+    def __call__(self):
+        return self.now
+
+
+
+class BlockingPoolTests(TestCase):
+
+    def setUp(self):
+        self.timer = ManualTimer()
+        self.pool = BlockingPool("test", 1, reactor=reactor,
+                                 timer=self.timer)
+        self.addCleanup(self.pool.stop)
+
+
+    def test_run(self):
+        """
+        Calls are run in one of the pool's threads, and their result is
+        given back in the reactor thread.
+        """
+        def call(x, y):
+            return threading.current_thread().name, x + y
+
+        reactorThread = threading.current_thread()
+        d = self.pool.run(call, 1, y=2)
+
+        def ran(result):
+            name, total = result
+            self.assertIn("saratoga-test", name)
+            self.assertEqual(total, 3)
+            self.assertIs(threading.current_thread(), reactorThread)
+
+        return d.addCallback(ran)
+
+
+    def test_defaultReactor(self):
+        """
+        Without a reactor, results are given back to the global one.
+        """
+        self.assertIs(BlockingPool("default").reactor, reactor)
+
+
+    def test_error(self):
+        """
+        Exceptions raised by calls fail the L{Deferred}.
+        """
+        def call():
+            raise ValueError("Oh no")
+
+        return self.assertFailure(self.pool.run(call), ValueError)
+
+
+    def test_accounting(self):
+        """
+        The pool keeps track of how long calls wait for a thread, and how
+        long they run for.
+        """
+        release = threading.Event()
+        started = threading.Event()
+
+        def slow():
+            started.set()
+            release.wait(10)
+            self.timer.now += 2
+
+        first = self.pool.run(slow)
+        started.wait(10)
+        self.timer.now = 1
+        second = self.pool.run(lambda: None)
+
+        self.assertEqual((self.pool.busy, self.pool.queued), (1, 1))
+        self.assertEqual(self.pool.utilisation, 1.0)
+        release.set()
+
+        def ran(_):
+            self.assertEqual((self.pool.busy, self.pool.queued), (0, 0))
+            # The first call ran from 0 until 3, and the second waited for
+            # it from 1
+            self.assertEqual(self.pool.busyTime, 3)
+            self.assertEqual(self.pool.queueWait.count, 2)
+            self.assertEqual(self.pool.queueWait.sum, 2)
+
+        return gatherResults([first, second]).addCallback(ran)
+
+
+    def test_stop(self):
+        """
+        Stopping the pool stops its threads, and removes its shutdown
+        trigger. It starts again if it's used again.
+        """
+        d = self.pool.run(lambda: 1)
+
+        def ran(_):
+            self.pool.stop()
+            self.assertIs(self.pool._pool, None)
+            self.assertIs(self.pool._shutdownTrigger, None)
+            return self.pool.run(lambda: 2)
+
+        d.addCallback(ran)
+        d.addCallback(self.assertEqual, 2)
+        return d
+
+
+
+class APIBlockingTests(TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+        self.serviceClass = BlockingServiceClass()
+        self.api = SaratogaAPI(BlockingAPIImpl, BlockingAPIDef,
+                               serviceClass=self.serviceClass,
+                               metrics=self.metrics,
+                               threadPools={"default": 2})
+
+        for pool in self.api.threadPools.values():
+            self.addCleanup(pool.stop)
+
+        # Don't leave the threads waiting if a test fails
+        self.addCleanup(self.serviceClass.release.set)
+
+
+    def test_pools(self):
+        """
+        C{blocking: true} uses the default pool, and a string names the pool
+        to use, which has the default size if it isn't given.
+        """
+        pools = self.api.threadPools
+        self.assertEqual(sorted(pools), ["default", "reports"])
+        self.assertEqual((pools["default"].size, pools["reports"].size),
+                         (2, 10))
+
+
+    def test_withoutMetrics(self):
+        """
+        Pools are made when the API has no metrics.
+        """
+        api = SaratogaAPI(BlockingAPIImpl, BlockingAPIDef,
+                          serviceClass=BlockingServiceClass())
+        self.assertEqual(sorted(api.threadPools), ["default", "reports"])
+
+
+    def test_doesNotBlock(self):
+        """
+        Blocking processors run in a thread, so other requests are handled
+        while they block.
+        """
+        blocked = self.api.test("/v1/blocking")
+
+        def fast(request):
+            self.assertEqual(request.code, 200)
+            self.assertEqual(
+                json.loads(request.getWrittenData())["data"]["thread"],
+                threading.current_thread().name)
+            self.assertNoResult(blocked)
+            self.serviceClass.release.set()
+            return blocked
+
+        def unblocked(request):
+            self.assertEqual(request.code, 200)
+            self.assertIn("saratoga-default", json.loads(
+                request.getWrittenData())["data"]["thread"])
+
+        d = self.api.test("/v1/fast").addCallback(fast)
+        return d.addCallback(unblocked)
+
+
+    def test_namedPool(self):
+        d = self.api.test("/v1/reports")
+
+        def rendered(request):
+            self.assertIn("saratoga-reports", json.loads(
+                request.getWrittenData())["data"]["thread"])
+
+        return d.addCallback(rendered)
+
+
+    def test_error(self):
+        """
+        Errors raised in the thread are handled like any other.
+        """
+        d = self.api.test("/v1/broken")
+
+        def rendered(request):
+            self.assertEqual(request.code, 500)
+            self.assertEqual(json.loads(request.getWrittenData())["status"],
+                             "error")
+            self.assertEqual(len(self.flushLoggedErrors(ValueError)), 1)
+
+        return d.addCallback(rendered)
+
+
+    def test_metrics(self):
+        """
+        The thread pools are reported in the metrics.
+        """
+        self.serviceClass.release.set()
+        d = self.api.test("/v1/blocking")
+
+        def rendered(_):
+            output = self.metrics.prometheus()
+            self.assertIn(
+                'saratoga_threadpool_queue_wait_seconds_count{pool="default"}'
+                ' 1', output)
+            self.assertIn('saratoga_threadpool_threads{pool="default"} 2',
+                          output)
+            self.assertIn('saratoga_threadpool_threads{pool="reports"} 10',
+                          output)
+            self.assertIn('saratoga_threadpool_busy_threads{pool="default"} '
+                          '0', output)
+
+        return d.addCallback(rendered)
@@ -0,0 +1,194 @@
+from twisted.internet.defer import Deferred
+from twisted.internet.task import Clock
+from twisted.python import log
+from twisted.trial.unittest import TestCase
+
+from saratoga.api import SaratogaAPI
+from saratoga.auth import (
+    DefaultAuthenticator, InMemoryStringSharedSecretSource)
+from saratoga.timing import (
+    RequestTimer, LogTimingSink, AggregatingTimingSink, reportTiming)
+
+
+class TimedAPIImpl(object):
+    class v1(object):
+        def timed_GET(self, request, params):
+            self.waiting = Deferred()
+            return self.waiting
+
+        def timed_POST(self, request, params):
+            raise ValueError("Oh no.")
+
+        def cached_GET(self, request, params):
+            return {}
+
+
+
+TimedAPIDef = {
+    "metadata": {"versions": [1]},
+    "endpoints": [{
+        "endpoint": "timed",
+        "getProcessors": [{
+            "versions": [1],
+            "requestSchema": {"type": "object"},
+            "responseSchema": {"type": "object"}
+        }],
+        "postProcessors": [{"versions": [1]}]
+    }, {
+        "endpoint": "cached",
+        "requiresAuthentication": True,
+        "getProcessors": [{"versions": [1], "cache": {"ttl": 60}}]
+    }]
+}
+
+
+
+class TimedServiceClass(object):
+
+    auth = DefaultAuthenticator(InMemoryStringSharedSecretSource([
+        {"username": "bob", "password": "pass"}]))
+
+
+
+class RecordingSink(object):
+
+    def __init__(self):
+        self.timed = []
+
+
+    def requestTimed(self, method, version, endpoint, phases):
+        self.timed.append((method, version, endpoint, phases))
+
+
+
+class RequestTimerTests(TestCase):
+
+    def test_mark(self):
+        clock = Clock()
+        timer = RequestTimer(clock)
+
+        clock.advance(1)
+        timer.mark("one")
+        clock.advance(2)
+        self.assertEqual(timer.markResult("result", "two"), "result")
+        timer.mark("three")
+
+        self.assertEqual(timer.phases, [("one", 1), ("two", 2),
+                                        ("three", 0)])
+
+
+
+class SinkTests(TestCase):
+
+    def test_log(self):
+        messages = []
+        log.addObserver(messages.append)
+        self.addCleanup(log.removeObserver, messages.append)
+
+        LogTimingSink().requestTimed("GET", 1, "example",
+                                     [("parse", 0.001), ("write", 0.0025)])
+
+        self.assertEqual(messages[0]["message"],
+                         ("GET v1 example: parse=1.000ms write=2.500ms",))
+
+
+    def test_aggregate(self):
+        sink = AggregatingTimingSink()
+        sink.requestTimed("GET", 1, "example", [("parse", 1), ("write", 2)])
+        sink.requestTimed("GET", 1, "example", [("parse", 3)])
+        sink.requestTimed("GET", 1, "example", [("parse", 2)])
+        sink.requestTimed("GET", None, None, [("route", 1)])
+
+        self.assertEqual(sink.summary(), {
+            ("GET", 1, "example"): {"parse": (3, 2.0, 3),
+                                    "write": (1, 2.0, 2)},
+            ("GET", None, None): {"route": (1, 1.0, 1)}})
+
+
+    def test_brokenHook(self):
+        """
+        A hook that raises doesn't stop the others from being called.
+        """
+        class Broken(object):
+            def requestTimed(self, *args):
+                raise RuntimeError("Broken.")
+
+        sink = RecordingSink()
+        reportTiming([Broken(), sink], "GET", 1, "example", [])
+
+        self.assertEqual(len(sink.timed), 1)
+        self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+
+
+
+class APITimingTests(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.api = SaratogaAPI(TimedAPIImpl, TimedAPIDef, TimedServiceClass(),
+                               reactor=self.clock)
+        self.sink = RecordingSink()
+        self.api.addTimingHook(self.sink)
+
+
+    def test_phases(self):
+        """
+        Every phase that a request goes through is timed.
+        """
+        d = self.api.test("/v1/timed")
+        self.clock.advance(2)
+        self.api.serviceClass.waiting.callback({})
+
+        def rendered(_):
+            [(method, version, endpoint, phases)] = self.sink.timed
+            self.assertEqual((method, version, endpoint), ("GET", 1, "timed"))
+            self.assertEqual(phases, [
+                ("negotiate", 0), ("route", 0), ("parse", 0),
+                ("validateRequest", 0), ("implementation", 2),
+                ("validateResponse", 0), ("serialise", 0), ("write", 0)])
+
+        return d.addCallback(rendered)
+
+
+    def test_authenticatedAndCached(self):
+        """
+        Authenticating and looking in the cache are timed, including for
+        responses served from the cache.
+        """
+        headers = {"Authorization": ["Basic {}".format(
+            "bob:pass".encode("base64").strip())]}
+        d = self.api.test("/v1/cached", headers=headers)
+        d.addCallback(lambda _: self.api.test("/v1/cached", headers=headers))
+
+        def rendered(_):
+            self.assertEqual([[phase for phase, t in timed[3]]
+                              for timed in self.sink.timed], [
+                ["negotiate", "route", "parse", "auth", "cache",
+                 "implementation", "serialise", "write"],
+                ["negotiate", "route", "parse", "auth", "cache", "write"]])
+
+        return d.addCallback(rendered)
+
+
+    def test_error(self):
+        d = self.api.test("/v1/timed", method="POST")
+
+        def rendered(_):
+            self.assertEqual([phase for phase, t in self.sink.timed[0][3]],
+                             ["negotiate", "route", "parse", "error",
+                              "write"])
+            self.flushLoggedErrors(ValueError)
+
+        return d.addCallback(rendered)
+
+
+    def test_removeTimingHook(self):
+        self.api.removeTimingHook(self.sink)
+
+        d = self.api.test("/v1/timed", method="POST")
+
+        def rendered(_):
+            self.assertEqual(self.sink.timed, [])
+            self.flushLoggedErrors(ValueError)
+
+        return d.addCallback(rendered)
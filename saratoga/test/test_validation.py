@@ -0,0 +1,121 @@
+from twisted.trial.unittest import TestCase
+
+from saratoga import BadResponseParams
+from saratoga.validation import (
+    JSONSchemaValidator, CompiledValidator, checkItems)
+
+
+class JSONSchemaValidatorTests(TestCase):
+
+    def setUp(self):
+        self.validator = JSONSchemaValidator({
+            "properties": {
+                "hello": {"type": "string"},
+                "goodbye": {}
+            },
+            "required": ["hello", "goodbye"]
+        })
+
+
+    def test_valid(self):
+        """
+        Valid instances give no errors.
+        """
+        self.assertIs(
+            self.validator.check({"hello": "yes", "goodbye": "no"}), None)
+
+
+    def test_invalid(self):
+        """
+        Invalid instances give every error, sorted by path.
+        """
+        self.assertEqual(
+            self.validator.check({"hello": 1}),
+            "'goodbye' is a required property, 1 is not of type 'string'")
+
+
+
+class CompiledValidatorTests(TestCase):
+
+    def test_compiled(self):
+        """
+        Schemas that can be compiled are checked by generated code.
+        """
+        validator = CompiledValidator({"required": ["hello"]})
+
+        self.assertIs(validator._fallback, None)
+        self.assertIs(validator.check({"hello": 1}), None)
+        self.assertEqual(validator.check({}),
+                         "'hello' is a required property")
+
+
+    def test_fallback(self):
+        """
+        Schemas that can't be compiled are checked by jsonschema instead.
+        """
+        validator = CompiledValidator({
+            "definitions": {"name": {"type": "string"}},
+            "properties": {"hello": {"$ref": "#/definitions/name"}}})
+
+        self.assertIsInstance(validator._fallback, JSONSchemaValidator)
+        self.assertIs(validator.check({"hello": "there"}), None)
+        self.assertEqual(validator.check({"hello": 1}),
+                         "1 is not of type 'string'")
+
+
+
+class ItemsValidationTests(TestCase):
+
+    def test_forItems(self):
+        """
+        Validators can give a validator of the same kind for the schema of
+        their array items, which is only made once.
+        """
+        for engine in [JSONSchemaValidator, CompiledValidator]:
+            validator = engine({"type": "array",
+                                "items": {"type": "integer"}})
+            items = validator.forItems()
+
+            self.assertIsInstance(items, engine)
+            self.assertIs(validator.forItems(), items)
+            self.assertEqual(items.check("a"), "'a' is not of type 'integer'")
+
+
+    def test_forItemsRefs(self):
+        """
+        Item schemas can refer to definitions in the whole schema.
+        """
+        for engine in [JSONSchemaValidator, CompiledValidator]:
+            validator = engine({
+                "definitions": {"name": {"type": "string"}},
+                "items": {"$ref": "#/definitions/name"}})
+
+            self.assertEqual(validator.forItems().check(1),
+                             "1 is not of type 'string'")
+
+
+    def test_forItemsNoItems(self):
+        """
+        Schemas without a single items schema, or that check more than each
+        item on its own, give C{None}.
+        """
+        self.assertIs(JSONSchemaValidator({}).forItems(), None)
+        self.assertIs(
+            CompiledValidator({"items": [{}, {}]}).forItems(), None)
+        self.assertIs(CompiledValidator(
+            {"items": {}, "maxItems": 2}).forItems(), None)
+        self.assertIs(JSONSchemaValidator(
+            {"type": "object", "items": {}}).forItems(), None)
+
+
+    def test_checkItems(self):
+        """
+        L{checkItems} checks items as they are iterated over.
+        """
+        items = checkItems(iter([1, 2, "a"]),
+                           CompiledValidator({"type": "integer"}))
+
+        self.assertEqual(next(items), 1)
+        self.assertEqual(next(items), 2)
+        e = self.assertRaises(BadResponseParams, next, items)
+        self.assertEqual(e.message, "'a' is not of type 'integer'")
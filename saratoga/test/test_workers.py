@@ -0,0 +1,315 @@
+from twisted.internet.error import (
+    ProcessDone, ProcessExitedAlready, ConnectionDone)
+from twisted.internet.task import Clock
+from twisted.python import log
+from twisted.python.failure import Failure
+from twisted.trial.unittest import TestCase, SkipTest
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+from twisted.web.test.requesthelper import DummyChannel
+
+from saratoga.workers import (
+    listeningSocket, isWorker, listenAsWorker, WorkerSupervisor,
+    WORKER_FD, WORKER_PORT)
+
+import itertools
+import socket
+
+
+class FakeProcess(object):
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.signals = []
+        self.exited = False
+
+    def signalProcess(self, signal):
+        if self.exited:
+            raise ProcessExitedAlready()
+        self.signals.append(signal)
+
+
+
+class FakePort(object):
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.listening = True
+
+    def stopListening(self):
+        self.listening = False
+
+
+
+class FakeReactor(Clock):
+
+    def __init__(self):
+        Clock.__init__(self)
+        self.spawned = []
+        self.triggers = []
+        self.adopted = []
+        self._pids = itertools.count(100)
+
+    def spawnProcess(self, protocol, executable, args, env, childFDs):
+        process = FakeProcess(next(self._pids))
+        self.spawned.append((protocol, process, args, env, childFDs))
+        return process
+
+    def addSystemEventTrigger(self, phase, event, func):
+        self.triggers.append((phase, event, func))
+        return len(self.triggers)
+
+    def adoptStreamPort(self, fd, family, factory):
+        self.adopted.append((fd, family, factory))
+        return FakePort(fd)
+
+    def end(self, index):
+        protocol, process = self.spawned[index][:2]
+        process.exited = True
+        process.pid = None
+        protocol.processEnded(Failure(ProcessDone(0)))
+
+
+
+class ListeningSocketTests(TestCase):
+
+    def test_listening(self):
+        """
+        L{listeningSocket} gives a non-blocking socket that accepts
+        connections.
+        """
+        sock = listeningSocket(0, "127.0.0.1")
+        self.addCleanup(sock.close)
+
+        self.assertEqual(sock.gettimeout(), 0.0)
+
+        client = socket.create_connection(sock.getsockname())
+        self.addCleanup(client.close)
+
+
+    def test_reusePort(self):
+        """
+        With C{reusePort}, several sockets can listen on the same port.
+        """
+        if not hasattr(socket, "SO_REUSEPORT"):
+            raise SkipTest("No SO_REUSEPORT on this platform.")
+
+        first = listeningSocket(0, "127.0.0.1", reusePort=True)
+        self.addCleanup(first.close)
+        second = listeningSocket(first.getsockname()[1], "127.0.0.1",
+                                 reusePort=True)
+        self.addCleanup(second.close)
+
+        self.assertEqual(first.getsockname(), second.getsockname())
+
+
+    def test_noReusePort(self):
+        """
+        Asking for C{reusePort} where there's no C{SO_REUSEPORT} is an error.
+        """
+        if hasattr(socket, "SO_REUSEPORT"):
+            reusePort = socket.SO_REUSEPORT
+            del socket.SO_REUSEPORT
+            self.addCleanup(setattr, socket, "SO_REUSEPORT", reusePort)
+
+        self.assertRaises(Exception, listeningSocket, 0, "127.0.0.1",
+                          reusePort=True)
+
+
+
+class WorkerTests(TestCase):
+
+    def test_isWorker(self):
+        self.assertFalse(isWorker({}))
+        self.assertTrue(isWorker({WORKER_FD: "3"}))
+        self.assertTrue(isWorker({WORKER_PORT: "8080"}))
+
+
+    def test_listenOnInheritedSocket(self):
+        """
+        Workers given a file descriptor adopt it.
+        """
+        reactor = FakeReactor()
+        factory = Site(Resource())
+
+        listenAsWorker(reactor, factory, {WORKER_FD: "7"})
+        self.assertEqual(reactor.adopted, [(7, socket.AF_INET, factory)])
+
+
+    def test_listenOnOwnSocket(self):
+        """
+        Workers given a port open their own socket on it.
+        """
+        if not hasattr(socket, "SO_REUSEPORT"):
+            raise SkipTest("No SO_REUSEPORT on this platform.")
+
+        reactor = FakeReactor()
+        listenAsWorker(reactor, Site(Resource()), {WORKER_PORT: "0"})
+        self.assertEqual(len(reactor.adopted), 1)
+
+
+    def test_stopWhenFinished(self):
+        """
+        When the reactor stops, workers stop listening, and wait for the
+        requests they're handling to finish or be lost.
+        """
+        reactor = FakeReactor()
+        factory = Site(Resource())
+        port = listenAsWorker(reactor, factory, {WORKER_FD: "7"})
+
+        finished = factory.requestFactory(DummyChannel())
+        finished.method = b"GET"
+        finished.finish()
+        lost = factory.requestFactory(DummyChannel())
+        running = factory.requestFactory(DummyChannel())
+
+        [(phase, event, drain)] = reactor.triggers
+        self.assertEqual((phase, event), ("before", "shutdown"))
+        d = drain()
+
+        self.assertFalse(port.listening)
+        lost.connectionLost(Failure(ConnectionDone()))
+        self.assertNoResult(d)
+
+        running.method = b"GET"
+        running.finish()
+        self.successResultOf(d)
+
+
+
+class WorkerSupervisorTests(TestCase):
+
+    def setUp(self):
+        self.reactor = FakeReactor()
+        self.supervisor = WorkerSupervisor(
+            self.reactor, 3, 0, shutdownTimeout=5, restartDelay=1,
+            argv=["service.py", "--flag"], executable="python")
+        self.supervisor.start()
+        self.addCleanup(self.closeSocket)
+
+
+    def closeSocket(self):
+        if self.supervisor._socket:
+            self.supervisor._socket.close()
+
+
+    def test_start(self):
+        """
+        Each worker runs the same program, and inherits the listening socket.
+        """
+        self.assertEqual(len(self.reactor.spawned), 3)
+        self.assertEqual(self.reactor.triggers,
+                         [("before", "shutdown", self.supervisor.stop)])
+
+        fd = self.supervisor._socket.fileno()
+
+        for protocol, process, args, env, childFDs in self.reactor.spawned:
+            self.assertEqual(args, ["python", "service.py", "--flag"])
+            self.assertEqual(env[WORKER_FD], str(fd))
+            self.assertEqual(childFDs, {0: 0, 1: 1, 2: 2, fd: fd})
+
+
+    def test_restart(self):
+        """
+        Workers that end are restarted after C{restartDelay}.
+        """
+        messages = []
+        log.addObserver(messages.append)
+        self.addCleanup(log.removeObserver, messages.append)
+
+        self.reactor.end(0)
+        self.assertTrue(
+            messages[0]["message"][0].startswith("Worker 100 ended ("))
+        self.assertEqual(len(self.supervisor.processes), 2)
+
+        self.reactor.advance(1)
+        self.assertEqual(len(self.supervisor.processes), 3)
+        self.assertEqual(len(self.reactor.spawned), 4)
+        self.assertEqual(self.supervisor.restarts, 1)
+
+
+    def test_noRestartWhileStopping(self):
+        """
+        Workers waiting to be restarted aren't once stopping has begun.
+        """
+        self.reactor.end(0)
+        self.supervisor.stop()
+        self.reactor.advance(1)
+        self.assertEqual(len(self.reactor.spawned), 3)
+
+
+    def test_stop(self):
+        """
+        Stopping asks every worker to stop, and fires once they all have,
+        without restarting them.
+        """
+        d = self.supervisor.stop()
+
+        for protocol, process in [x[:2] for x in self.reactor.spawned]:
+            self.assertEqual(process.signals, ["TERM"])
+
+        self.reactor.end(0)
+        self.reactor.end(1)
+        self.assertNoResult(d)
+        self.reactor.end(2)
+        self.successResultOf(d)
+
+        self.reactor.advance(10)
+        self.assertEqual(len(self.reactor.spawned), 3)
+        self.assertIs(self.supervisor._socket, None)
+
+
+    def test_stopKills(self):
+        """
+        Workers that haven't stopped after C{shutdownTimeout} are killed.
+        """
+        d = self.supervisor.stop()
+        self.reactor.end(0)
+        self.reactor.advance(5)
+
+        signals = [x[1].signals for x in self.reactor.spawned]
+        self.assertEqual(signals, [["TERM"], ["TERM", "KILL"],
+                                   ["TERM", "KILL"]])
+
+        self.reactor.end(1)
+        self.reactor.end(2)
+        self.successResultOf(d)
+
+
+    def test_stopExited(self):
+        """
+        Workers that have exited but not yet been reaped are skipped when
+        stopping.
+        """
+        self.reactor.spawned[0][1].exited = True
+        d = self.supervisor.stop()
+
+        signals = [x[1].signals for x in self.reactor.spawned]
+        self.assertEqual(signals, [[], ["TERM"], ["TERM"]])
+
+        for i in range(3):
+            self.reactor.end(i)
+        self.successResultOf(d)
+
+
+    def test_ownSockets(self):
+        """
+        With C{reusePort}, workers are told the port to open their own socket
+        on.
+        """
+        if not hasattr(socket, "SO_REUSEPORT"):
+            raise SkipTest("No SO_REUSEPORT on this platform.")
+
+        reactor = FakeReactor()
+        supervisor = WorkerSupervisor(reactor, 1, 0, reusePort=True)
+        supervisor.start()
+
+        protocol, process, args, env, childFDs = reactor.spawned[0]
+        self.assertEqual(env[WORKER_PORT], "0")
+        self.assertNotIn(WORKER_FD, env)
+        self.assertEqual(childFDs, {0: 0, 1: 1, 2: 2})
+
+        # There's no socket of its own to close when stopping
+        d = supervisor.stop()
+        reactor.end(0)
+        self.successResultOf(d)
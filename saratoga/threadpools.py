@@ -0,0 +1,127 @@
+"""
+Running blocking processors in thread pools, so that they don't stop the
+reactor from handling other requests while they wait on a database or the
+disk.
+"""
+
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.threadpool import ThreadPool
+
+from saratoga.metrics import Histogram, DEFAULT_BUCKETS
+
+from threading import Lock
+from timeit import default_timer
+
+DEFAULT_POOL_SIZE = 10
+
+
+class BlockingPool(object):
+    """
+    A sized pool of threads, which keeps track of how long calls wait for a
+    thread, and how busy its threads are.
+
+    The threads are started on the first call, and stopped when the reactor
+    shuts down, after the calls they are running have finished.
+
+    @ivar queued: How many calls are waiting for a thread.
+    @ivar busy: How many threads are running a call.
+    @ivar busyTime: How many seconds the threads have spent running calls,
+        in total.
+    @ivar queueWait: A L{Histogram} of how many seconds calls waited for a
+        thread.
+    """
+
+    def __init__(self, name, size=DEFAULT_POOL_SIZE, reactor=None,
+                 buckets=DEFAULT_BUCKETS, timer=default_timer):
+        """
+        @param size: The most threads to run at once.
+        @param reactor: The reactor to give the results back to. Defaults to
+            the global reactor.
+        """
+        if reactor is None:
+            from twisted.internet import reactor
+
+        self.name = name
+        self.size = size
+        self.reactor = reactor
+        self.timer = timer
+        self.queued = 0
+        self.busy = 0
+        self.busyTime = 0.0
+        self.queueWait = Histogram(tuple(buckets))
+        self._lock = Lock()
+        self._pool = None
+        self._shutdownTrigger = None
+
+
+    @property
+    def utilisation(self):
+        """
+        The fraction of the threads that are running a call.
+        """
+        return float(self.busy) / self.size
+
+
+    def start(self):
+        """
+        Start the pool, and stop it when the reactor shuts down.
+        """
+        if self._pool is not None:
+            return
+
+        self._pool = ThreadPool(0, self.size, "saratoga-{}".format(self.name))
+        self._pool.start()
+        self._shutdownTrigger = self.reactor.addSystemEventTrigger(
+            "during", "shutdown", self._stop)
+
+
+    def stop(self):
+        """
+        Stop the pool, waiting for the calls it is running to finish.
+        """
+        if self._shutdownTrigger is not None:
+            self.reactor.removeSystemEventTrigger(self._shutdownTrigger)
+        self._stop()
+
+
+    def _stop(self):
+        self._shutdownTrigger = None
+
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            pool.stop()
+
+
+    def run(self, f, *args, **kwargs):
+        """
+        Call C{f} with C{args} and C{kwargs} in one of the pool's threads.
+
+        @return: A L{Deferred} firing with what it returns, in the reactor
+            thread.
+        """
+        self.start()
+
+        with self._lock:
+            self.queued += 1
+
+        return deferToThreadPool(self.reactor, self._pool, self._call,
+                                 self.timer(), f, args, kwargs)
+
+
+    def _call(self, submitted, f, args, kwargs):
+
+        started = self.timer()
+
+        with self._lock:
+            self.queued -= 1
+            self.busy += 1
+            self.queueWait.observe(started - submitted)
+
+        try:
+            return f(*args, **kwargs)
+        finally:
+            finished = self.timer()
+
+            with self._lock:
+                self.busy -= 1
+                self.busyTime += finished - started
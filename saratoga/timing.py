@@ -0,0 +1,146 @@
+"""
+Timing how long each phase of handling a request takes.
+
+Timing hooks are added with L{saratoga.api.SaratogaAPI.addTimingHook}. When
+a request finishes, each hook's C{requestTimed} is called with the request's
+route and a list of C{(phase, seconds)}, in the order they happened. The
+phases are:
+
+  - C{negotiate}: Choosing the output format.
+  - C{route}: Finding the endpoint.
+  - C{parse}: Reading and parsing the request's params.
+  - C{validateRequest}: Checking the params against the request schema.
+  - C{auth}: Authenticating the request.
+  - C{cache}: Looking in the response cache.
+  - C{implementation}: Running the processor.
+  - C{validateResponse}: Checking the result against the response schema.
+  - C{serialise}: Turning the result into the output format.
+  - C{compress}: Compressing the response.
+  - C{error}: From the end of the last phase, to something going wrong.
+  - C{write}: Writing the response, until it has finished.
+
+Phases that a request doesn't go through are left out.
+"""
+
+from twisted.python import log
+
+
+class RequestTimer(object):
+    """
+    The phase timings of one request.
+    """
+    __slots__ = ["clock", "last", "phases"]
+
+    def __init__(self, clock):
+        """
+        @param clock: An C{IReactorTime} provider.
+        """
+        self.clock = clock
+        self.last = clock.seconds()
+        self.phases = []
+
+
+    def mark(self, phase):
+        """
+        Note that C{phase} has just finished.
+        """
+        now = self.clock.seconds()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+
+    def markResult(self, result, phase):
+        """
+        Like C{mark}, but as a Deferred callback.
+        """
+        self.mark(phase)
+        return result
+
+
+
+def reportTiming(hooks, method, version, endpoint, phases):
+    """
+    Give the timings of a request to every hook. Hooks that raise are logged,
+    and don't stop the others from being called.
+    """
+    for hook in hooks:
+        try:
+            hook.requestTimed(method, version, endpoint, phases)
+        except Exception:
+            log.err(None, "Error in timing hook {!r}".format(hook))
+
+
+
+class LogTimingSink(object):
+    """
+    Logs the phase timings of every request.
+    """
+
+    def requestTimed(self, method, version, endpoint, phases):
+        log.msg("{} v{} {}: {}".format(
+            method, version, endpoint, " ".join(
+                "{}={:.3f}ms".format(phase, seconds * 1000)
+                for phase, seconds in phases)))
+
+
+
+class PhaseStats(object):
+    """
+    How many times a phase happened, and how long it took in total and at
+    most.
+    """
+    __slots__ = ["count", "total", "max"]
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+
+class AggregatingTimingSink(object):
+    """
+    Adds up the phase timings of every request, for each route.
+
+    @ivar routes: A dict of C{(method, version, endpoint)} to a dict of phase
+        names to L{PhaseStats}.
+    """
+
+    def __init__(self):
+        self.routes = {}
+
+
+    def requestTimed(self, method, version, endpoint, phases):
+
+        key = (method, version, endpoint)
+        stats = self.routes.get(key)
+
+        if stats is None:
+            stats = self.routes[key] = {}
+
+        for phase, seconds in phases:
+            phaseStats = stats.get(phase)
+
+            if phaseStats is None:
+                phaseStats = stats[phase] = PhaseStats()
+
+            phaseStats.count += 1
+            phaseStats.total += seconds
+            if seconds > phaseStats.max:
+                phaseStats.max = seconds
+
+
+    def summary(self):
+        """
+        @return: A dict of routes to dicts of phase names to C{(count, mean
+            seconds, max seconds)}.
+        """
+        return {
+            route: {phase: (s.count, s.mean, s.max)
+                    for phase, s in stats.iteritems()}
+            for route, stats in self.routes.iteritems()}
@@ -0,0 +1,139 @@
+from jsonschema import Draft4Validator
+
+from saratoga import BadResponseParams
+from saratoga.schemacompiler import (
+    compileSchema, formatErrors, UnsupportedSchema)
+
+
+# Keywords that don't check anything about an array besides its items
+_itemsOnlyKeywords = frozenset(["type", "items", "definitions", "title",
+                                "description", "$schema", "id"])
+
+
+class _Validator(object):
+
+    _itemsValidator = None
+
+    def forItems(self):
+        """
+        Get a validator for the items of the arrays this schema describes.
+
+        @return: A validator of the same kind, or C{None} if the schema
+            doesn't have a single schema for its items, or checks more than
+            each item on its own (like C{maxItems}).
+        """
+        items = self.schema.get("items")
+
+        if not isinstance(items, dict) or \
+           self.schema.get("type", "array") != "array" or \
+           not _itemsOnlyKeywords.issuperset(self.schema):
+            return None
+
+        if self._itemsValidator is None:
+            self._itemsValidator = self.__class__(items, self.resolver)
+
+        return self._itemsValidator
+
+
+
+class JSONSchemaValidator(_Validator):
+    """
+    Checks instances against a JSON Schema, using jsonschema's
+    C{Draft4Validator}.
+
+    The validator (and its C{RefResolver}) is built once, so one of these can
+    be shared between every request and version that uses the schema.
+    """
+
+    def __init__(self, schema, resolver=None):
+        self.schema = schema
+        self._validator = Draft4Validator(schema, resolver=resolver)
+
+
+    @property
+    def resolver(self):
+        return self._validator.resolver
+
+
+    def check(self, instance):
+        """
+        Check C{instance} against the schema.
+
+        @return: C{None} if it is valid, otherwise a message made of every
+            error, sorted by where in the instance they occurred.
+        """
+        # is_valid stops at the first error, so valid instances (which is
+        # nearly all of them) don't pay for collecting and sorting errors.
+        if self._validator.is_valid(instance):
+            return None
+
+        errors = sorted(self._validator.iter_errors(instance),
+                        key=lambda e: e.path)
+        return ", ".join(e.message for e in errors)
+
+
+
+class CompiledValidator(_Validator):
+    """
+    Checks instances against a JSON Schema, using a function generated from
+    the schema by L{saratoga.schemacompiler}.
+
+    Schemas that can't be compiled are checked by a L{JSONSchemaValidator}
+    instead, so the results are the same either way.
+    """
+
+    def __init__(self, schema, resolver=None):
+        self.schema = schema
+
+        try:
+            self._validate = compileSchema(schema)
+            self._fallback = None
+        except UnsupportedSchema:
+            self._fallback = JSONSchemaValidator(schema, resolver)
+
+
+    @property
+    def resolver(self):
+        # Compiled schemas have no $refs, so only the fallback needs one.
+        return self._fallback.resolver if self._fallback else None
+
+
+    def check(self, instance):
+        """
+        Check C{instance} against the schema.
+
+        @return: C{None} if it is valid, otherwise a message made of every
+            error, sorted by where in the instance they occurred.
+        """
+        if self._fallback:
+            return self._fallback.check(instance)
+
+        errors = self._validate(instance, [])
+
+        if not errors:
+            return None
+
+        return formatErrors(errors)
+
+
+
+def checkItems(items, validator):
+    """
+    Check each of C{items} against C{validator}, as they are iterated over.
+
+    @raise BadResponseParams: When an item doesn't validate.
+    """
+    for item in items:
+        errors = validator.check(item)
+
+        if errors:
+            raise BadResponseParams(errors)
+
+        yield item
+
+
+
+engines = {
+    "jsonschema": JSONSchemaValidator,
+    "compiled": CompiledValidator
+}
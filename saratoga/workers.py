@@ -0,0 +1,264 @@
+"""
+Serving from several processes at once, so that a Saratoga service can use
+every core of a machine.
+
+The parent process opens the listening socket, and runs the same program
+again for each worker, handing it the socket. When the program gets to
+C{SaratogaAPI.run} in a worker, it serves from that socket rather than
+starting more workers. The parent supervises the workers, restarting any
+that die, and shutting them down when it is stopped. Workers that are asked
+to stop close their socket, and finish the requests they are handling
+before they do.
+"""
+
+from twisted.internet.defer import Deferred, DeferredList, maybeDeferred
+from twisted.internet.error import ProcessExitedAlready
+from twisted.internet.protocol import ProcessProtocol
+from twisted.python import log
+from twisted.web.iweb import INonQueuedRequestFactory
+
+from zope.interface import implementer
+
+import os
+import socket
+import sys
+
+# Set in the environment of workers.
+WORKER_FD = "SARATOGA_WORKER_FD"
+WORKER_PORT = "SARATOGA_WORKER_PORT"
+
+
+def listeningSocket(port, interface="", backlog=50, reusePort=False):
+    """
+    Make a non-blocking TCP socket listening on C{port}.
+
+    @param reusePort: Set C{SO_REUSEPORT}, so that several sockets can listen
+        on the same port and the kernel will balance connections between them.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+    if reusePort:
+        if not hasattr(socket, "SO_REUSEPORT"):
+            raise Exception("SO_REUSEPORT is not supported on this platform.")
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+    sock.bind((interface, port))
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+
+
+def isWorker(environ=os.environ):
+    """
+    Is this process a worker started by a L{WorkerSupervisor}?
+    """
+    return WORKER_FD in environ or WORKER_PORT in environ
+
+
+
+def listenAsWorker(reactor, factory, environ=os.environ):
+    """
+    Serve C{factory}, a L{twisted.web.server.Site}, on the socket given to
+    this worker by its supervisor. When the reactor is stopped, it stops
+    listening, and waits for the requests it's handling to finish first.
+    """
+    tracker = _RequestTracker(factory.requestFactory)
+    factory.requestFactory = tracker
+
+    if WORKER_PORT in environ:
+        sock = listeningSocket(int(environ[WORKER_PORT]), reusePort=True)
+        port = reactor.adoptStreamPort(sock.fileno(), socket.AF_INET, factory)
+        sock.close()
+    else:
+        port = reactor.adoptStreamPort(
+            int(environ[WORKER_FD]), socket.AF_INET, factory)
+
+    def _drain():
+        d = maybeDeferred(port.stopListening)
+        d.addCallback(lambda _: tracker.unfinished())
+        return d
+
+    reactor.addSystemEventTrigger("before", "shutdown", _drain)
+    return port
+
+
+
+@implementer(INonQueuedRequestFactory)
+class _RequestTracker(object):
+    """
+    Makes requests with C{requestFactory}, keeping the ones that haven't
+    finished.
+    """
+
+    def __init__(self, requestFactory):
+        self.requestFactory = requestFactory
+        self.requests = set()
+
+
+    def __call__(self, channel):
+        request = self.requestFactory(channel)
+        self.requests.add(request)
+        request.notifyFinish().addBoth(
+            lambda _: self.requests.discard(request))
+        return request
+
+
+    def unfinished(self):
+        """
+        @return: A L{Deferred} that fires when the requests that haven't
+            finished yet have, or have been lost.
+        """
+        return DeferredList(
+            [request.notifyFinish() for request in self.requests],
+            consumeErrors=True)
+
+
+
+class _WorkerProtocol(ProcessProtocol):
+
+    def __init__(self, supervisor):
+        self.supervisor = supervisor
+        self.ended = Deferred()
+        # The process forgets its pid once it has ended
+        self.pid = None
+
+
+    def processEnded(self, reason):
+        self.supervisor._workerEnded(self, reason)
+        self.ended.callback(None)
+
+
+
+class WorkerSupervisor(object):
+    """
+    Runs and supervises worker processes.
+    """
+
+    def __init__(self, reactor, workers, port, reusePort=False,
+                 shutdownTimeout=10, restartDelay=1, argv=None,
+                 executable=sys.executable):
+        """
+        @param port: The port to listen on.
+        @param reusePort: Have each worker listen on its own socket with
+            C{SO_REUSEPORT}, instead of sharing one opened by the supervisor.
+        @param shutdownTimeout: How long to let workers finish their requests
+            when stopping, before killing them.
+        @param restartDelay: How long to wait before restarting a worker that
+            died, so that a broken service doesn't restart as fast as it can.
+        @param argv: The arguments to run workers with, defaulting to the
+            ones this process was run with.
+        """
+        self.reactor = reactor
+        self.workers = workers
+        self.port = port
+        self.reusePort = reusePort
+        self.shutdownTimeout = shutdownTimeout
+        self.restartDelay = restartDelay
+        self.argv = argv if argv is not None else sys.argv
+        self.executable = executable
+
+        self.processes = {}
+        self.restarts = 0
+        self._socket = None
+        self._stopping = False
+
+
+    def start(self):
+        """
+        Start the workers, and stop them when the reactor shuts down.
+        """
+        if self.reusePort:
+            # Bind once here, so that errors (like the port being in use)
+            # come from here rather than from every worker.
+            listeningSocket(self.port, reusePort=True).close()
+        else:
+            self._socket = listeningSocket(self.port)
+
+        self.reactor.addSystemEventTrigger("before", "shutdown", self.stop)
+
+        for x in range(self.workers):
+            self._spawn()
+
+
+    def _spawn(self):
+
+        env = dict(os.environ)
+        childFDs = {0: 0, 1: 1, 2: 2}
+
+        if self._socket:
+            fd = self._socket.fileno()
+            env[WORKER_FD] = str(fd)
+            childFDs[fd] = fd
+        else:
+            env[WORKER_PORT] = str(self.port)
+
+        protocol = _WorkerProtocol(self)
+        process = self.reactor.spawnProcess(
+            protocol, self.executable, [self.executable] + list(self.argv),
+            env=env, childFDs=childFDs)
+
+        self.processes[protocol] = process
+        protocol.pid = process.pid
+        log.msg("Started worker {}".format(process.pid))
+
+
+    def _workerEnded(self, protocol, reason):
+
+        del self.processes[protocol]
+
+        if self._stopping:
+            return
+
+        log.msg("Worker {} ended ({}), restarting".format(
+            protocol.pid, reason.getErrorMessage()))
+        self.restarts += 1
+        self.reactor.callLater(self.restartDelay, self._restart)
+
+
+    def _restart(self):
+        if not self._stopping:
+            self._spawn()
+
+
+    def stop(self):
+        """
+        Ask the workers to stop, and kill any that haven't after
+        C{shutdownTimeout}.
+
+        @return: A L{Deferred} that fires when all of the workers have ended.
+        """
+        self._stopping = True
+
+        ended = [protocol.ended for protocol in self.processes]
+
+        for process in self.processes.values():
+            _signal(process, "TERM")
+
+        kill = self.reactor.callLater(self.shutdownTimeout, self._kill)
+
+        def _stopped(_):
+            if kill.active():
+                kill.cancel()
+            if self._socket:
+                self._socket.close()
+                self._socket = None
+
+        return DeferredList(ended).addCallback(_stopped)
+
+
+    def _kill(self):
+        for process in self.processes.values():
+            _signal(process, "KILL")
+
+
+
+def _signal(process, signal):
+    """
+    Send C{signal} to C{process}, unless it's already gone.
+    """
+    try:
+        process.signalProcess(signal)
+    except ProcessExitedAlready:
+        pass